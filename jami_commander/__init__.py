@@ -1 +1,10 @@
 # from .jami_commander import main
+
+
+def __getattr__(name):
+    # imported on first use, so the command line program does not load it
+    if name == "JamiClient":
+        from .client import JamiClient
+
+        return JamiClient
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
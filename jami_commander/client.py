@@ -0,0 +1,306 @@
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+
+r"""client.py.
+
+Async Jami client for embedding jami-commander into Python programs,
+e.g. bots. Unlike main() it neither parses arguments nor prints
+anything nor touches the global state of the command line program.
+
+    import asyncio
+    from jami_commander import JamiClient
+
+    async def run():
+        async with JamiClient(account="mybot") as client:
+            convs = await client.conversations()
+            await client.send(convs, "Hello")
+            results = await client.send_file(convs[0], "pic.jpg", wait=True)
+
+    asyncio.run(run())
+
+"""
+
+import asyncio
+import os
+from typing import Union
+
+from .controller import (
+    libjamiCtrlAccountError,
+    libjamiCtrlAsync,
+    libjamiTransferTracker,
+)
+from .jami_commander import (
+    FORMAT_TEXT,
+    FORMATS,
+    PARALLEL_DEFAULT,
+    PROG_WITHOUT_EXT,
+    fan_out,
+    format_message,
+)
+
+
+def _as_list(conversations: Union[str, list]) -> list:
+    if isinstance(conversations, str):
+        return [conversations]
+    return list(conversations)
+
+
+class JamiClient:
+    """Async client to the jamid daemon.
+
+    One client keeps one DBUS connection with its account cache for all
+    its operations. Concurrent sends of one client share a limit of
+    `parallel` DBUS calls in flight. Use it as async context manager, or
+    call start() and close() yourself, from within the event loop.
+
+    Methods return plain Python values: str, bool, lists and dicts. Sends
+    return the result dicts of fan_out(), one per conversation and item.
+
+    Arguments:
+    ---------
+    account : accountid, alias or username of the account to use. If None,
+        the only enabled account is used. Each method accepts an account
+        argument to override it.
+    parallel : maximum number of concurrent DBUS calls of sends
+    name : client name announced to the daemon
+
+    """
+
+    def __init__(
+        self,
+        account: str = None,
+        parallel: int = PARALLEL_DEFAULT,
+        name: str = PROG_WITHOUT_EXT,
+    ):
+        self.account = account
+        self.parallel = parallel
+        self.name = name
+        self.ctrl = None
+        self.tracker = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self) -> None:
+        """Connect to the daemon."""
+        if self.ctrl is not None:
+            return
+        self.ctrl = libjamiCtrlAsync(name=self.name, autoAnswer=False)
+        self.ctrl.start()
+        self.semaphore = asyncio.Semaphore(max(1, self.parallel))
+
+    async def close(self) -> bool:
+        """Disconnect from the daemon.
+
+        Returns True if the DBUS thread stopped in time.
+        """
+        if self.ctrl is None:
+            return True
+        if self.tracker is not None:
+            await self.tracker.close()
+            self.tracker = None
+        stopped = await self.ctrl.close()
+        self.ctrl = None
+        return stopped
+
+    async def accounts(self) -> list:
+        """Return the enabled accounts.
+
+        Each account is a dict with keys "accountid", "alias" and
+        "username".
+        """
+        accounts = []
+        for acct in await self.ctrl.getAllEnabledAccounts():
+            details = await self.ctrl.getAccountDetails(acct)
+            accounts.append(
+                {
+                    "accountid": str(acct),
+                    "alias": str(details.get("Account.alias", "")),
+                    "username": str(details.get("Account.username", "")),
+                }
+            )
+        return accounts
+
+    async def resolve_account(self, account: str = None) -> str:
+        """Return the accountid of account, an id, alias or username.
+
+        If account is None the account of the client is used. Raises
+        libjamiCtrlAccountError if it does not match exactly one enabled
+        account. Served from the account cache of the controller.
+        """
+        if account is None:
+            account = self.account
+        accts = await self.ctrl.getAllEnabledAccounts()
+        if account is None:
+            if len(accts) != 1:
+                raise libjamiCtrlAccountError(
+                    f"{len(accts)} enabled accounts found. Cannot decide "
+                    f"which one to use. Valid accountids are {accts}."
+                )
+            acct = accts[0]
+        else:
+            acct = await self.ctrl.resolveAccount(account, accts)
+            if acct is None:
+                raise libjamiCtrlAccountError(
+                    f'Account "{account}" is not a valid accountid, alias '
+                    f"or username. Valid accountids are {accts}."
+                )
+        return str(acct)
+
+    async def send(
+        self,
+        conversations: Union[str, list],
+        message: str,
+        format: str = FORMAT_TEXT,
+        account: str = None,
+    ) -> list:
+        """Send a message to one or more conversations.
+
+        Arguments:
+        ---------
+        conversations : conversationid or list of conversationids
+        message : message text, empty messages are not sent
+        format : one of FORMATS, e.g. "markdown"
+        account : account to use instead of the one of the client
+
+        Returns the results of fan_out(), one per conversation.
+
+        """
+        if format not in FORMATS:
+            raise ValueError(f'Format "{format}" is not one of {FORMATS}.')
+        message = message.strip("\n")
+        if message.strip() == "":
+            return []
+        message, text = format_message(message, format)
+        item = {"type": "message", "message": message, "text": text}
+        return await self._fan_out(conversations, [item], account)
+
+    async def send_file(
+        self,
+        conversations: Union[str, list],
+        files: Union[str, list],
+        account: str = None,
+        wait: bool = False,
+        timeout: float = None,
+    ) -> list:
+        """Send one or more files to one or more conversations.
+
+        Arguments:
+        ---------
+        conversations : conversationid or list of conversationids
+        files : file name or list of file names
+        account : account to use instead of the one of the client
+        wait : wait until the file transfers finished, each result then
+            has its transfer record under key "transfer", see
+            libjamiTransferTracker.expect()
+        timeout : seconds to wait at most, None waits forever
+
+        Returns the results of fan_out(), one per conversation and file.
+        Raises FileNotFoundError if one of the files is not a file.
+
+        """
+        items = []
+        for file in _as_list(files):
+            if not os.path.isfile(file):
+                raise FileNotFoundError(f'File "{file}" is not a file.')
+            items.append(
+                {
+                    "type": "file",
+                    "file": file,
+                    "path": os.path.abspath(file),
+                    "name": os.path.basename(file),
+                }
+            )
+        if not wait:
+            return await self._fan_out(conversations, items, account)
+        if self.tracker is None:
+            # one tracker serves all sends of this client
+            self.tracker = libjamiTransferTracker(self.ctrl)
+            self.tracker.start()
+        results = await self._fan_out(
+            conversations, items, account, self.tracker
+        )
+        transfers = [r["transfer"] for r in results if "transfer" in r]
+        try:
+            await self.tracker.wait(transfers, timeout)
+        finally:
+            # also unfinished ones, so that a record still expected does
+            # not claim the transfer of the next send
+            for record in transfers:
+                self.tracker.forget(record)
+        return results
+
+    async def _fan_out(self, conversations, items, account, tracker=None):
+        return await fan_out(
+            self.ctrl,
+            await self.resolve_account(account),
+            _as_list(conversations),
+            items,
+            tracker=tracker,
+            semaphore=self.semaphore,
+        )
+
+    async def conversations(self, account: str = None) -> list:
+        """Return the conversationids of the account."""
+        account = await self.resolve_account(account)
+        return [str(c) for c in await self.ctrl.getConversations(account)]
+
+    async def members(self, conversation: str, account: str = None) -> list:
+        """Return the members of a conversation.
+
+        Each member is a dict with keys like "uri" (the userid), "role"
+        ("admin", "member", "invited" or "banned") and "lastDisplayed".
+        """
+        account = await self.resolve_account(account)
+        members = await self.ctrl.getConversationMembers(
+            account, conversation
+        )
+        return [{str(k): str(v) for k, v in m.items()} for m in members]
+
+    async def add_conversation(self, account: str = None) -> str:
+        """Create a swarm conversation, return its conversationid."""
+        account = await self.resolve_account(account)
+        return str(await self.ctrl.startConversation(account))
+
+    async def remove_conversation(
+        self, conversation: str, account: str = None
+    ) -> bool:
+        """Remove a conversation, return True on success."""
+        account = await self.resolve_account(account)
+        return bool(
+            await self.ctrl.removeConversation(account, conversation)
+        )
+
+    async def add_member(
+        self, conversation: str, member: str, account: str = None
+    ) -> None:
+        """Invite the user member to a conversation."""
+        account = await self.resolve_account(account)
+        await self.ctrl.addConversationMember(account, conversation, member)
+
+    async def remove_member(
+        self, conversation: str, member: str, account: str = None
+    ) -> None:
+        """Ban the user member from a conversation."""
+        account = await self.resolve_account(account)
+        await self.ctrl.removeConversationMember(
+            account, conversation, member
+        )
@@ -1,4 +1,7 @@
 from .controller import libjamiCtrl
+from .controllerAsync import libjamiCtrlAsync
+from .transferTracker import libjamiTransferTracker
+from .downloadPool import libjamiDownloadPool
 from .errorsDring import (
     libjamiCtrlAccountError,
     libjamiCtrlError,
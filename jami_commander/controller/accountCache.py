@@ -0,0 +1,150 @@
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+
+"""In-process cache of account metadata fetched from the daemon"""
+
+from threading import Lock
+
+ACCOUNT_LIST = "accountList"
+ACCOUNT_DETAILS = "accountDetails"
+VOLATILE_DETAILS = "volatileAccountDetails"
+
+
+def _copy(value):
+    # callers may modify what they get, e.g. setAccountEnable()
+    if isinstance(value, dict):
+        return dict(value)
+    return list(value)
+
+
+class libjamiAccountCache:
+    """Account list, account details and volatile account details
+
+    Entries stay valid until the daemon signals a change. The cache is
+    shared between the caller's thread and the GLib MainLoop thread
+    delivering the signals, hence every access is locked.
+
+    A fetch that started before an invalidation must not store its
+    (possibly outdated) result. So read generation before fetching and
+    hand it to put().
+
+    Additionally an index maps aliases and usernames to account ids. It is
+    built in one pass over the details of all accounts and dropped
+    whenever account details change.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = {
+            ACCOUNT_LIST: {},
+            ACCOUNT_DETAILS: {},
+            VOLATILE_DETAILS: {},
+        }
+        self.index = None  # {"alias": {...}, "username": {...}}
+
+    def get(self, kind, account=None):
+        """Return a copy of the cached value or None if not cached"""
+
+        with self.lock:
+            value = self.entries[kind].get(account)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return _copy(value)
+
+    def put(self, kind, value, account=None, generation=None):
+        """Store value unless the cache was invalidated since generation"""
+
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[kind][account] = _copy(value)
+
+    def fetch(self, kind, fetcher, account=None):
+        """Return cached value, on a miss get it by calling fetcher()"""
+
+        value = self.get(kind, account)
+        if value is None:
+            generation = self.generation
+            value = fetcher()
+            self.put(kind, value, account, generation)
+        return value
+
+    def invalidate(self):
+        """Forget everything, e.g. after accountsChanged"""
+
+        with self.lock:
+            self.generation += 1
+            self.index = None
+            for entries in self.entries.values():
+                entries.clear()
+
+    def invalidateAccount(self, account, kind=None):
+        """Forget the details (or only details of kind) of one account"""
+
+        with self.lock:
+            self.generation += 1
+            if kind != VOLATILE_DETAILS:
+                self.index = None
+            for k in (kind,) if kind else (ACCOUNT_DETAILS, VOLATILE_DETAILS):
+                self.entries[k].pop(account, None)
+
+    def update(self, kind, account, details):
+        """Merge details delivered by a signal into a cached entry"""
+
+        with self.lock:
+            self.generation += 1
+            if kind == ACCOUNT_DETAILS:
+                self.index = None
+            cached = self.entries[kind].get(account)
+            if cached is not None:
+                cached.update(details)
+
+    def getIndex(self):
+        """Return the alias and username index or None if not built"""
+
+        with self.lock:
+            return self.index
+
+    def putIndex(self, detailsByAccount, generation=None):
+        """Build the index from {accountId: details}, return the index
+
+        detailsByAccount must be ordered like the account list, so that
+        for ambiguous aliases the first matching account comes first.
+        """
+
+        index = {"alias": {}, "username": {}}
+        for account, details in detailsByAccount.items():
+            alias = details.get("Account.alias")
+            if alias:
+                index["alias"].setdefault(alias, []).append(account)
+            username = details.get("Account.username")
+            if username:
+                index["username"].setdefault(username, account)
+        with self.lock:
+            if generation is None or generation == self.generation:
+                self.index = index
+        return index
+
+    def stats(self):
+        """Return hit and miss counters"""
+
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
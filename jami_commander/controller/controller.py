@@ -30,11 +30,17 @@ import random
 import time
 import hashlib
 
-from threading import Thread
+from threading import Thread, current_thread
 from functools import partial
 from gi.repository import GLib
 
 # local
+from .accountCache import (
+    ACCOUNT_DETAILS,
+    ACCOUNT_LIST,
+    VOLATILE_DETAILS,
+    libjamiAccountCache,
+)
 from .errorsDring import (
     libjamiCtrlAccountError,
     libjamiCtrlError,
@@ -71,6 +77,13 @@ class libjamiCtrl(Thread):
 
         self.isStop = False
 
+        # callables invoked as listener(signalName, *args) for every
+        # DBus signal received, see addSignalListener()
+        self.signalListeners = []
+
+        # account list and details, valid until the daemon signals a change
+        self.accountCache = libjamiAccountCache()
+
         # Glib MainLoop for processing callbacks
         self.loop = GLib.MainLoop()
 
@@ -82,8 +95,33 @@ class libjamiCtrl(Thread):
         self.unregister()
         # self.loop.quit() # causes exception
 
-    def stopThread(self):
+    def startThread(self):
+        """Start processing DBus replies and signals in this thread"""
+
+        if not self.is_alive():
+            self.isStop = False
+            self.start()
+
+    def stopThread(self, timeout=None):
+        """Quit the GLib MainLoop and optionally wait for the thread
+
+        Safe to call from any thread, also before the loop runs. The quit
+        is queued into the loop itself, so it cannot get lost between
+        start() and MainLoop.run(). If timeout (in seconds) is given and
+        this is not the controller thread, wait up to timeout seconds for
+        the thread to end. Returns True if the thread is not running.
+        """
+
         self.isStop = True
+        if self.is_alive():
+            GLib.idle_add(self._quitLoop)
+            if timeout is not None and current_thread() is not self:
+                self.join(timeout)
+        return not self.is_alive()
+
+    def _quitLoop(self):
+        self.loop.quit()
+        return False  # run only once
 
     def register(self):
         if self.registered:
@@ -162,6 +200,16 @@ class libjamiCtrl(Thread):
             proxy_confmgr.connect_to_signal(
                 "accountsChanged", self.onAccountsChanged
             )
+            proxy_confmgr.connect_to_signal(
+                "accountDetailsChanged", self.onAccountDetailsChanged
+            )
+            proxy_confmgr.connect_to_signal(
+                "volatileAccountDetailsChanged",
+                self.onVolatileAccountDetailsChanged,
+            )
+            proxy_confmgr.connect_to_signal(
+                "registrationStateChanged", self.onRegistrationStateChanged
+            )
             proxy_confmgr.connect_to_signal(
                 "dataTransferEvent", self.onDataTransferEvent
             )
@@ -179,6 +227,12 @@ class libjamiCtrl(Thread):
             proxy_confmgr.connect_to_signal(
                 "messageReceived", self.onMessageReceived
             )
+            proxy_confmgr.connect_to_signal(
+                "swarmMessageReceived", self.onSwarmMessageReceived
+            )
+            proxy_confmgr.connect_to_signal(
+                "conversationLoaded", self.onConversationLoaded
+            )
             # Signal triggered when a log is done in the daemon.
             proxy_confmgr.connect_to_signal("messageSend", self.onMessageSend)
 
@@ -201,6 +255,25 @@ class libjamiCtrl(Thread):
     def isRegistered(self):
         return self.registered
 
+    def addSignalListener(self, listener):
+        """Register a callable that is called for every received signal
+
+        The listener is called as listener(signalName, *args) from the
+        thread running the GLib MainLoop. It must not block.
+        """
+
+        self.signalListeners.append(listener)
+
+    def removeSignalListener(self, listener):
+        """Unregister a callable previously added by addSignalListener()"""
+
+        if listener in self.signalListeners:
+            self.signalListeners.remove(listener)
+
+    def _emitSignal(self, signalName, *args):
+        for listener in list(self.signalListeners):
+            listener(signalName, *args)
+
     #
     # Signal handling
     #
@@ -243,6 +316,7 @@ class libjamiCtrl(Thread):
         self.activeCalls[callid] = {"Account": account, "To": to, "State": ""}
         self.currentCallId = callid
         self.onIncomingCall_cb(callid)
+        self._emitSignal("incomingCall", account, callid, to)
 
     def onCallHangUp(self, callid, state):
         """Remove callid from call list"""
@@ -345,6 +419,7 @@ class libjamiCtrl(Thread):
         else:
             print("unknown state:" + str(state))
         self.onCallStateChanged_cb(callid, state, code)
+        self._emitSignal("callStateChanged", callid, state, code)
 
     def onConferenceCreated_cb(self):
         pass
@@ -356,12 +431,16 @@ class libjamiCtrl(Thread):
         self.currentConfId = confId
         self.onConferenceCreated_cb()
         self.onConferenceCreated_callback(confId)
+        self._emitSignal("conferenceCreated", convId, confId)
 
     def onDataTransferEvent(self, account, conversationId, id, fileId, code):
-        pass
+        self._emitSignal(
+            "dataTransferEvent", account, conversationId, id, fileId, code
+        )
 
     def onConversationReady(self, account, conversationId):
         print(f"New conversation ready for {account} with id {conversationId}")
+        self._emitSignal("conversationReady", account, conversationId)
 
     def onConversationRequestReceived(
         self, account, conversationId, metadatas
@@ -369,6 +448,9 @@ class libjamiCtrl(Thread):
         print(
             f"New conversation request for {account} with id {conversationId}"
         )
+        self._emitSignal(
+            "conversationRequestReceived", account, conversationId, metadatas
+        )
 
     def onConversationPreferencesUpdated(
         self, account, conversationId, metadatas
@@ -376,16 +458,31 @@ class libjamiCtrl(Thread):
         print(
             f"New conversation preferences for {account} with id {conversationId}"
         )
+        self._emitSignal(
+            "conversationPreferencesUpdated",
+            account,
+            conversationId,
+            metadatas,
+        )
 
     def onMessageReceived(self, account, conversationId, message):
-        print(
-            f'New message for {account} in conversation {conversationId} with id {message["id"]}'
+        # no printing here, it would stall the GLib MainLoop when
+        # thousands of messages arrive, see --listen
+        self._emitSignal("messageReceived", account, conversationId, message)
+
+    def onSwarmMessageReceived(self, account, conversationId, message):
+        self._emitSignal(
+            "swarmMessageReceived", account, conversationId, message
+        )
+
+    def onConversationLoaded(self, id, account, conversationId, messages):
+        self._emitSignal(
+            "conversationLoaded", id, account, conversationId, messages
         )
-        for key in message:
-            print(f"\t {key}: {message[key]}")
 
     def onMessageSend(self, message):
         print(f"New message is logged by daemon: {message}")
+        self._emitSignal("messageSend", message)
 
     #
     # Account management
@@ -432,7 +529,10 @@ class libjamiCtrl(Thread):
     def getAllAccounts(self, account_type=None):
         """Return a list with all accounts"""
 
-        acclist = map(str, self.configurationmanager.getAccountList())
+        cm = self.configurationmanager
+        acclist = self.accountCache.fetch(
+            ACCOUNT_LIST, lambda: [str(x) for x in cm.getAccountList()]
+        )
         if account_type:
             acclist = filter(
                 partial(self.isAccountOfType, account_type), acclist
@@ -456,7 +556,11 @@ class libjamiCtrl(Thread):
 
         account = self._valid_account(account)
         if self.isAccountExists(account):
-            return self.configurationmanager.getAccountDetails(account)
+            return self.accountCache.fetch(
+                ACCOUNT_DETAILS,
+                lambda: self.configurationmanager.getAccountDetails(account),
+                account,
+            )
         return []
 
     def getVolatileAccountDetails(self, account=None):
@@ -464,9 +568,20 @@ class libjamiCtrl(Thread):
 
         account = self._valid_account(account)
         if self.isAccountExists(account):
-            return self.configurationmanager.getVolatileAccountDetails(account)
+            return self.accountCache.fetch(
+                VOLATILE_DETAILS,
+                lambda: self.configurationmanager.getVolatileAccountDetails(
+                    account
+                ),
+                account,
+            )
         return []
 
+    def getAccountCacheStats(self):
+        """Return hit and miss counters of the account cache"""
+
+        return self.accountCache.stats()
+
     def setActiveCodecList(self, account=None, codec_list=""):
         """Activate given codecs on an account. If no account is provided, active account is used"""
 
@@ -493,7 +608,9 @@ class libjamiCtrl(Thread):
                                   order to create a new account"
             )
 
-        return str(self.configurationmanager.addAccount(details))
+        accountID = str(self.configurationmanager.addAccount(details))
+        self.accountCache.invalidate()
+        return accountID
 
     def removeAccount(self, accountID=None):
         """Remove an account from internal list"""
@@ -502,16 +619,30 @@ class libjamiCtrl(Thread):
             raise libjamiCtrlAccountError("Account ID must be specified")
 
         self.configurationmanager.removeAccount(accountID)
+        self.accountCache.invalidate()
+
+    def getAccountIndex(self):
+        """Return the alias and username index of all accounts
+
+        The index is {"alias": {alias: [accountId, ...]},
+        "username": {username: accountId}}. It is built once from the
+        (cached) details of all accounts.
+        """
+
+        index = self.accountCache.getIndex()
+        if index is None:
+            generation = self.accountCache.generation
+            details = {
+                a: self.getAccountDetails(a) for a in self.getAllAccounts()
+            }
+            index = self.accountCache.putIndex(details, generation)
+        return index
 
     def setAccountByAlias(self, alias):
         """Define as active the first account who match with the alias"""
 
-        for testedaccount in self.getAllAccounts():
-            details = self.getAccountDetails(testedaccount)
-            if (
-                details["Account.enable"] == "true"
-                and details["Account.alias"] == alias
-            ):
+        for testedaccount in self.getAccountIndex()["alias"].get(alias, []):
+            if self.isAccountEnable(testedaccount):
                 self.account = testedaccount
                 return
         raise libjamiCtrlAccountError("No enabled account matched with alias")
@@ -519,13 +650,42 @@ class libjamiCtrl(Thread):
     def getAccountByAlias(self, alias):
         """Get account name having its alias"""
 
-        for account in self.getAllAccounts():
-            details = self.getAccountDetails(account)
-            if details["Account.alias"] == alias:
-                return account
+        accounts = self.getAccountIndex()["alias"].get(alias)
+        if accounts:
+            return accounts[0]
 
         raise libjamiCtrlAccountError("No account matched with alias")
 
+    def getAccountByUsername(self, username):
+        """Get account name having its username"""
+
+        account = self.getAccountIndex()["username"].get(username)
+        if account:
+            return account
+
+        raise libjamiCtrlAccountError("No account matched with username")
+
+    def resolveAccount(self, name, candidates=None):
+        """Return the account id for an account id, alias or username
+
+        If candidates (a list of account ids) is given, only those accounts
+        are considered, e.g. only enabled ones. Returns None if nothing
+        matches.
+        """
+
+        if candidates is None:
+            candidates = self.getAllAccounts()
+        if name in candidates:
+            return name
+        index = self.getAccountIndex()
+        for account in index["alias"].get(name, []):
+            if account in candidates:
+                return account
+        account = index["username"].get(name)
+        if account in candidates:
+            return account
+        return None
+
     def setAccount(self, account):
         """Define the active account
 
@@ -571,15 +731,33 @@ class libjamiCtrl(Thread):
             details = self.getAccountDetails(account)
             details["Account.enable"] = "false"
             self.configurationmanager.setAccountDetails(account, details)
+        self.accountCache.invalidateAccount(account)
 
     def setAccountRegistered(self, account=None, register=False):
         """Tries to register the account"""
 
         account = self._valid_account(account)
         self.configurationmanager.sendRegister(account, register)
+        self.accountCache.invalidateAccount(account, VOLATILE_DETAILS)
 
     def onAccountsChanged(self):
         print("Accounts changed")
+        self.accountCache.invalidate()
+        self._emitSignal("accountsChanged")
+
+    def onAccountDetailsChanged(self, account, details):
+        self.accountCache.update(ACCOUNT_DETAILS, str(account), details)
+        self._emitSignal("accountDetailsChanged", account, details)
+
+    def onVolatileAccountDetailsChanged(self, account, details):
+        self.accountCache.update(VOLATILE_DETAILS, str(account), details)
+        self._emitSignal("volatileAccountDetailsChanged", account, details)
+
+    def onRegistrationStateChanged(self, account, state, code, detail):
+        self.accountCache.invalidateAccount(str(account), VOLATILE_DETAILS)
+        self._emitSignal(
+            "registrationStateChanged", account, state, code, detail
+        )
 
     #
     # Codec manager
@@ -802,6 +980,26 @@ class libjamiCtrl(Thread):
             account, conversationId, filePath, fileDisplayName, replyTo
         )
 
+    def fileTransferInfo(self, account, conversationId, fileId):
+        """Return (code, path, total, progress) of a file transfer"""
+
+        return self.configurationmanager.fileTransferInfo(
+            account, conversationId, fileId
+        )
+
+    def downloadFile(
+        self, account, conversationId, interactionId, fileId, path
+    ):
+        """Ask the daemon to download a received file to path
+
+        Returns True if the download started. Its progress is reported
+        with the dataTransferEvent signal carrying fileId.
+        """
+
+        return self.configurationmanager.downloadFile(
+            account, conversationId, interactionId, fileId, path
+        )
+
     def sendTextMessage(self, account, to, message):
         return self.configurationmanager.sendTextMessage(
             account, to, {"text/plain": message}
@@ -821,6 +1019,20 @@ class libjamiCtrl(Thread):
             account, conversationId
         )
 
+    def loadConversationMessages(
+        self, account, conversationId, fromMessage, n
+    ):
+        """Request n messages, newest first, starting at fromMessage
+
+        An empty fromMessage starts at the newest message. Returns a
+        request id, the messages arrive with the conversationLoaded signal
+        carrying the same id.
+        """
+
+        return self.configurationmanager.loadConversationMessages(
+            account, conversationId, fromMessage, n
+        )
+
     def addConversationMember(self, account, conversationId, member):
         return self.configurationmanager.addConversationMember(
             account, conversationId, member
@@ -856,13 +1068,11 @@ class libjamiCtrl(Thread):
         )
 
     def run(self):
-        """Processing method for this thread"""
-
-        context = self.loop.get_context()
+        """Processing method for this thread
 
-        while True:
-            context.iteration(True)
+        Sleeps in the GLib MainLoop until DBus replies, signals or a quit
+        request from stopThread() arrive.
+        """
 
-            if self.isStop:
-                print("++++++++++++++++++ EXIT ++++++++++++++++++++++")
-                return
+        if not self.isStop:
+            self.loop.run()
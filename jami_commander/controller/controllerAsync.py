@@ -0,0 +1,535 @@
+#! /usr/bin/env python3
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+
+"""asyncio front-end of the libjami controlling class
+
+DBus methods are invoked asynchronously (reply_handler/error_handler) from
+the thread running the GLib MainLoop of libjamiCtrl. Replies are handed
+back to the asyncio event loop as resolved futures, signals are handed
+back as items put into asyncio queues. The asyncio event loop never waits
+for a DBus round trip, so many calls can be in flight at the same time.
+"""
+
+import asyncio
+from threading import Lock
+
+from gi.repository import GLib
+
+# local
+from .accountCache import ACCOUNT_DETAILS, ACCOUNT_LIST, VOLATILE_DETAILS
+from .controller import libjamiCtrl
+from .errorsDring import libjamiCtrlAccountError
+
+# seconds to wait for the GLib MainLoop thread when closing
+STOP_TIMEOUT = 5
+
+# messages per page of getConversationMessages()
+PAGE_SIZE = 100
+
+
+def _resolve(future, result):
+    if future.done():  # e.g. cancelled by the caller meanwhile
+        return
+    if len(result) == 0:
+        future.set_result(None)
+    elif len(result) == 1:
+        future.set_result(result[0])
+    else:
+        future.set_result(result)
+
+
+def _reject(future, exception):
+    if not future.done():
+        future.set_exception(exception)
+
+
+class libjamiCtrlAsync:
+    """Awaitable variant of libjamiCtrl
+
+    Offers the account, conversation and messaging methods of libjamiCtrl
+    as coroutines with identical names and arguments. Must be created from
+    within a running asyncio event loop. The wrapped libjamiCtrl is
+    available as attribute ctrl, e.g. for call management.
+    """
+
+    def __init__(self, name, autoAnswer):
+        self.loop = asyncio.get_running_loop()
+        self.ctrl = libjamiCtrl(name, autoAnswer)
+        self.signalQueues = {}  # signal name -> list of asyncio.Queue
+        # signals received by the GLib MainLoop thread, not yet handed to
+        # the queues; the event loop takes them over in one go
+        self.pending = []
+        self.pendingScheduled = False
+        self.pendingLock = Lock()
+        self.ctrl.addSignalListener(self._onSignal)
+
+    def start(self):
+        """Start the thread running the GLib MainLoop"""
+
+        self.ctrl.startThread()
+
+    async def close(self, timeout=STOP_TIMEOUT):
+        """Stop the GLib MainLoop thread and wait for it to finish
+
+        Returns True if the thread stopped within timeout seconds.
+        """
+
+        self.ctrl.removeSignalListener(self._onSignal)
+        return await asyncio.to_thread(self.ctrl.stopThread, timeout)
+
+    @property
+    def account(self):
+        return self.ctrl.account
+
+    #
+    # DBus plumbing
+    #
+
+    def _call(self, method, *args):
+        """Invoke DBus method asynchronously, return a future for its reply
+
+        method is a method of one of the dbus.Interface objects of ctrl,
+        e.g. self.ctrl.configurationmanager.getAccountList.
+        """
+
+        loop = self.loop
+        future = loop.create_future()
+
+        def reply(*result):
+            loop.call_soon_threadsafe(_resolve, future, result)
+
+        def error(e):
+            loop.call_soon_threadsafe(_reject, future, e)
+
+        def dispatch():
+            try:
+                method(*args, reply_handler=reply, error_handler=error)
+            except Exception as e:
+                error(e)
+            return False  # run only once
+
+        GLib.idle_add(dispatch)
+        return future
+
+    async def _cached(self, kind, method, *args, account=None):
+        """Return value from the account cache, on a miss call method"""
+
+        cache = self.ctrl.accountCache
+        value = cache.get(kind, account)
+        if value is None:
+            generation = cache.generation
+            value = await self._call(method, *args)
+            cache.put(kind, value, account, generation)
+        return value
+
+    def _onSignal(self, signalName, *args):
+        # runs in the GLib MainLoop thread, must not block
+        if signalName not in self.signalQueues:
+            return
+        with self.pendingLock:
+            self.pending.append((signalName, args))
+            if self.pendingScheduled:
+                return  # the event loop has yet to pick up the batch
+            self.pendingScheduled = True
+        # wake up the event loop once per batch, not once per signal
+        self.loop.call_soon_threadsafe(self._dispatchPending)
+
+    def _dispatchPending(self):
+        with self.pendingLock:
+            pending = self.pending
+            self.pending = []
+            self.pendingScheduled = False
+        for signalName, args in pending:
+            self._dispatchSignal(signalName, args)
+
+    def _dispatchSignal(self, signalName, args):
+        for queue in self.signalQueues.get(signalName, []):
+            queue.put_nowait((signalName, args))
+
+    def subscribe(self, *signalNames):
+        """Return an asyncio.Queue receiving (signalName, args) tuples
+
+        Every signal in signalNames received from the daemon after this
+        call is put into the queue. The queue is unbounded, so no signal
+        is lost while the consumer is busy.
+        """
+
+        queue = asyncio.Queue()
+        for signalName in signalNames:
+            self.signalQueues.setdefault(signalName, []).append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        """Stop delivering signals to a queue returned by subscribe()"""
+
+        for signalName in list(self.signalQueues):
+            queues = self.signalQueues[signalName]
+            if queue in queues:
+                queues.remove(queue)
+            if not queues:
+                del self.signalQueues[signalName]
+
+    #
+    # Account management
+    #
+
+    async def isAccountExists(self, account):
+        """Checks if the account exists"""
+
+        return account in await self.getAllAccounts()
+
+    async def isAccountEnable(self, account=None):
+        """Return True if the account is enabled. If no account is
+        provided, active account is used"""
+
+        details = await self.getAccountDetails(account)
+        return details["Account.enable"] == "true"
+
+    async def isAccountRegistered(self, account=None):
+        """Return True if the account is registered. If no account is
+        provided, active account is used"""
+
+        details = await self.getVolatileAccountDetails(account)
+        return details["Account.registrationStatus"] in ("READY", "REGISTERED")
+
+    async def isAccountOfType(self, account_type, account=None):
+        """Return True if the account type is the given one. If no account is
+        provided, active account is used"""
+
+        details = await self.getAccountDetails(account)
+        return details["Account.type"] == account_type
+
+    async def getAllAccounts(self, account_type=None):
+        """Return a list with all accounts"""
+
+        cm = self.ctrl.configurationmanager
+        acclist = [
+            str(x) for x in await self._cached(ACCOUNT_LIST, cm.getAccountList)
+        ]
+        if account_type:
+            matches = await asyncio.gather(
+                *(self.isAccountOfType(account_type, x) for x in acclist)
+            )
+            acclist = [x for x, m in zip(acclist, matches) if m]
+        return acclist
+
+    async def getAllEnabledAccounts(self):
+        """Return a list with all enabled-only accounts"""
+
+        acclist = await self.getAllAccounts()
+        enabled = await asyncio.gather(
+            *(self.isAccountEnable(x) for x in acclist)
+        )
+        return [x for x, e in zip(acclist, enabled) if e]
+
+    async def getAllRegisteredAccounts(self):
+        """Return a list with all registered-only accounts"""
+
+        acclist = await self.getAllAccounts()
+        registered = await asyncio.gather(
+            *(self.isAccountRegistered(x) for x in acclist)
+        )
+        return [x for x, r in zip(acclist, registered) if r]
+
+    async def getAccountDetails(self, account=None):
+        """Return a list of string. If no account is
+        provided, active account is used"""
+
+        account = self.ctrl._valid_account(account)
+        cm = self.ctrl.configurationmanager
+        if await self.isAccountExists(account):
+            return await self._cached(
+                ACCOUNT_DETAILS, cm.getAccountDetails, account, account=account
+            )
+        return []
+
+    async def getVolatileAccountDetails(self, account=None):
+        """Return a list of string. If no account is
+        provided, active account is used"""
+
+        account = self.ctrl._valid_account(account)
+        cm = self.ctrl.configurationmanager
+        if await self.isAccountExists(account):
+            return await self._cached(
+                VOLATILE_DETAILS,
+                cm.getVolatileAccountDetails,
+                account,
+                account=account,
+            )
+        return []
+
+    def getAccountCacheStats(self):
+        """Return hit and miss counters of the account cache"""
+
+        return self.ctrl.getAccountCacheStats()
+
+    async def addAccount(self, details=None):
+        """Add a new account account, see libjamiCtrl.addAccount()"""
+
+        if details is None:
+            raise libjamiCtrlAccountError(
+                "Must specifies type, alias, hostname, \
+                                  username and password in \
+                                  order to create a new account"
+            )
+
+        cm = self.ctrl.configurationmanager
+        accountID = str(await self._call(cm.addAccount, details))
+        self.ctrl.accountCache.invalidate()
+        return accountID
+
+    async def removeAccount(self, accountID=None):
+        """Remove an account from internal list"""
+
+        if accountID is None:
+            raise libjamiCtrlAccountError("Account ID must be specified")
+
+        cm = self.ctrl.configurationmanager
+        await self._call(cm.removeAccount, accountID)
+        self.ctrl.accountCache.invalidate()
+
+    async def getAccountIndex(self):
+        """Return the alias and username index, see libjamiCtrl"""
+
+        cache = self.ctrl.accountCache
+        index = cache.getIndex()
+        if index is None:
+            generation = cache.generation
+            acclist = await self.getAllAccounts()
+            # one bulk pass, all details requests are in flight together
+            details = await asyncio.gather(
+                *(self.getAccountDetails(x) for x in acclist)
+            )
+            index = cache.putIndex(dict(zip(acclist, details)), generation)
+        return index
+
+    async def setAccountByAlias(self, alias):
+        """Define as active the first account who match with the alias"""
+
+        index = await self.getAccountIndex()
+        for testedaccount in index["alias"].get(alias, []):
+            if await self.isAccountEnable(testedaccount):
+                self.ctrl.account = testedaccount
+                return
+        raise libjamiCtrlAccountError("No enabled account matched with alias")
+
+    async def getAccountByAlias(self, alias):
+        """Get account name having its alias"""
+
+        accounts = (await self.getAccountIndex())["alias"].get(alias)
+        if accounts:
+            return accounts[0]
+
+        raise libjamiCtrlAccountError("No account matched with alias")
+
+    async def getAccountByUsername(self, username):
+        """Get account name having its username"""
+
+        account = (await self.getAccountIndex())["username"].get(username)
+        if account:
+            return account
+
+        raise libjamiCtrlAccountError("No account matched with username")
+
+    async def resolveAccount(self, name, candidates=None):
+        """Return the account id for an account id, alias or username
+
+        If candidates (a list of account ids) is given, only those accounts
+        are considered, e.g. only enabled ones. Returns None if nothing
+        matches.
+        """
+
+        if candidates is None:
+            candidates = await self.getAllAccounts()
+        if name in candidates:
+            return name
+        index = await self.getAccountIndex()
+        for account in index["alias"].get(name, []):
+            if account in candidates:
+                return account
+        account = index["username"].get(name)
+        if account in candidates:
+            return account
+        return None
+
+    async def setAccount(self, account):
+        """Define the active account"""
+
+        if account in await self.getAllAccounts():
+            self.ctrl.account = account
+        else:
+            raise libjamiCtrlAccountError("Not a valid account")
+
+    async def setFirstRegisteredAccount(self):
+        """Find the first registered account and define it as active"""
+
+        rAccounts = await self.getAllRegisteredAccounts()
+        if 0 == len(rAccounts):
+            raise libjamiCtrlAccountError("No registered account !")
+        self.ctrl.account = rAccounts[0]
+
+    async def setFirstActiveAccount(self):
+        """Find the first enabled account and define it as active"""
+
+        aAccounts = await self.getAllEnabledAccounts()
+        if 0 == len(aAccounts):
+            raise libjamiCtrlAccountError("No active account !")
+        self.ctrl.account = aAccounts[0]
+
+    def getAccount(self):
+        """Return the active account"""
+
+        return self.ctrl.account
+
+    #
+    # Conversations and messages
+    #
+
+    async def sendFile(
+        self, account, conversationId, filePath, fileDisplayName="", replyTo=""
+    ):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.sendFile,
+            account,
+            conversationId,
+            filePath,
+            fileDisplayName,
+            replyTo,
+        )
+
+    async def fileTransferInfo(self, account, conversationId, fileId):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.fileTransferInfo, account, conversationId, fileId
+        )
+
+    async def downloadFile(
+        self, account, conversationId, interactionId, fileId, path
+    ):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.downloadFile,
+            account,
+            conversationId,
+            interactionId,
+            fileId,
+            path,
+        )
+
+    async def sendTextMessage(self, account, to, message):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.sendTextMessage, account, to, {"text/plain": message}
+        )
+
+    async def startConversation(self, account):
+        cm = self.ctrl.configurationmanager
+        return await self._call(cm.startConversation, account)
+
+    async def getConversations(self, account):
+        cm = self.ctrl.configurationmanager
+        return await self._call(cm.getConversations, account)
+
+    async def getConversationsRequests(self, account):
+        cm = self.ctrl.configurationmanager
+        return await self._call(cm.getConversationRequests, account)
+
+    async def getConversationMembers(self, account, conversationId):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.getConversationMembers, account, conversationId
+        )
+
+    async def loadConversationMessages(
+        self, account, conversationId, fromMessage, n
+    ):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.loadConversationMessages,
+            account,
+            conversationId,
+            fromMessage,
+            n,
+        )
+
+    async def getConversationMessages(
+        self, account, conversationId, fromMessage="", n=PAGE_SIZE
+    ):
+        """Return up to n messages, newest first, starting at fromMessage
+
+        An empty fromMessage starts at the newest message. The message
+        fromMessage itself is included. Pass the id of the last (oldest)
+        message of a page to get the next page; fewer than n messages
+        mean the first message of the conversation was reached. Messages
+        are dicts with keys like "id", "type", "author", "timestamp" and
+        "body".
+        """
+
+        # subscribe before the request, the signal may beat the reply
+        queue = self.subscribe("conversationLoaded")
+        try:
+            requestId = await self.loadConversationMessages(
+                account, conversationId, fromMessage, n
+            )
+            while True:
+                name, args = await queue.get()
+                id, acct, conv, messages = args
+                if id == requestId and conv == conversationId:
+                    return messages
+        finally:
+            self.unsubscribe(queue)
+
+    async def addConversationMember(self, account, conversationId, member):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.addConversationMember, account, conversationId, member
+        )
+
+    async def removeConversationMember(self, account, conversationId, member):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.removeConversationMember, account, conversationId, member
+        )
+
+    async def acceptConversationRequest(self, account, conversationId):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.acceptConversationRequest, account, conversationId
+        )
+
+    async def declineConversationRequest(self, account, conversationId):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.declineConversationRequest, account, conversationId
+        )
+
+    # Flag: 0 = reply (if commitId is not empty), else single message
+    #       1 = edit message
+    async def sendMessage(
+        self, account, conversationId, message, commitId="", flag=0
+    ):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.sendMessage, account, conversationId, message, commitId, flag
+        )
+
+    async def removeConversation(self, account, conversationId):
+        cm = self.ctrl.configurationmanager
+        return await self._call(
+            cm.removeConversation, account, conversationId
+        )
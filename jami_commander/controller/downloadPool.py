@@ -0,0 +1,125 @@
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+
+"""Bounded pool of concurrent file downloads"""
+
+import asyncio
+
+
+class libjamiDownloadPool:
+    """Download received files with limited concurrency
+
+    downloadFile() returns as soon as the daemon started the download. A
+    download holds its slot until the libjamiTransferTracker saw its
+    final dataTransferEvent (or timeout seconds passed), so at most
+    `parallel` downloads run at once, and at most `perConversation` of
+    them for the same conversation. Downloads waiting for a slot of a
+    busy conversation do not block other conversations.
+
+    Lives in the asyncio event loop of the libjamiCtrlAsync it is
+    created with. The tracker must be started.
+    """
+
+    def __init__(self, ctrl, tracker, parallel, perConversation, timeout=None):
+        self.ctrl = ctrl  # libjamiCtrlAsync
+        self.tracker = tracker  # libjamiTransferTracker
+        self.semaphore = asyncio.Semaphore(max(1, parallel))
+        self.perConversation = max(1, perConversation)
+        self.timeout = timeout
+        # (account, conversationId) -> [semaphore, number of downloads]
+        self.conversations = {}
+        self.tasks = set()
+
+    def submit(
+        self, account, conversationId, interactionId, fileId, path, size=None
+    ):
+        """Queue a download, return its task
+
+        The task results in the transfer record of the download, see
+        libjamiTransferTracker.expect(). A download the daemon refused has
+        status "failed", one that timed out keeps its last status and a
+        "duration" of None. Exceptions of downloadFile() are raised by
+        the task.
+        """
+
+        key = (account, conversationId)
+        entry = self.conversations.get(key)
+        if entry is None:
+            entry = [asyncio.Semaphore(self.perConversation), 0]
+            self.conversations[key] = entry
+        entry[1] += 1
+        task = asyncio.create_task(
+            self._download(entry, key, interactionId, fileId, path, size)
+        )
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _download(self, entry, key, interactionId, fileId, path, size):
+        account, conversationId = key
+        try:
+            # always per conversation first, then global
+            async with entry[0], self.semaphore:
+                record = self.tracker.expectFile(
+                    account, conversationId, interactionId, fileId, path, size
+                )
+                try:
+                    started = await self.ctrl.downloadFile(
+                        account, conversationId, interactionId, fileId, path
+                    )
+                    if started:
+                        await self.tracker.wait([record], self.timeout)
+                    else:
+                        self.tracker.cancel(record)
+                except BaseException:
+                    self.tracker.cancel(record)
+                    raise
+                finally:
+                    self.tracker.forget(record)
+                return record
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.conversations[key]
+
+    def pending(self):
+        """Return the number of queued and running downloads"""
+
+        return len(self.tasks)
+
+    async def join(self, timeout=None):
+        """Wait until all downloads are done or timeout seconds passed
+
+        Returns True if all downloads are done.
+        """
+
+        if self.tasks:
+            await asyncio.wait(set(self.tasks), timeout=timeout)
+        return not self.tasks
+
+    async def close(self):
+        """Cancel all queued and running downloads
+
+        The daemon may still complete downloads it already started.
+        Returns the number of cancelled downloads.
+        """
+
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.conversations.clear()  # tasks cancelled before they ran
+        return len(tasks)
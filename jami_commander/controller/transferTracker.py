@@ -0,0 +1,305 @@
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA.
+#
+
+"""Progress of file transfers, driven by the dataTransferEvent signal"""
+
+import asyncio
+import os
+import time
+from collections import deque
+
+# libjami DataTransferEventCode
+INVALID = 0
+CREATED = 1
+UNSUPPORTED = 2
+WAIT_PEER_ACCEPTANCE = 3
+WAIT_HOST_ACCEPTANCE = 4
+ONGOING = 5
+FINISHED = 6
+CLOSED_BY_HOST = 7
+CLOSED_BY_PEER = 8
+INVALID_PATHNAME = 9
+UNJOINABLE_PEER = 10
+TIMEOUT_EXPIRED = 11
+
+EVENT_NAMES = {
+    INVALID: "invalid",
+    CREATED: "created",
+    UNSUPPORTED: "unsupported",
+    WAIT_PEER_ACCEPTANCE: "wait_peer_acceptance",
+    WAIT_HOST_ACCEPTANCE: "wait_host_acceptance",
+    ONGOING: "ongoing",
+    FINISHED: "finished",
+    CLOSED_BY_HOST: "closed_by_host",
+    CLOSED_BY_PEER: "closed_by_peer",
+    INVALID_PATHNAME: "invalid_pathname",
+    UNJOINABLE_PEER: "unjoinable_peer",
+    TIMEOUT_EXPIRED: "timeout_expired",
+}
+
+# codes after which no more events arrive for a transfer
+FINAL_CODES = (
+    UNSUPPORTED,
+    FINISHED,
+    CLOSED_BY_HOST,
+    CLOSED_BY_PEER,
+    INVALID_PATHNAME,
+    UNJOINABLE_PEER,
+    TIMEOUT_EXPIRED,
+)
+
+# status of transfers that never got a final code
+PENDING = "pending"
+FAILED = "failed"
+
+# type of the message announcing a file in a swarm conversation
+FILE_MESSAGE_TYPE = "application/data-transfer+json"
+# signals announcing new messages, newer daemons send both
+MESSAGE_SIGNALS = ("messageReceived", "swarmMessageReceived")
+
+
+def _fileMessage(signalName, message):
+    """Return (interactionId, body) of a file message, else None"""
+
+    if signalName == "swarmMessageReceived":
+        id, type, parent, body = message[:4]
+    else:
+        id, type, body = message.get("id"), message.get("type"), message
+    if type != FILE_MESSAGE_TYPE or not body.get("fileId"):
+        return None
+    return str(id), body
+
+
+class libjamiTransferTracker:
+    """Map fileIds to transfer progress
+
+    sendFile() does not return the fileId of the new transfer. The daemon
+    announces it in the file message it commits to the conversation, with
+    the display name and size of the file. So before calling sendFile()
+    register the transfer with expect(); the first file message of the
+    same account and conversation with that name and size gives the
+    record its fileId and interactionId. Events with an unknown fileId,
+    e.g. of incoming files or of transfers started by other clients, are
+    ignored.
+
+    Lives in the asyncio event loop of the libjamiCtrlAsync it is
+    created with; records are plain dicts, see expect().
+    """
+
+    def __init__(self, ctrl):
+        self.ctrl = ctrl  # libjamiCtrlAsync
+        self.records = {}  # fileId -> record
+        # (account, conversationId) -> deque of records without fileId
+        self.expected = {}
+        self.futures = {}  # id(record) -> future done when record is final
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        """Start listening to dataTransferEvent and file messages"""
+
+        self.queue = self.ctrl.subscribe("dataTransferEvent", *MESSAGE_SIGNALS)
+        self.task = asyncio.create_task(self._consume())
+
+    async def close(self):
+        """Stop listening, pending transfers keep their last status"""
+
+        if self.task is None:
+            return
+        self.ctrl.unsubscribe(self.queue)
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    def expect(self, account, conversationId, path, name=None):
+        """Register a transfer about to be started by sendFile()
+
+        name is the display name given to sendFile(), by default the
+        file name of path. Returns its record, a dict with the keys
+        "accountid", "conversationid", "path", "name", "fileid",
+        "interactionid", "code", "status", "success", "size", "bytes",
+        "started", "duration" and "rate" (bytes per second). "duration"
+        stays None until the transfer reached a final status.
+        """
+
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+        record = self._newRecord(account, conversationId, path, size)
+        record["name"] = os.path.basename(path) if name is None else name
+        key = (account, conversationId)
+        self.expected.setdefault(key, deque()).append(record)
+        return record
+
+    def expectFile(
+        self, account, conversationId, interactionId, fileId, path, size=None
+    ):
+        """Register a transfer with a known fileId, e.g. a download
+
+        Call it before downloadFile() so that no event gets lost. Returns
+        its record, see expect(). size is the size announced by the sender.
+        """
+
+        record = self._newRecord(account, conversationId, path, size)
+        record["fileid"] = fileId
+        record["interactionid"] = interactionId
+        self.records[fileId] = record
+        return record
+
+    def _newRecord(self, account, conversationId, path, size):
+        record = {
+            "accountid": account,
+            "conversationid": conversationId,
+            "path": path,
+            "name": os.path.basename(path),
+            "fileid": None,
+            "interactionid": None,
+            "code": None,
+            "status": PENDING,
+            "success": False,
+            "size": size,
+            "bytes": 0,
+            "started": time.monotonic(),
+            "duration": None,
+            "rate": None,
+        }
+        self.futures[id(record)] = asyncio.get_running_loop().create_future()
+        return record
+
+    def cancel(self, record):
+        """Mark an expected transfer as failed, e.g. sendFile() raised"""
+
+        key = (record["accountid"], record["conversationid"])
+        if record in self.expected.get(key, ()):
+            self.expected[key].remove(record)
+        if self.records.get(record["fileid"]) is record:
+            del self.records[record["fileid"]]
+        record["status"] = FAILED
+        self._finish(record)
+
+    def forget(self, record):
+        """Drop a record no longer waited for, e.g. in a long-running
+        listener; later events of its fileId are ignored
+        """
+
+        key = (record["accountid"], record["conversationid"])
+        pending = self.expected.get(key)
+        if pending is not None:
+            if record in pending:
+                # never got its fileId, must not claim another transfer
+                pending.remove(record)
+            if not pending:
+                del self.expected[key]
+        if self.records.get(record["fileid"]) is record:
+            del self.records[record["fileid"]]
+        self.futures.pop(id(record), None)
+
+    def onMessage(self, account, conversationId, interactionId, body):
+        """Give an expected record the fileId of a file message"""
+
+        fileId = str(body["fileId"])
+        key = (account, conversationId)
+        pending = self.expected.get(key)
+        if not pending or fileId in self.records:
+            return  # not one of ours, or announced by both signals
+        name = str(body.get("displayName", ""))
+        try:
+            size = int(body.get("totalSize"))
+        except (TypeError, ValueError):
+            size = None
+        for record in pending:
+            if record["name"] == name and (
+                size is None or record["size"] in (None, size)
+            ):
+                break
+        else:
+            return  # e.g. a file sent by another member
+        pending.remove(record)
+        if not pending:
+            del self.expected[key]
+        record["fileid"] = fileId
+        record["interactionid"] = interactionId
+        self.records[fileId] = record
+
+    def onEvent(self, account, conversationId, interactionId, fileId, code):
+        """Update the record of fileId with a dataTransferEvent"""
+
+        record = self.records.get(fileId)
+        if record is None:
+            return  # not one of ours
+        record["interactionid"] = interactionId or record["interactionid"]
+        record["code"] = code
+        record["status"] = EVENT_NAMES.get(code, str(code))
+        if code == FINISHED:
+            record["bytes"] = record["size"] or record["bytes"]
+        if code in FINAL_CODES:
+            self._finish(record)
+
+    def _finish(self, record):
+        if record["duration"] is None:
+            record["success"] = record["code"] == FINISHED
+            record["duration"] = time.monotonic() - record["started"]
+            if record["bytes"] and record["duration"] > 0:
+                record["rate"] = record["bytes"] / record["duration"]
+        future = self.futures.get(id(record))
+        if future is not None and not future.done():
+            future.set_result(record)
+
+    async def _consume(self):
+        while True:
+            name, args = await self.queue.get()
+            if name == "dataTransferEvent":
+                self.onEvent(*args)
+                continue
+            account, conversationId, message = args
+            fileMessage = _fileMessage(name, message)
+            if fileMessage is not None:
+                self.onMessage(account, conversationId, *fileMessage)
+
+    async def refresh(self, record):
+        """Ask the daemon for the progress of an unfinished transfer"""
+
+        if record["fileid"] is None or record["duration"] is not None:
+            return
+        try:
+            code, path, total, progress = await self.ctrl.fileTransferInfo(
+                record["accountid"], record["conversationid"], record["fileid"]
+            )
+        except Exception:
+            return
+        record["bytes"] = int(progress)
+        duration = time.monotonic() - record["started"]
+        if duration > 0:
+            record["rate"] = record["bytes"] / duration
+
+    async def wait(self, records, timeout=None):
+        """Wait until all records are final or timeout seconds passed
+
+        A timeout of None waits forever. Returns True if all transfers
+        reached a final status. Unfinished transfers get their progress
+        refreshed from the daemon.
+        """
+
+        futures = [self.futures[id(r)] for r in records]
+        if futures:
+            await asyncio.wait(futures, timeout=timeout)
+        unfinished = [r for r in records if r["duration"] is None]
+        await asyncio.gather(*(self.refresh(r) for r in unfinished))
+        return not unfinished
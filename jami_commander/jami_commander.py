@@ -17,34 +17,41 @@ https://git.jami.net/savoirfairelinux/jami-daemon/-/blob/master/bin/dbus/cx.ring
 # automatically sorted by isort,
 # then formatted by black --line-length 79
 
+# annotations are not evaluated, so asyncio etc. need not be loaded for them
+from __future__ import annotations
 
-import argparse
-import asyncio
+import codecs
 import errno
 import json
-import logging
 import os
 import os.path
 import re  # regular expression
 import select
-import subprocess
+import shutil
+import signal
+import stat
 import sys
 import tempfile
-import textwrap
 import time
 import traceback
-import urllib.request
 import uuid
-from importlib import metadata
 from os import R_OK, access
 from os.path import isfile
-from typing import Literal, Union
-
-import emoji
-import markdown
-
-# local
-from .controller import libjamiCtrl
+from typing import TYPE_CHECKING, Literal, Union
+
+# asyncio, argparse, logging, subprocess, textwrap, emoji, markdown,
+# urllib.request, importlib.metadata, hashlib and the controller (which
+# loads dbus and gi) are imported in the functions using them. asyncio
+# alone takes longer to import than everything else together, and none of
+# them is needed for the help files, see print_bundled_help().
+# This keeps --help, --usage, --version etc. fast.
+# See scripts/check-importtime.py.
+if TYPE_CHECKING:
+    import argparse
+    import asyncio
+    import logging
+
+    from .controller import libjamiCtrlAsync, libjamiTransferTracker
 
 # version number
 VERSION = "2024-08-25"
@@ -78,10 +85,36 @@ OUTPUT_JSON = "json"
 OUTPUT_DEFAULT = OUTPUT_TEXT
 
 # location of README.md file if it is not found on local harddisk
-# used for --manual
+# used for --readme
 README_FILE_RAW_URL = (
     "https://raw.githubusercontent.com/8go/jami-commander/master/README.md"
 )
+# a downloaded README.md is kept here, so it is downloaded only once
+README_CACHE_FILE = os.path.normpath(
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        PROG_WITHOUT_EXT,
+        "README.md",
+    )
+)
+# the path above as printed by --help, the same for every user
+README_CACHE_FILE_SHOWN = (
+    "${XDG_CACHE_HOME:-~/.cache}/" + PROG_WITHOUT_EXT + "/README.md"
+)
+README_FETCH_TIMEOUT = 10  # seconds, give up on github.com after this
+# --readme pipes README.md through this pager if stdout is a terminal
+PAGER_DEFAULT = "less"
+
+# help files shipped inside the package, see print_bundled_help()
+BUNDLED_HELP = {
+    ("--usage",): "help.usage.txt",
+    ("-h",): "help.help.txt",
+    ("--help",): "help.help.txt",
+    ("--manual",): "help.manual.txt",
+}
+
+# argument parser, see get_parser()
+parser = None
 
 DEFAULT_SEPARATOR = "    "  # used for sperating columns in print outputs
 SEP = DEFAULT_SEPARATOR
@@ -92,10 +125,194 @@ VERSION_USED_DEFAULT = PRINT  # use 'print' by default with --version
 ACCT_TYPE_RING = "RING"
 DEFAUL_ACCT_TYPE = ACCT_TYPE_RING
 
+# maximum number of sends (DBUS calls) in flight at the same time
+PARALLEL_DEFAULT = 8
+
+# message formats, see -w, -z, -k, -j and "format" of --batch
+FORMAT_TEXT = "text"
+FORMAT_HTML = "html"
+FORMAT_MARKDOWN = "markdown"
+FORMAT_CODE = "code"
+FORMAT_EMOJIZE = "emojize"
+FORMATS = (
+    FORMAT_TEXT,
+    FORMAT_HTML,
+    FORMAT_MARKDOWN,
+    FORMAT_CODE,
+    FORMAT_EMOJIZE,
+)
+
+# --batch: jobs read ahead per allowed concurrent send (--parallel)
+BATCH_JOBS_PER_SEND = 4
+
+# --serve: maximum size of one JSON-RPC request line
+SERVE_LINE_LIMIT = 16 * 1024 * 1024
+
+# JSON-RPC 2.0 error codes
+RPC_PARSE_ERROR = -32700
+RPC_INVALID_REQUEST = -32600
+RPC_METHOD_NOT_FOUND = -32601
+RPC_INVALID_PARAMS = -32602
+RPC_SERVER_ERROR = -32000
+
+# streaming with "_": 0 means every line is sent as its own message
+STREAM_FLUSH_MS_DEFAULT = 0
+STREAM_MAX_BYTES_DEFAULT = 4096
+
+# 0 means messages can be of any size
+MAX_MESSAGE_SIZE_DEFAULT = 0
+
+# bytes read from stdin at once
+STDIN_CHUNK_SIZE = 64 * 1024
+
+# bytes copied at once when storing a file piped in with "-f -"
+FILE_COPY_CHUNK_SIZE = 1024 * 1024
+
+# how a file piped in with "-f -" is handed to the daemon
+FILE_STDIN_TMPFILE = "tmpfile"
+FILE_STDIN_MEMFD = "memfd"
+FILE_STDIN_AUTO = "auto"
+# the /proc paths of the other modes are only valid while we run
+FILE_STDIN_MODE_DEFAULT = FILE_STDIN_TMPFILE
+
+# files already sent are remembered in this index for --dedupe
+DEDUPE_CACHE_DEFAULT = os.path.normpath(
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        PROG_WITHOUT_EXT,
+        "sent-files.json",
+    )
+)
+DEDUPE_CACHE_SHOWN = (
+    "${XDG_CACHE_HOME:-~/.cache}/" + PROG_WITHOUT_EXT + "/sent-files.json"
+)
+DEDUPE_TTL_DEFAULT = 24 * 60 * 60  # seconds
+DEDUPE_SKIP = "skip"
+DEDUPE_REFERENCE = "reference"
+DEDUPE_ACTION_DEFAULT = DEDUPE_SKIP
+
+# --wait-transfers without TIMEOUT: 0 means wait as long as it takes
+WAIT_TRANSFERS_FOREVER = 0
+
+# --listen
+LISTEN_NEVER = "never"
+LISTEN_FOREVER = "forever"
+LISTEN_DEFAULT = LISTEN_NEVER
+# both signals announce new messages, newer daemons send both
+LISTEN_SIGNALS = ("messageReceived", "swarmMessageReceived")
+LISTEN_BATCH_MAX = 1024  # messages written to stdout with one flush
+LISTEN_SEEN_MAX = 10000  # message ids remembered to drop duplicates
+# --listen-checkpoint: the last message processed per conversation
+LISTEN_CHECKPOINT_DEFAULT = os.path.normpath(
+    os.path.join(
+        os.environ.get("XDG_STATE_HOME")
+        or os.path.expanduser("~/.local/state"),
+        PROG_WITHOUT_EXT,
+        "listen-checkpoint.json",
+    )
+)
+LISTEN_CHECKPOINT_SHOWN = (
+    "${XDG_STATE_HOME:-~/.local/state}/"
+    + PROG_WITHOUT_EXT
+    + "/listen-checkpoint.json"
+)
+LISTEN_CHECKPOINT_INTERVAL = 5  # seconds, checkpoints are written at most
+# messages caught up at most per conversation if its checkpoint message is
+# not found in the history
+LISTEN_CATCH_UP_MAX = 10000
+
+# --export-history
+EXPORT_PAGE_SIZE_DEFAULT = 100  # messages requested from jamid at once
+EXPORT_PAGE_TIMEOUT = 60  # seconds to wait for jamid to deliver a page
+# an --export-history file with one of these suffixes is an SQLite database
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+# exported messages and export checkpoints in an SQLite database
+MESSAGE_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    accountid TEXT NOT NULL,
+    conversationid TEXT NOT NULL,
+    id TEXT NOT NULL,
+    type TEXT,
+    author TEXT,
+    timestamp INTEGER,
+    body TEXT,
+    message TEXT NOT NULL,  -- all fields of the message as JSON
+    PRIMARY KEY (accountid, conversationid, id)
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    accountid TEXT NOT NULL,
+    conversationid TEXT NOT NULL,
+    state TEXT NOT NULL,  -- JSON, see export_conversation()
+    PRIMARY KEY (accountid, conversationid)
+);
+CREATE INDEX IF NOT EXISTS messages_by_time
+    ON messages (accountid, conversationid, timestamp);
+CREATE INDEX IF NOT EXISTS messages_by_author ON messages (author, timestamp);
+-- full-text index of the message bodies for --search, kept up to date
+-- by the triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+    USING fts5(body, content='messages', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+BEGIN
+    INSERT INTO messages_fts (rowid, body) VALUES (new.rowid, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, body)
+        VALUES ('delete', old.rowid, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages
+BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, body)
+        VALUES ('delete', old.rowid, old.body);
+    INSERT INTO messages_fts (rowid, body) VALUES (new.rowid, new.body);
+END;
+"""
+
+# --archive: received messages are stored in this SQLite database
+ARCHIVE_DEFAULT = os.path.normpath(
+    os.path.join(
+        os.environ.get("XDG_DATA_HOME")
+        or os.path.expanduser("~/.local/share"),
+        PROG_WITHOUT_EXT,
+        "archive.db",
+    )
+)
+ARCHIVE_SHOWN = (
+    "${XDG_DATA_HOME:-~/.local/share}/" + PROG_WITHOUT_EXT + "/archive.db"
+)
+SEARCH_LIMIT_DEFAULT = 100  # --search prints at most this many messages
+
+# --download-media: received files are downloaded into this directory
+DOWNLOAD_MEDIA_DEFAULT = "media"
+DOWNLOAD_PARALLEL_DEFAULT = 4  # concurrent downloads in total
+DOWNLOAD_PARALLEL_CONVERSATION_DEFAULT = 2  # ... and per conversation
+DOWNLOAD_TIMEOUT = 30 * 60  # seconds, then a download gives up its slot
+DOWNLOAD_QUOTA_DEFAULT = 0  # bytes kept in the media store, 0 is no limit
+# the media store lives in this subdirectory of the --download-media
+# directory; files are stored under the digest Jami announces as sha3sum
+MEDIA_STORE_DIR = ".store"
+MEDIA_STORE_HASH = "sha3_512"
+FILE_MESSAGE_TYPE = "application/data-transfer+json"
+
+# --version check remembers the latest release found on PyPI in this file
+VERSION_CACHE_FILE = os.path.normpath(
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        PROG_WITHOUT_EXT,
+        "pypi-version.json",
+    )
+)
+VERSION_CACHE_FILE_SHOWN = (
+    "${XDG_CACHE_HOME:-~/.cache}/" + PROG_WITHOUT_EXT + "/pypi-version.json"
+)
+VERSION_CACHE_TTL = 12 * 60 * 60  # seconds, PyPI is asked at most this often
+VERSION_CHECK_TIMEOUT = 5  # seconds, give up on PyPI after this
+
 # increment this number and use new incremented number for next warning
-# last unique Wxxx warning number used: W113:
+# last unique Wxxx warning number used: W125:
 # increment this number and use new incremented number for next error
-# last unique Exxx error number used: E255:
+# last unique Exxx error number used: E270:
 
 
 class LooseVersion:
@@ -173,10 +390,14 @@ class GlobalState:
         # to which logic (message, file) is
         # stdin pipe assigned?
         self.stdin_use: str = "none"
-        self.ctrl: libjamiCtrl = None
+        self.ctrl: libjamiCtrlAsync = None
         self.account: Union[None, str] = None
         self.send_action = False  # argv contains send action
+        self.batch_action = False  # argv contains batch action
+        self.serve_action = False  # argv contains serve action
         self.listen_action = False  # argv contains listen action
+        self.export_action = False  # argv contains export action
+        self.search_action = False  # argv contains search action
         self.accountmgmt_action = False  # argv contains account action
         self.conversation_action = False  # argv contains conversation action
         self.set_action = False  # argv contains set action
@@ -184,6 +405,8 @@ class GlobalState:
         self.setget_action = False  # argv contains set or get action
         self.err_count = 0  # how many errors have occurred so far
         self.warn_count = 0  # how many warnings have occurred so far
+        self.temp_files = []  # temporary files to be removed at exit
+        self.temp_fds = []  # memfd file descriptors to be closed at exit
 
 
 # Convert None to "", useful when reporting values to stdout
@@ -313,13 +536,47 @@ def delete_pid_file() -> None:
         gs.log.debug(f'Failed to remove PID file "{PID_FILE_DEFAULT}".')
 
 
+def delete_temp_file(file: str) -> None:
+    """Remove a temporary file created by this program.
+
+    It might already be gone. So, ignore failures.
+    """
+    try:
+        os.remove(file)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        gs.log.debug(f'Failed to remove temporary file "{file}".')
+    if file in gs.temp_files:
+        gs.temp_files.remove(file)
+
+
+def close_temp_fd(fd: int) -> None:
+    """Close a memfd file descriptor, this frees its memory."""
+    try:
+        os.close(fd)
+    except OSError:
+        gs.log.debug(f"Failed to close file descriptor {fd}.")
+    if fd in gs.temp_fds:
+        gs.temp_fds.remove(fd)
+
+
+def delete_temp_files() -> None:
+    """Remove all temporary files that are still left over."""
+    for file in list(gs.temp_files):
+        delete_temp_file(file)
+    for fd in list(gs.temp_fds):
+        close_temp_fd(fd)
+
+
 def cleanup() -> None:
     """Cleanup before quiting program."""
     gs.log.debug("Cleanup: cleaning up.")
+    delete_temp_files()
     delete_pid_file()
 
 
-def action_add_account() -> None:
+async def action_add_account() -> None:
     """Add account."""
     # gs.pa.add_account : ALIAS HOSTNAME USERNAME PASSWORD
     accountdetails = {
@@ -330,7 +587,7 @@ def action_add_account() -> None:
         "Account.password": gs.pa.add_account[3],
     }
     gs.log.debug(f"Adding account with these details: {accountdetails}")
-    accountid = gs.ctrl.addAccount(accountdetails)
+    accountid = await gs.ctrl.addAccount(accountdetails)
     json_ = {"accountid": accountid}
     text = accountid
     # output format controlled via --output flag
@@ -342,16 +599,16 @@ def action_add_account() -> None:
     )
 
 
-def action_remove_account() -> None:
+async def action_remove_account() -> None:
     """Remove account."""
     for acct in gs.pa.remove_account:
         gs.log.debug(f'Submitted account "{acct}" for removal.')
-        gs.ctrl.removeAccount(acct)
+        await gs.ctrl.removeAccount(acct)
 
 
-def action_get_enabled_accounts() -> None:
+async def action_get_enabled_accounts() -> None:
     """Get enabled account ids."""
-    accts = gs.ctrl.getAllEnabledAccounts()
+    accts = await gs.ctrl.getAllEnabledAccounts()
     json_ = {"accountids": accts}
     text = ""
     for acct in accts:
@@ -366,9 +623,9 @@ def action_get_enabled_accounts() -> None:
     )
 
 
-def action_get_conversations() -> None:
+async def action_get_conversations() -> None:
     """Get swarm conversation ids associated with the account."""
-    convs = gs.ctrl.getConversations(gs.account)
+    convs = await gs.ctrl.getConversations(gs.account)
     json_ = {"accountid": gs.account, "conversationids": convs}
     text = ""
     for conv in convs:
@@ -383,9 +640,9 @@ def action_get_conversations() -> None:
     )
 
 
-def action_add_conversation() -> None:
+async def action_add_conversation() -> None:
     """Add swarm conversation to the account."""
-    convid = gs.ctrl.startConversation(gs.account)
+    convid = await gs.ctrl.startConversation(gs.account)
     json_ = {"accountid": gs.account, "conversationid": convid}
     text = convid
     # output format controlled via --output flag
@@ -397,12 +654,20 @@ def action_add_conversation() -> None:
     )
 
 
-def action_remove_conversation() -> None:
+async def action_remove_conversation() -> None:
     """Remove swarm conversation to the account."""
+    import asyncio
+
     text = ""
     rmlist = []
-    for conv in gs.pa.conversations:
-        resp = gs.ctrl.removeConversation(gs.account, conv)
+    # all removals are in flight at the same time
+    resps = await asyncio.gather(
+        *(
+            gs.ctrl.removeConversation(gs.account, conv)
+            for conv in gs.pa.conversations
+        )
+    )
+    for conv, resp in zip(gs.pa.conversations, resps):
         rmlist.append({"conversationid": conv, "success": resp})
         text += f"{gs.account}{SEP}{conv}{SEP}success={resp}\n"
         if resp == 1:
@@ -427,8 +692,10 @@ def action_remove_conversation() -> None:
     )
 
 
-def action_get_conversation_members() -> None:
+async def action_get_conversation_members() -> None:
     """Get members from swarm conversations associated with the account."""
+    import asyncio
+
     if gs.pa.conversations is None:
         gs.log.info(
             "No conversations specified. "
@@ -437,8 +704,14 @@ def action_get_conversation_members() -> None:
         return
     memberslist = []
     text = ""
-    for conv in gs.pa.conversations:
-        members = gs.ctrl.getConversationMembers(gs.account, conv)
+    # all queries are in flight at the same time
+    allmembers = await asyncio.gather(
+        *(
+            gs.ctrl.getConversationMembers(gs.account, conv)
+            for conv in gs.pa.conversations
+        )
+    )
+    for conv, members in zip(gs.pa.conversations, allmembers):
         gs.log.debug(f"members: {members} {type(members)}")
         # members is an array of dictionaries
         # dictionaries have members: lastDisplayed, role, uri
@@ -455,7 +728,7 @@ def action_get_conversation_members() -> None:
             f"accountid {gs.account}{SEP}conversationid {conv}{SEP}userids "
         )
         for member in members:
-            text += f"{member["uri"]}{SEP}"
+            text += f"{member['uri']}{SEP}"
         text += "\n"
     json_ = {"accountid": gs.account, "members": memberslist}
     text = text.strip()
@@ -468,7 +741,7 @@ def action_get_conversation_members() -> None:
     )
 
 
-def action_add_conversation_member() -> None:
+async def action_add_conversation_member() -> None:
     """This will invite a user to a conversation."""
     if gs.pa.conversations is None:
         gs.log.info(
@@ -482,10 +755,10 @@ def action_add_conversation_member() -> None:
                 f"Submitted user {userid} to be added to "
                 f"conversation {conv} in account {gs.account} as members."
             )
-            gs.ctrl.addConversationMember(gs.account, conv, userid)
+            await gs.ctrl.addConversationMember(gs.account, conv, userid)
 
 
-def action_remove_conversation_member() -> None:
+async def action_remove_conversation_member() -> None:
     """This will ban a user from a conversation."""
     if gs.pa.conversations is None:
         gs.log.info(
@@ -499,44 +772,174 @@ def action_remove_conversation_member() -> None:
                 f"Submitted user {userid} to be removed from "
                 f"conversation {conv} in account {gs.account} as members."
             )
-            gs.ctrl.removeConversationMember(gs.account, conv, userid)
+            await gs.ctrl.removeConversationMember(
+                gs.account, conv, userid
+            )
 
 
-# according to linter: function is too complex, C901
-async def send_file(conversations, file):  # noqa: C901
-    """Process file.
+def copy_stdin_to(fout) -> int:
+    """Copy all data piped into stdin into the binary file object fout.
 
-    Send file to conversation.
+    Data is copied in chunks, so memory use does not depend on the
+    size of the piped data. Returns the number of bytes copied.
+    """
+    fin = sys.stdin.buffer
+    fin_fd = fin.fileno()
+    if hasattr(os, "splice") and stat.S_ISFIFO(os.fstat(fin_fd).st_mode):
+        # pipe: move the data inside the kernel, nothing has
+        # been read from stdin buffer before, so nothing is lost
+        fout.flush()
+        fout_fd = fout.fileno()
+        while os.splice(fin_fd, fout_fd, FILE_COPY_CHUNK_SIZE):
+            pass
+        return os.lseek(fout_fd, 0, os.SEEK_CUR)
+    shutil.copyfileobj(fin, fout, FILE_COPY_CHUNK_SIZE)
+    fout.flush()
+    return fout.tell()
+
+
+def copy_stdin_to_temp_file() -> str:
+    """Store the data piped into stdin in a temporary file.
+
+    The file is created in the --tmp-dir directory and registered in
+    gs.temp_files, so that cleanup() removes it in case it is not
+    removed after sending.
+
+    Returns the name of the temporary file.
+    """
+    fout = tempfile.NamedTemporaryFile(
+        mode="wb", prefix="mc-", suffix=".tmp", dir=gs.pa.tmp_dir, delete=False
+    )
+    gs.temp_files.append(fout.name)
+    try:
+        with fout:
+            size = copy_stdin_to(fout)
+    except BaseException:
+        delete_temp_file(fout.name)
+        raise
+    gs.log.debug(
+        f"{size} bytes of file data read from stdin. "
+        f'Temporary file "{fout.name}" was created for file.'
+    )
+    return fout.name
+
+
+def copy_stdin_to_memfd(name: str) -> int:
+    """Store the data piped into stdin in an anonymous memory file.
+
+    The memfd lives in RAM only, nothing is written to disk. It is
+    registered in gs.temp_fds, so that cleanup() closes it.
+
+    Returns the file descriptor of the memfd.
+    """
+    fd = os.memfd_create(name, os.MFD_CLOEXEC)
+    gs.temp_fds.append(fd)
+    try:
+        with open(fd, "wb", closefd=False) as fout:
+            size = copy_stdin_to(fout)
+    except BaseException:
+        close_temp_fd(fd)
+        raise
+    gs.log.debug(
+        f"{size} bytes of file data read from stdin. "
+        f"Memory file with descriptor {fd} was created for file."
+    )
+    return fd
+
+
+def fd_path(fd: int) -> str:
+    """Return a path under which other processes can open our fd."""
+    return f"/proc/{os.getpid()}/fd/{fd}"
+
+
+def can_use_fd_path() -> bool:
+    """Return True if our file descriptors can be opened by path."""
+    return os.path.isdir(f"/proc/{os.getpid()}/fd")
+
+
+def prepare_stdin_file() -> dict:
+    """Prepare the file piped into stdin ("-f -") for sending.
+
+    The daemon only needs a path it can read. Depending on --file-stdin-mode
+    the data is copied into a temporary file or into a memfd. If stdin is
+    a regular file (e.g. "< file.pdf") and mode is not "tmpfile", no copy
+    is made at all; the daemon reads stdin via /proc/<pid>/fd/0.
+
+    A /proc path vanishes when the fd is closed or we exit, but the daemon
+    reads the file after sendFile() returned. Hence a /proc path is only
+    used with --wait-transfers, otherwise the data is copied into a
+    temporary file.
+    """
+    mode = gs.pa.file_stdin_mode
+    fd = sys.stdin.fileno()
+    name = "mc-" + str(uuid.uuid4()) + ".tmp"
+    regular = stat.S_ISREG(os.fstat(fd).st_mode) and can_use_fd_path()
+    if gs.pa.wait_transfers is None and (
+        mode == FILE_STDIN_MEMFD or (mode == FILE_STDIN_AUTO and regular)
+    ):
+        gs.log.warning(
+            f'W124: --file-stdin-mode "{mode}" hands stdin to Jami as a '
+            f"/proc path, which is only valid while {PROG_WITHOUT_EXT} "
+            "runs. Without --wait-transfers stdin is copied into a "
+            "temporary file instead."
+        )
+        gs.warn_count += 1
+        mode = FILE_STDIN_TMPFILE
+    if mode != FILE_STDIN_TMPFILE and regular:
+        gs.log.debug("Stdin is a regular file. It is sent without a copy.")
+        return {
+            "type": "file",
+            "file": "-",
+            "path": fd_path(fd),
+            "name": name,
+            "temporary": False,
+        }
+    if mode == FILE_STDIN_MEMFD:
+        fd = copy_stdin_to_memfd(name)
+        return {
+            "type": "file",
+            "file": "-",
+            "path": fd_path(fd),
+            "name": name,
+            "temporary": True,
+            "fd": fd,
+        }
+    file = copy_stdin_to_temp_file()
+    return {
+        "type": "file",
+        "file": file,
+        "path": os.path.abspath(file),
+        "name": os.path.basename(file),
+        "temporary": True,
+    }
+
+
+def release_item(item: dict) -> None:
+    """Remove the temporary file or memfd of a send item, if any."""
+    if not item.get("temporary"):
+        return
+    if item.get("fd") is not None:
+        close_temp_fd(item["fd"])
+    else:
+        delete_temp_file(item["file"])
+
+
+def prepare_file(file) -> Union[None, dict]:
+    """Prepare a file for sending.
+
+    Returns a send item (see fan_out()) or None if the file cannot be sent.
+    If the file is read from the stdin pipe ("-") the data may be stored in
+    a temporary file or memfd. Then the item has "temporary" set to True and
+    the caller must call release_item() after sending.
 
     Arguments:
     ---------
-    conversations : list
-        list of conversationid-s
     file : str
         file name of file from --file argument
 
     """
-    if not conversations:
-        gs.log.info(
-            "No conversations are given. This should not happen. "
-            "This file is being dropped and NOT sent."
-        )
-        return
-
     if file == "-":  # - means read as pipe from stdin
-        isPipe = True
-        fin_buf = sys.stdin.buffer.read()
-        len_fin_buf = len(fin_buf)
-        file = "mc-" + str(uuid.uuid4()) + ".tmp"
-        gs.log.debug(
-            f"{len_fin_buf} bytes of file data read from stdin. "
-            f'Temporary file "{file}" was created for file.'
-        )
-        fout = open(file, "wb")
-        fout.write(fin_buf)
-        fout.close()
-    else:
-        isPipe = False
+        return prepare_stdin_file()
 
     if not os.path.isfile(file):
         gs.log.debug(
@@ -544,55 +947,43 @@ async def send_file(conversations, file):  # noqa: C901
             "is a directory. "
             "This file is being dropped and NOT sent."
         )
-        return
+        return None
+    return {
+        "type": "file",
+        "file": file,
+        "path": os.path.abspath(file),
+        "name": os.path.basename(file),
+        "temporary": False,
+    }
 
-    try:
-        for conversation in conversations:
-            resp = gs.ctrl.sendFile(
-                gs.account,
-                conversation,
-                os.path.abspath(file),
-                fileDisplayName=os.path.basename(file),
-                replyTo="",
-            )
-            # this never returns anything, resp == None
-            gs.log.debug(f"ctrl.sendFile() returned {resp}.")
-            gs.log.info(
-                f'An attempt was made to send file "{file}" '
-                f'to conversation "{conversation}". Response was {resp}.'
-            )
-    except Exception:
-        gs.log.error("E147: " f"File send of file {file} failed. Sorry.")
-        gs.err_count += 1
-        gs.log.debug("Here is the traceback.\n" + traceback.format_exc())
 
-    if isPipe:
-        # rm temp file
-        os.remove(file)
+def get_message_format() -> str:
+    """Return the message format selected in the command line."""
+    if gs.pa.code:
+        return FORMAT_CODE
+    if gs.pa.markdown:
+        return FORMAT_MARKDOWN
+    if gs.pa.html:
+        return FORMAT_HTML
+    if gs.pa.emojize:
+        return FORMAT_EMOJIZE
+    return FORMAT_TEXT
 
 
-# according to linter: function is too complex, C901
-async def send_message(conversations, message):  # noqa: C901
-    """Process message.
+def prepare_message(message, format: str = None) -> Union[None, dict]:
+    """Format a message according to the command line arguments.
 
-    Format message according to instructions from command line arguments.
-    Then send the one message to all conversations.
+    Returns a send item (see fan_out()) or None if the message is empty.
 
     Arguments:
     ---------
-    conversations : list
-        list of conversationsid-s
     message : str
         message to send as read from -m, pipe or keyboard
         message is without mime formatting
+    format : str
+        one of FORMATS, None means format given in the command line
 
     """
-    if not conversations:
-        gs.log.info(
-            "No conversations are given. This should not happen. "
-            "This text message is being dropped and NOT sent."
-        )
-        return
     # remove leading AND trailing newlines to beautify
     message = message.strip("\n")
 
@@ -601,140 +992,719 @@ async def send_message(conversations, message):  # noqa: C901
             "The message is empty. "
             "This message is being dropped and NOT sent."
         )
-        return
+        return None
 
-    if gs.pa.code:
-        gs.log.debug('Sending message in format "code".')
+    if format is None:
+        format = get_message_format()
+    gs.log.debug(f'Sending message in format "{format}".')
+    message, formatted_message = format_message(message, format)
+    return {"type": "message", "message": message, "text": formatted_message}
+
+
+def format_message(message: str, format: str = FORMAT_TEXT) -> tuple:
+    """Return (message, formatted message) for a message in format.
+
+    Arguments:
+    ---------
+    message : str
+        message without mime formatting
+    format : str
+        one of FORMATS
+
+    """
+    if format == FORMAT_CODE:
         formatted_message = "<pre><code>" + message + "\n</code></pre>\n"
         # next line: work-around for Element Android
         message = "```\n" + message + "\n```"  # to format it as code
         formatted_message = message
-    elif gs.pa.markdown:
-        gs.log.debug(
-            "Converting message from MarkDown into HTML. "
-            'Sending message in format "markdown".'
-        )
+    elif format == FORMAT_MARKDOWN:
+        import markdown
+
         # e.g. converts from "-abc" to "<ul><li>abc</li></ul>"
-        formatted_message = markdown(message)
-    elif gs.pa.html:
-        gs.log.debug('Sending message in format "html".')
+        formatted_message = markdown.markdown(message)
+    elif format == FORMAT_HTML:
         formatted_message = message  # the same for the time being
-    elif gs.pa.emojize:
-        gs.log.debug('Sending message in format "emojized".')
+    elif format == FORMAT_EMOJIZE:
+        import emoji
+
         # convert emoji shortcodes if present
         formatted_message = emoji.emojize(message)
     else:
-        gs.log.debug('Sending message in format "text".')
         formatted_message = message
+    return message, formatted_message
+
+
+async def fan_out(
+    ctrl: libjamiCtrlAsync,
+    account: str,
+    conversations: list,
+    items: list,
+    parallel: int = PARALLEL_DEFAULT,
+    substitute=None,
+    tracker: libjamiTransferTracker = None,
+    semaphore: asyncio.Semaphore = None,
+) -> list:
+    """Send all items to all conversations.
+
+    Every conversation gets the items in the given order: an item is only
+    sent after the daemon replied to the previous item of the same
+    conversation. Different conversations are served concurrently, with at
+    most `parallel` DBUS calls in flight at any time.
 
-    try:
-        for conversation in conversations:
-            resp = gs.ctrl.sendMessage(
-                gs.account,
-                conversation,
-                formatted_message,
-                commitId="",
-                flag=0,
+    Arguments:
+    ---------
+    ctrl : asynchronous Jami controller
+    account : accountid used for sending
+    conversations : list of conversationids
+    items : list of send items as returned by prepare_message() and
+        prepare_file(), i.e. dicts with "type" "message" and key "text",
+        or with "type" "file" and keys "path" and "name"
+    parallel : maximum number of concurrent DBUS calls
+    substitute : optional function (conversationid, item) -> item that
+        returns the item to be sent instead of item, or None to skip it
+    tracker : optional started transfer tracker, every file sent is
+        registered with it and its transfer record is added to the
+        result under key "transfer"
+    semaphore : optional semaphore shared by several fan_out() calls,
+        replaces parallel
+
+    Returns a list of result dicts, one per conversation and item, in
+    the order of conversations and items. Each result has the keys
+    "conversationid", "type", "item", "success", "skipped", "response",
+    "error", "started" (seconds since start of fan_out) and "duration"
+    (seconds).
+
+    """
+    import asyncio
+
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, parallel))
+    t0 = time.monotonic()
+
+    async def send_item(conversation, item):
+        if substitute is not None:
+            item = substitute(conversation, item)
+            if item is None:
+                return None
+        async with semaphore:
+            started = time.monotonic()
+            response = None
+            error = None
+            transfer = None
+            try:
+                if item["type"] == "file":
+                    if tracker is not None:
+                        transfer = tracker.expect(
+                            account, conversation, item["path"], item["name"]
+                        )
+                    response = await ctrl.sendFile(
+                        account,
+                        conversation,
+                        item["path"],
+                        fileDisplayName=item["name"],
+                        replyTo="",
+                    )
+                else:
+                    response = await ctrl.sendMessage(
+                        account,
+                        conversation,
+                        item["text"],
+                        commitId="",
+                        flag=0,
+                    )
+            except Exception as e:
+                error = e
+                if transfer is not None:
+                    tracker.cancel(transfer)
+            finished = time.monotonic()
+        result = {
+            "conversationid": conversation,
+            "type": item["type"],
+            "item": item["path"] if item["type"] == "file" else item["text"],
+            "success": error is None,
+            "skipped": False,
+            "response": response,
+            "error": None if error is None else str(error),
+            "started": round(started - t0, 6),
+            "duration": round(finished - started, 6),
+        }
+        if transfer is not None:
+            result["transfer"] = transfer
+        return result
+
+    async def send_conversation(conversation):
+        # items of one conversation strictly one after another
+        results = []
+        for item in items:
+            result = await send_item(conversation, item)
+            if result is None:
+                result = {
+                    "conversationid": conversation,
+                    "type": item["type"],
+                    "item": (
+                        item["path"]
+                        if item["type"] == "file"
+                        else item["text"]
+                    ),
+                    "success": True,
+                    "skipped": True,
+                    "response": None,
+                    "error": None,
+                    "started": round(time.monotonic() - t0, 6),
+                    "duration": 0.0,
+                }
+            results.append(result)
+        return results
+
+    results = await asyncio.gather(
+        *(send_conversation(conv) for conv in conversations)
+    )
+    return [result for conv_results in results for result in conv_results]
+
+
+def send_status(result: dict) -> str:
+    """Return the status of a fan_out() result as a short word."""
+    if result.get("skipped"):
+        return "skipped"
+    return "ok" if result["success"] else "failed"
+
+
+def report_send_results(results: list, table: bool = True) -> None:
+    """Log the results of fan_out() and optionally print them.
+
+    The result table is printed if --send-report is used and table is True.
+    """
+    for result in results:
+        what = "file" if result["type"] == "file" else "message"
+        if result.get("skipped"):
+            gs.log.info(
+                f'{what.capitalize()} "{result["item"]}" was already sent '
+                f'to conversation "{result["conversationid"]}". Skipped.'
             )
-            # this never returns anything, resp == None
-            gs.log.debug(f"ctrl.sendMessage() returned {resp}.")
+        elif result["success"]:
             gs.log.info(
-                f'An attempt was made to send message "{message}" '
-                f'to conversation "{conversation}". Response was {resp}.'
+                f'An attempt was made to send {what} "{result["item"]}" '
+                f'to conversation "{result["conversationid"]}". '
+                f'Response was {result["response"]}. '
+                f'It took {result["duration"]:.3f} seconds.'
             )
-    except Exception:
-        gs.log.error("E151: " "Message send failed. Sorry.")
-        gs.err_count += 1
-        gs.log.debug("Here is the traceback.\n" + traceback.format_exc())
+        else:
+            errnr = "E147: " if result["type"] == "file" else "E151: "
+            gs.log.error(
+                errnr + f'Sending {what} "{result["item"]}" '
+                f'to conversation "{result["conversationid"]}" failed. '
+                f'Sorry. ({result["error"]})'
+            )
+            gs.err_count += 1
+    if not table or not gs.pa.send_report or not results:
+        return
+    text = ""
+    for result in results:
+        item = result["item"].replace("\n", " ")
+        text += (
+            f'{result["conversationid"]}{SEP}{result["type"]}{SEP}'
+            f'{send_status(result)}{SEP}'
+            f'{result["started"]:.3f}{SEP}{result["duration"]:.3f}{SEP}'
+            f"{item}\n"
+        )
+    text = text.strip()
+    json_ = {"accountid": gs.account, "results": results}
+    # output format controlled via --output flag
+    print_output(
+        gs.pa.output,
+        text=text,
+        json_=json_,
+    )
 
 
-async def stream_messages_from_pipe(conversations):
-    """Read input from pipe if available.
+def hash_file(path: str, algorithm: str = "sha256") -> str:
+    """Return the hex digest of a file, read in chunks."""
+    import hashlib
 
-    Read pipe line by line. For each line received, immediately
-    send it.
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, algorithm).hexdigest()
 
-    Arguments:
-    ---------
-    conversations : list of conversationids
 
+async def hash_files(items: list) -> None:
+    """Add key "sha256" to all file items.
+
+    Files are hashed concurrently in worker threads, hashlib releases the
+    GIL while hashing, so several files are hashed in parallel.
     """
-    stdin_ready = select.select(
-        [
-            sys.stdin,
-        ],
-        [],
-        [],
-        0.0,
-    )[  # noqa
-        0
-    ]  # noqa
-    if not stdin_ready:
-        gs.log.debug(
-            "stdin is not ready for streaming. "
-            "A pipe could be used, but pipe could be empty, "
-            "stdin could also be a keyboard."
-        )
-    else:
-        gs.log.debug(
-            "stdin is ready. Something "
-            "is definitely piped into program from stdin. "
-            "Reading message from stdin pipe."
-        )
-    if ((not stdin_ready) and (not sys.stdin.isatty())) or stdin_ready:
-        if not sys.stdin.isatty():
-            gs.log.debug(
-                "Pipe was definitely used, but pipe might be empty. "
-                "Trying to read from pipe in any case."
-            )
+    import asyncio
+
+    files = [item for item in items if item["type"] == "file"]
+    digests = await asyncio.gather(
+        *(asyncio.to_thread(hash_file, item["path"]) for item in files)
+    )
+    for item, digest in zip(files, digests):
+        item["sha256"] = digest
+
+
+def prune_dedupe_index(index: dict, ttl: int, now: float) -> dict:
+    """Return index without entries older than ttl seconds."""
+    pruned = {}
+    for digest, sent in index.items():
+        sent = {
+            conv: ts
+            for conv, ts in sent.items()
+            if isinstance(ts, (int, float)) and now - ts < ttl
+        }
+        if sent:
+            pruned[digest] = sent
+    return pruned
+
+
+def save_json_file(path: str, data) -> None:
+    """Write data as JSON to path, replacing the file atomically.
+
+    The data is synced to disk before the rename, so after a crash path
+    holds either the old or the new data, never a torn file.
+    """
+    dir = os.path.dirname(path) or "."
+    os.makedirs(dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        mode="w",
+        encoding="utf-8",
+        dir=dir,
+        prefix=f".{os.path.basename(path)}-",
+        delete=False,
+    ) as f:
         try:
-            for line in sys.stdin:
-                await send_message(conversations, line)
-                gs.log.debug("Using data from stdin pipe stream as message.")
-        except EOFError:  # EOF when reading a line
-            gs.log.debug(
-                "Reading from stdin resulted in EOF. This can happen "
-                "when a pipe was used, but the pipe is empty. "
-                "No message will be generated."
-            )
-        except UnicodeDecodeError:
-            gs.log.info(
-                "Reading from stdin resulted in UnicodeDecodeError. This "
-                "can happen if you try to pipe binary data for a text "
-                "message. For a text message only pipe text via stdin, "
-                "not binary data. No message will be generated."
-            )
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
 
 
-def get_messages_from_pipe() -> list:
-    """Read input from pipe if available.
+def load_dedupe_index(path: str) -> dict:
+    """Read the dedupe index {sha256: {conversationid: timestamp}}.
 
-    Return [] if no input available on pipe stdin.
-    Return ["some-msg"] if input is availble.
-    Might also return [""] of course if "" was in pipe.
-    Currently there is at most 1 msg in the returned list.
+    A missing or unreadable index is treated as empty.
     """
-    messages = []
-    stdin_ready = select.select(
-        [
-            sys.stdin,
-        ],
-        [],
-        [],
-        0.0,
-    )[  # noqa
-        0
-    ]  # noqa
-    if not stdin_ready:
-        gs.log.debug(
-            "stdin is not ready for reading. "
-            "A pipe could be used, but pipe could be empty, "
-            "stdin could also be a keyboard."
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if isinstance(index, dict):
+            return index
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        gs.log.warning(
+            f'W115: Dedupe index "{path}" could not be read and is '
+            f"ignored. ({e})"
         )
-    else:
-        gs.log.debug(
-            "stdin is ready. Something "
-            "is definitely piped into program from stdin. "
+        gs.warn_count += 1
+    return {}
+
+
+def save_dedupe_index(path: str, sent: dict, ttl: int) -> None:
+    """Add sent {sha256: {conversationid: timestamp}} to the index.
+
+    The index is read again just before writing, so entries written by
+    other processes in the meantime are kept. It is replaced atomically.
+    """
+    now = time.time()
+    index = load_dedupe_index(path)
+    for digest, convs in sent.items():
+        index.setdefault(digest, {}).update(convs)
+    index = prune_dedupe_index(index, ttl, now)
+    save_json_file(path, index)
+
+
+def dedupe_reference_item(item: dict, sent_at: float) -> dict:
+    """Return a message item that refers to an already sent file."""
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sent_at))
+    text = (
+        f'File "{item["name"]}" is unchanged, it was already sent at '
+        f'{when} (sha256 {item["sha256"]}).'
+    )
+    return {"type": "message", "message": text, "text": text}
+
+
+async def dedupe_items(items: list):
+    """Prepare the --dedupe check of file items.
+
+    Returns (substitute, index) where substitute is a function for
+    fan_out() and index the pruned dedupe index.
+    """
+    import asyncio
+
+    path = gs.pa.dedupe
+    index, _ = await asyncio.gather(
+        asyncio.to_thread(load_dedupe_index, path), hash_files(items)
+    )
+    index = prune_dedupe_index(index, gs.pa.dedupe_ttl, time.time())
+
+    def substitute(conversation, item):
+        if item["type"] != "file":
+            return item
+        sent_at = index.get(item["sha256"], {}).get(conversation)
+        if sent_at is None:
+            return item
+        gs.log.debug(
+            f'File "{item["path"]}" with sha256 {item["sha256"]} was sent to '
+            f'conversation "{conversation}" before. Not sending it again.'
+        )
+        if gs.pa.dedupe_action == DEDUPE_REFERENCE:
+            return dedupe_reference_item(item, sent_at)
+        return None
+
+    return substitute
+
+
+def record_sent_files(results: list, items: list) -> None:
+    """Remember files successfully sent in the --dedupe index."""
+    digests = {
+        item["path"]: item["sha256"] for item in items if "sha256" in item
+    }
+    now = time.time()
+    sent = {}
+    for result in results:
+        if (
+            result["type"] == "file"
+            and result["success"]
+            and not result["skipped"]
+            and result["item"] in digests
+        ):
+            digest = digests[result["item"]]
+            sent.setdefault(digest, {})[result["conversationid"]] = now
+    if sent:
+        save_dedupe_index(gs.pa.dedupe, sent, gs.pa.dedupe_ttl)
+
+
+def format_rate(rate: Union[None, float]) -> str:
+    """Return bytes per second in human readable form."""
+    if rate is None:
+        return "-"
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if rate < 1000:
+            return f"{rate:.1f} {unit}"
+        rate /= 1000
+    return f"{rate:.1f} GB/s"
+
+
+def report_transfers(
+    transfers: list, complete: bool, table: bool = True
+) -> None:
+    """Log the final state of file transfers and optionally print it."""
+    if not complete:
+        gs.log.warning(
+            "W116: Not all file transfers finished within "
+            f"{gs.pa.wait_transfers} seconds. "
+            "Unfinished transfers might fail when the program ends."
+        )
+        gs.warn_count += 1
+    for transfer in transfers:
+        if transfer["duration"] is not None and not transfer["success"]:
+            gs.log.error(
+                f'E257: Transfer of file "{transfer["path"]}" to '
+                f'conversation "{transfer["conversationid"]}" failed '
+                f'with status "{transfer["status"]}". Sorry.'
+            )
+            gs.err_count += 1
+    if not table:
+        return
+    text = ""
+    for transfer in transfers:
+        duration = transfer["duration"]
+        text += (
+            f'{transfer["conversationid"]}{SEP}{transfer["status"]}{SEP}'
+            f'{transfer["bytes"]}{SEP}'
+            f'{"-" if duration is None else f"{duration:.3f}"}{SEP}'
+            f'{format_rate(transfer["rate"])}{SEP}{transfer["path"]}\n'
+        )
+    text = text.strip()
+    json_ = {
+        "accountid": gs.account,
+        "complete": complete,
+        "transfers": [
+            {k: v for k, v in transfer.items() if k != "started"}
+            for transfer in transfers
+        ],
+    }
+    # output format controlled via --output flag
+    print_output(
+        gs.pa.output,
+        text=text,
+        json_=json_,
+    )
+
+
+async def send_items(conversations: list, items: list) -> None:
+    """Send prepared items to all conversations and report results.
+
+    With --wait-transfers the temporary files are only removed after the
+    file transfers finished, as the daemon reads them during the transfer.
+    """
+    import asyncio
+
+    if not items:
+        return
+    tracker = None
+    try:
+        substitute = None
+        dedupe = gs.pa.dedupe and any(i["type"] == "file" for i in items)
+        if dedupe:
+            substitute = await dedupe_items(items)
+        if gs.pa.wait_transfers is not None and any(
+            i["type"] == "file" for i in items
+        ):
+            from .controller import libjamiTransferTracker
+
+            tracker = libjamiTransferTracker(gs.ctrl)
+            tracker.start()
+        results = await fan_out(
+            gs.ctrl,
+            gs.account,
+            conversations,
+            items,
+            gs.pa.parallel,
+            substitute=substitute,
+            tracker=tracker,
+        )
+        report_send_results(results)
+        if dedupe:
+            await asyncio.to_thread(record_sent_files, results, items)
+        if tracker is not None:
+            transfers = [r["transfer"] for r in results if "transfer" in r]
+            complete = await tracker.wait(
+                transfers, gs.pa.wait_transfers or None
+            )
+            report_transfers(transfers, complete)
+    finally:
+        if tracker is not None:
+            await tracker.close()
+        for item in items:
+            release_item(item)
+
+
+async def send_file(conversations, file):
+    """Process file.
+
+    Send file to conversation.
+
+    Arguments:
+    ---------
+    conversations : list
+        list of conversationid-s
+    file : str
+        file name of file from --file argument
+
+    """
+    if not conversations:
+        gs.log.info(
+            "No conversations are given. This should not happen. "
+            "This file is being dropped and NOT sent."
+        )
+        return
+    item = prepare_file(file)
+    if item:
+        await send_items(conversations, [item])
+
+
+async def send_message(conversations, message):
+    """Process message.
+
+    Format message according to instructions from command line arguments.
+    Then send the one message to all conversations.
+
+    Arguments:
+    ---------
+    conversations : list
+        list of conversationsid-s
+    message : str
+        message to send as read from -m, pipe or keyboard
+        message is without mime formatting
+
+    """
+    if not conversations:
+        gs.log.info(
+            "No conversations are given. This should not happen. "
+            "This text message is being dropped and NOT sent."
+        )
+        return
+    item = prepare_message(message)
+    if item:
+        await send_items(conversations, [item])
+
+
+async def read_stdin_chunks():
+    """Read stdin without blocking the event loop.
+
+    Async generator yielding the data piped into stdin as bytes chunks.
+    Pipes and sockets are connected to an asyncio.StreamReader, so other
+    tasks (sending, timers, daemon signals) keep running while waiting for
+    input. Everything else, e.g. regular files ("< file"), /dev/null or a
+    terminal, cannot be watched by the event loop reliably and is read in
+    a worker thread instead.
+
+    The event loop sets O_NONBLOCK on the pipe. The flag belongs to the
+    open file description shared with fd 0 and with the invoking shell or
+    pipeline, so it is restored when reading ends.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    # a duplicate, so that closing the transport leaves sys.stdin open
+    pipe = os.fdopen(os.dup(sys.stdin.fileno()), "rb", buffering=0)
+    mode = os.fstat(pipe.fileno()).st_mode
+    if not (stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode)):
+        try:
+            while chunk := await asyncio.to_thread(
+                pipe.read, STDIN_CHUNK_SIZE
+            ):
+                yield chunk
+        finally:
+            pipe.close()
+        return
+    blocking = os.get_blocking(sys.stdin.fileno())
+    reader = asyncio.StreamReader(limit=STDIN_CHUNK_SIZE)
+    try:
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), pipe
+        )
+        try:
+            while chunk := await reader.read(STDIN_CHUNK_SIZE):
+                yield chunk
+        finally:
+            transport.close()
+    finally:
+        # the dup may already be closed, fd 0 shares the flag with it
+        os.set_blocking(sys.stdin.fileno(), blocking)
+
+
+async def read_text_from_stdin():
+    """Async generator yielding the text piped into stdin in chunks.
+
+    Raises UnicodeDecodeError if stdin does not contain valid text.
+    """
+    decoder = codecs.getincrementaldecoder(sys.stdin.encoding or "utf-8")()
+    async for chunk in read_stdin_chunks():
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+async def read_lines_from_stdin(queue: asyncio.Queue) -> None:
+    """Read stdin line by line and put the lines into queue.
+
+    Each line is put as tuple (arrival time, line), the arrival time is
+    taken from the event loop clock. At EOF None is put. If reading
+    fails the exception is put.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    parts = []  # pieces of the current, not yet complete line
+    try:
+        async for text in read_text_from_stdin():
+            *lines, rest = text.split("\n")
+            for line in lines:
+                parts.append(line + "\n")
+                await queue.put((loop.time(), "".join(parts)))
+                parts = []
+            if rest:
+                parts.append(rest)
+        if parts:  # last line without newline
+            await queue.put((loop.time(), "".join(parts)))
+    except Exception as e:
+        await queue.put(e)
+    await queue.put(None)
+
+
+async def coalesce_lines(queue: asyncio.Queue, flush_ms: int, max_bytes: int):
+    """Merge lines that arrive close together into one message.
+
+    Async generator reading what read_lines_from_stdin() puts into queue.
+    A message is yielded at the latest flush_ms milliseconds after the
+    arrival of its first line, or as soon as it reaches max_bytes bytes.
+    A line that would make the message exceed max_bytes starts the next
+    message. A single line longer than max_bytes is yielded by itself.
+    If flush_ms is 0 every line is yielded by itself right away.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    batch = []
+    size = 0
+    deadline = 0.0
+    while True:
+        if batch:
+            try:
+                entry = await asyncio.wait_for(
+                    queue.get(), max(0.0, deadline - loop.time())
+                )
+            except TimeoutError:
+                yield "".join(batch)
+                batch, size = [], 0
+                continue
+        else:
+            entry = await queue.get()
+        if entry is None or isinstance(entry, Exception):
+            if batch:
+                yield "".join(batch)
+            if entry is None:
+                return
+            raise entry
+        arrival, line = entry
+        if flush_ms <= 0:
+            yield line
+            continue
+        length = len(line.encode("utf-8"))
+        if batch and size + length > max_bytes:
+            yield "".join(batch)
+            batch, size = [], 0
+        if not batch:
+            deadline = arrival + flush_ms / 1000
+        batch.append(line)
+        size += length
+        if size >= max_bytes or deadline <= loop.time():
+            yield "".join(batch)
+            batch, size = [], 0
+
+
+async def stream_messages_from_pipe(conversations):
+    """Read input from pipe if available.
+
+    Read pipe line by line. For each line received, immediately
+    send it. If --stream-flush-ms is set, lines arriving within that
+    time window (and up to --stream-max-bytes) are sent as one message.
+    Reading continues while messages are being sent.
+
+    Arguments:
+    ---------
+    conversations : list of conversationids
+
+    """
+    import asyncio
+
+    stdin_ready = select.select(
+        [
+            sys.stdin,
+        ],
+        [],
+        [],
+        0.0,
+    )[  # noqa
+        0
+    ]  # noqa
+    if not stdin_ready:
+        gs.log.debug(
+            "stdin is not ready for streaming. "
+            "A pipe could be used, but pipe could be empty, "
+            "stdin could also be a keyboard."
+        )
+    else:
+        gs.log.debug(
+            "stdin is ready. Something "
+            "is definitely piped into program from stdin. "
             "Reading message from stdin pipe."
         )
     if ((not stdin_ready) and (not sys.stdin.isatty())) or stdin_ready:
@@ -743,12 +1713,14 @@ def get_messages_from_pipe() -> list:
                 "Pipe was definitely used, but pipe might be empty. "
                 "Trying to read from pipe in any case."
             )
-        message = ""
+        queue = asyncio.Queue()
+        reader = asyncio.create_task(read_lines_from_stdin(queue))
         try:
-            for line in sys.stdin:
-                message += line
-            gs.log.debug("Using data from stdin pipe as message.")
-            messages.append(message)
+            async for message in coalesce_lines(
+                queue, gs.pa.stream_flush_ms, gs.pa.stream_max_bytes
+            ):
+                gs.log.debug("Using data from stdin pipe stream as message.")
+                await send_message(conversations, message)
         except EOFError:  # EOF when reading a line
             gs.log.debug(
                 "Reading from stdin resulted in EOF. This can happen "
@@ -762,6 +1734,141 @@ def get_messages_from_pipe() -> list:
                 "message. For a text message only pipe text via stdin, "
                 "not binary data. No message will be generated."
             )
+        finally:
+            if not reader.done():
+                reader.cancel()
+
+
+def split_by_size(text: str, max_bytes: int) -> list:
+    """Cut text into pieces of at most max_bytes bytes (UTF-8).
+
+    Pieces are cut at character boundaries. max_bytes of 0 means no limit.
+    A single character longer than max_bytes forms a piece by itself.
+    """
+    data = text.encode("utf-8")
+    if not max_bytes or len(data) <= max_bytes:
+        return [text]
+    pieces = []
+    while len(data) > max_bytes:
+        cut = max_bytes
+        while cut > 0 and (data[cut] & 0xC0) == 0x80:  # UTF-8 continuation
+            cut -= 1
+        if cut == 0:  # max_bytes smaller than one character, take it whole
+            cut = max_bytes
+            while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+                cut += 1
+        pieces.append(data[:cut].decode("utf-8"))
+        data = data[cut:]
+    pieces.append(data.decode("utf-8"))
+    return pieces
+
+
+async def split_text_stream(chunks, separator: str, max_bytes: int):
+    """Split a stream of text chunks into messages as data arrives.
+
+    Async generator. chunks is an async iterable of str. Messages are
+    separated by separator (if not empty) and are at most max_bytes bytes
+    long (if not 0); longer messages are cut into several messages. Only
+    the message currently being assembled is kept in memory, so with
+    a separator or max_bytes memory use does not grow with the input.
+    """
+    parts = []  # pieces of the current message
+    size = 0  # bytes in parts
+    tail = ""  # end of the text seen so far, might start a separator
+    keep = len(separator) - 1 if separator else 0
+    async for chunk in chunks:
+        segments = (tail + chunk).split(separator) if separator else [chunk]
+        for segment in segments[:-1]:  # each one completes a message
+            parts.append(segment)
+            for piece in split_by_size("".join(parts), max_bytes):
+                yield piece
+            parts, size = [], 0
+        last = segments[-1]
+        if keep:
+            last, tail = last[:-keep], last[-keep:]
+        parts.append(last)
+        size += len(last.encode("utf-8"))
+        if max_bytes and size > max_bytes:
+            *pieces, rest = split_by_size("".join(parts), max_bytes)
+            for piece in pieces:
+                yield piece
+            parts, size = [rest], len(rest.encode("utf-8"))
+    parts.append(tail)
+    for piece in split_by_size("".join(parts), max_bytes):
+        yield piece
+
+
+def get_split_separator() -> str:
+    """Return the de-escaped --split separator or "" if not used."""
+    if not gs.pa.split:
+        return ""
+    # gs.pa.split can have escape characters, it has to be de-escaped
+    return bytes(gs.pa.split, "utf-8").decode("unicode_escape")
+
+
+async def stream_messages_from_pipe_data():
+    """Yield the messages contained in the data piped into stdin.
+
+    Async generator. Without --split all data is one message. The data is
+    read in chunks and split with --split and --max-message-size as it
+    arrives.
+    """
+    try:
+        async for message in split_text_stream(
+            read_text_from_stdin(),
+            get_split_separator(),
+            gs.pa.max_message_size,
+        ):
+            yield message
+        gs.log.debug("Using data from stdin pipe as message.")
+    except UnicodeDecodeError:
+        gs.log.info(
+            "Reading from stdin resulted in UnicodeDecodeError. This "
+            "can happen if you try to pipe binary data for a text "
+            "message. For a text message only pipe text via stdin, "
+            "not binary data. No further message will be generated."
+        )
+
+
+def get_messages_from_pipe() -> list:
+    """Read input from pipe if available.
+
+    Return [] if no input available on pipe stdin.
+    Return [async-generator] if input is availble. The async generator
+    yields the message(s) read from the pipe, see
+    stream_messages_from_pipe_data(). Data is only read from the pipe
+    while the generator is being iterated.
+    """
+    messages = []
+    stdin_ready = select.select(
+        [
+            sys.stdin,
+        ],
+        [],
+        [],
+        0.0,
+    )[  # noqa
+        0
+    ]  # noqa
+    if not stdin_ready:
+        gs.log.debug(
+            "stdin is not ready for reading. "
+            "A pipe could be used, but pipe could be empty, "
+            "stdin could also be a keyboard."
+        )
+    else:
+        gs.log.debug(
+            "stdin is ready. Something "
+            "is definitely piped into program from stdin. "
+            "Reading message from stdin pipe."
+        )
+    if ((not stdin_ready) and (not sys.stdin.isatty())) or stdin_ready:
+        if not sys.stdin.isatty():
+            gs.log.debug(
+                "Pipe was definitely used, but pipe might be empty. "
+                "Trying to read from pipe in any case."
+            )
+        messages.append(stream_messages_from_pipe_data())
     return messages
 
 
@@ -845,15 +1952,34 @@ async def send_messages_and_files(conversations, messages):
     Arguments:
     ---------
     conversations : list of conversationsids
-    messages : list of messages to send
+    messages : list of messages to send, elements are either str or
+        async generators yielding str (messages read from the pipe)
 
     """
+    items = []
     if gs.pa.file:
         for file in gs.pa.file:
-            await send_file(conversations, file)
+            item = prepare_file(file)
+            if item:
+                items.append(item)
 
     for message in messages:
-        await send_message(conversations, message)
+        if not isinstance(message, str):
+            # async generator yielding messages read from the pipe
+            # send what we have so far, then one message at a time as
+            # they are read, so the pipe is never held in memory as a whole
+            await send_items(conversations, items)
+            items = []
+            async for piped_message in message:
+                item = prepare_message(piped_message)
+                if item:
+                    await send_items(conversations, [item])
+            continue
+        item = prepare_message(message)
+        if item:
+            items.append(item)
+    # one fan-out for all items, conversations are served concurrently
+    await send_items(conversations, items)
 
 
 async def process_arguments_and_input(conversations):
@@ -892,171 +2018,1769 @@ async def process_arguments_and_input(conversations):
             else:
                 messages_from_commandline += [m]
 
-    gs.log.debug(f"Messages from pipe:         {messages_from_pipe}")
-    gs.log.debug(f"Messages from keyboard:     {messages_from_keyboard}")
-    gs.log.debug(f"Messages from command-line: {messages_from_commandline}")
+    gs.log.debug(f"Messages from pipe:         {messages_from_pipe}")
+    gs.log.debug(f"Messages from keyboard:     {messages_from_keyboard}")
+    gs.log.debug(f"Messages from command-line: {messages_from_commandline}")
+
+    messages_all = (
+        messages_from_commandline + messages_from_pipe + messages_from_keyboard
+    )  # keyboard at end
+
+    # loop thru all msgs and split them, piped data (async generators)
+    # is split while it is being read
+    decoded_string = get_split_separator()
+    if decoded_string:
+        gs.log.debug(f'String used for splitting is: "{decoded_string}"')
+    messages_all_split = []
+    for m in messages_all:
+        if not isinstance(m, str):
+            messages_all_split.append(m)
+            continue
+        for part in m.split(decoded_string) if decoded_string else [m]:
+            messages_all_split += split_by_size(part, gs.pa.max_message_size)
+
+    if (gs.pa.file or messages_all_split) and not conversations:
+        gs.log.error(
+            "E255: "
+            "No conversations are given. Specify --conversations. "
+            "Nothing is being sent. Try again with --conversations set."
+        )
+        gs.err_count += 1
+        return
+
+    await send_messages_and_files(conversations, messages_all_split)
+    # now we are done with all the usual sends, now we start streaming
+    if streaming:
+        await stream_messages_from_pipe(conversations)
+
+
+async def read_text_from_file(file: str):
+    """Async generator yielding the text of a file in chunks.
+
+    "-" means stdin.
+    """
+    import asyncio
+
+    if file == "-":
+        async for chunk in read_text_from_stdin():
+            yield chunk
+        return
+    with open(file, "r", encoding="utf-8") as f:
+        while chunk := await asyncio.to_thread(f.read, STDIN_CHUNK_SIZE):
+            yield chunk
+
+
+def as_list(value, key: str) -> list:
+    """Return a string or list of strings from a batch job as list."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return value
+    raise ValueError(f'"{key}" must be a string or a list of strings.')
+
+
+async def resolve_job_account(record: dict) -> str:
+    """Return accountid of "account" of a job, default is --account.
+
+    Raises ValueError if there is no valid account.
+    """
+    account = gs.account
+    if record.get("account") is not None:
+        account = await gs.ctrl.resolveAccount(
+            str(record["account"]), await gs.ctrl.getAllEnabledAccounts()
+        )
+        if account is None:
+            raise ValueError(f'Account "{record["account"]}" is not valid.')
+    if account is None:
+        raise ValueError('"account" is missing and --account was not used.')
+    return account
+
+
+async def prepare_batch_job(line: str) -> dict:
+    """Parse one line of a --batch manifest into a job.
+
+    Returns dict with keys "id", "account", "conversations" and "items".
+    Raises ValueError if the line is not a valid job.
+    """
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Not valid JSON. ({e})") from None
+    return await prepare_send_job(record)
+
+
+async def prepare_send_job(record: dict) -> dict:
+    """Turn a send job {account, conversations, message, file, format, id}
+    into dict with keys "id", "account", "conversations" and "items".
+
+    Raises ValueError if record is not a valid job.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("A job must be a JSON object.")
+    conversations = as_list(record.get("conversations"), "conversations")
+    messages = as_list(record.get("message"), "message")
+    files = as_list(record.get("file"), "file")
+    format = record.get("format", get_message_format())
+    if not conversations:
+        raise ValueError('"conversations" is missing.')
+    if format not in FORMATS:
+        raise ValueError(
+            f'"format" must be one of {", ".join(FORMATS)}, not "{format}".'
+        )
+    if "-" in files or any(m in ("-", "_") for m in messages):
+        raise ValueError("Stdin cannot be used in a batch job.")
+    account = await resolve_job_account(record)
+    items = []
+    for file in files:  # files first, like -f and -m
+        item = prepare_file(file)
+        if item is None:
+            raise ValueError(f'File "{file}" does not exist.')
+        items.append(item)
+    for message in messages:
+        item = prepare_message(message, format)
+        if item is not None:
+            items.append(item)
+    if not items:
+        raise ValueError('Nothing to send, "message" or "file" is missing.')
+    return {
+        "id": record.get("id"),
+        "account": account,
+        "conversations": conversations,
+        "items": items,
+    }
+
+
+def write_batch_result(
+    number: int,
+    job: Union[None, dict],
+    results: list,
+    error: str = None,
+    line: str = None,
+) -> None:
+    """Print the JSON Lines result of a --batch job.
+
+    If the job could not be prepared, job is None and the "id" is taken
+    from line, if possible.
+    """
+    job_id = None if job is None else job["id"]
+    if job is None and line is not None:
+        try:
+            job_id = json.loads(line).get("id")
+        except Exception:
+            pass
+    if error is None and not all(r["success"] for r in results):
+        error = "Some sends failed."
+    if error is not None:
+        gs.log.error(f"E258: Batch job in line {number} failed. {error}")
+        gs.err_count += 1
+    line = {
+        "line": number,
+        "id": job_id,
+        "accountid": None if job is None else job["account"],
+        "success": error is None,
+        "error": error,
+        "results": results,
+    }
+    print(json.dumps(line, default=obj_to_dict), flush=True)
+
+
+async def batch_worker(
+    account: str, conversation: str, queue, semaphore, tracker=None
+):
+    """Send the items of batch jobs to one conversation in job order."""
+    while (entry := await queue.get()) is not None:
+        items, substitute, future = entry
+        try:
+            results = await fan_out(
+                gs.ctrl,
+                account,
+                [conversation],
+                items,
+                semaphore=semaphore,
+                substitute=substitute,
+                tracker=tracker,
+            )
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(results)
+
+
+async def run_batch() -> None:
+    """Run the send jobs of the --batch manifest.
+
+    Jobs are read and sent at the same time. Per conversation jobs are
+    sent in manifest order, different conversations are served
+    concurrently with at most --parallel DBUS calls in flight. Only a
+    limited number of jobs is read ahead, so manifests of any size can be
+    processed. Results are printed as JSON Lines as jobs complete.
+    --dedupe and --wait-transfers apply to the files of every job, as they
+    do to -f.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(gs.pa.parallel)
+    window = asyncio.Semaphore(gs.pa.parallel * BATCH_JOBS_PER_SEND)
+    workers = {}  # (account, conversation) -> (queue, task)
+    running = set()
+    tracker = None
+    if gs.pa.wait_transfers is not None:
+        from .controller import libjamiTransferTracker
+
+        # one tracker serves the transfers of all jobs
+        tracker = libjamiTransferTracker(gs.ctrl)
+        tracker.start()
+
+    async def finish(number, job, parts, dedupe):
+        try:
+            results = []
+            error = None
+            for part in await asyncio.gather(*parts, return_exceptions=True):
+                if isinstance(part, Exception):
+                    error = str(part)
+                else:
+                    results.extend(part)
+            report_send_results(results, table=False)
+            if dedupe:
+                await asyncio.to_thread(
+                    record_sent_files, results, job["items"]
+                )
+            if tracker is not None:
+                transfers = [r["transfer"] for r in results if "transfer" in r]
+                try:
+                    complete = await tracker.wait(
+                        transfers, gs.pa.wait_transfers or None
+                    )
+                finally:
+                    for transfer in transfers:
+                        tracker.forget(transfer)
+                report_transfers(transfers, complete, table=False)
+                if (
+                    error is None
+                    and all(r["success"] for r in results)
+                    and not all(t["success"] for t in transfers)
+                ):
+                    error = "Some file transfers failed or did not finish."
+            write_batch_result(number, job, results, error)
+        finally:
+            window.release()
+
+    number = 0
+    try:
+        lines = split_text_stream(read_text_from_file(gs.pa.batch), "\n", 0)
+        async for line in lines:
+            number += 1
+            if not line.strip():
+                continue
+            await window.acquire()
+            substitute = None
+            try:
+                job = await prepare_batch_job(line)
+                if gs.pa.dedupe and any(
+                    i["type"] == "file" for i in job["items"]
+                ):
+                    substitute = await dedupe_items(job["items"])
+            except (ValueError, OSError) as e:
+                write_batch_result(number, None, [], str(e), line)
+                window.release()
+                continue
+            parts = []
+            for conversation in job["conversations"]:
+                key = (job["account"], conversation)
+                if key not in workers:
+                    queue = asyncio.Queue()
+                    task = asyncio.create_task(
+                        batch_worker(*key, queue, semaphore, tracker)
+                    )
+                    workers[key] = (queue, task)
+                part = loop.create_future()
+                workers[key][0].put_nowait((job["items"], substitute, part))
+                parts.append(part)
+            task = asyncio.create_task(
+                finish(number, job, parts, substitute is not None)
+            )
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if running:
+            await asyncio.wait(running)
+    except BaseException:
+        # e.g. the manifest became unreadable, do not send the rest
+        for task in running:
+            task.cancel()
+        for queue, task in workers.values():
+            task.cancel()
+        raise
+    finally:
+        for queue, task in workers.values():
+            queue.put_nowait(None)
+        await asyncio.gather(
+            *running,
+            *(task for queue, task in workers.values()),
+            return_exceptions=True,
+        )
+        if tracker is not None:
+            await tracker.close()
+        gs.log.debug(f"Batch finished, {number} lines read.")
+
+
+async def action_batch() -> None:
+    """Send messages and files as listed in --batch manifest."""
+    try:
+        await run_batch()
+    except Exception as e:
+        gs.log.error(
+            "E259: "
+            "Error during batch processing. Continuing despite error. "
+            f"Exception: {e}"
+        )
+        gs.log.debug("Here is the traceback.\n" + traceback.format_exc())
+        gs.err_count += 1
+
+
+def rpc_param(params: dict, key: str) -> str:
+    """Return the string parameter key of a JSON-RPC request."""
+    value = params.get(key)
+    if not isinstance(value, str) or not value:
+        raise ValueError(f'Parameter "{key}" is missing or not a string.')
+    return value
+
+
+async def rpc_ping(params: dict, semaphore):
+    return "pong"
+
+
+async def rpc_get_accounts(params: dict, semaphore):
+    accounts = []
+    for acct in await gs.ctrl.getAllEnabledAccounts():
+        details = await gs.ctrl.getAccountDetails(acct)
+        accounts.append(
+            {
+                "accountid": acct,
+                "alias": details.get("Account.alias"),
+                "username": details.get("Account.username"),
+            }
+        )
+    return accounts
+
+
+async def rpc_send(params: dict, semaphore):
+    job = await prepare_send_job(params)
+    results = await fan_out(
+        gs.ctrl,
+        job["account"],
+        job["conversations"],
+        job["items"],
+        semaphore=semaphore,
+    )
+    report_send_results(results, table=False)
+    return {"accountid": job["account"], "results": results}
+
+
+async def rpc_get_conversations(params: dict, semaphore):
+    account = await resolve_job_account(params)
+    return [str(c) for c in await gs.ctrl.getConversations(account)]
+
+
+async def rpc_get_conversation_members(params: dict, semaphore):
+    account = await resolve_job_account(params)
+    members = await gs.ctrl.getConversationMembers(
+        account, rpc_param(params, "conversation")
+    )
+    return [{str(k): str(v) for k, v in m.items()} for m in members]
+
+
+async def rpc_add_conversation(params: dict, semaphore):
+    account = await resolve_job_account(params)
+    return str(await gs.ctrl.startConversation(account))
+
+
+async def rpc_remove_conversation(params: dict, semaphore):
+    account = await resolve_job_account(params)
+    return bool(
+        await gs.ctrl.removeConversation(
+            account, rpc_param(params, "conversation")
+        )
+    )
+
+
+async def rpc_add_conversation_member(params: dict, semaphore):
+    account = await resolve_job_account(params)
+    await gs.ctrl.addConversationMember(
+        account, rpc_param(params, "conversation"), rpc_param(params, "member")
+    )
+    return True
+
+
+async def rpc_remove_conversation_member(params: dict, semaphore):
+    account = await resolve_job_account(params)
+    await gs.ctrl.removeConversationMember(
+        account, rpc_param(params, "conversation"), rpc_param(params, "member")
+    )
+    return True
+
+
+# methods offered by --serve
+RPC_METHODS = {
+    "ping": rpc_ping,
+    "getAccounts": rpc_get_accounts,
+    "send": rpc_send,
+    "getConversations": rpc_get_conversations,
+    "getConversationMembers": rpc_get_conversation_members,
+    "addConversation": rpc_add_conversation,
+    "removeConversation": rpc_remove_conversation,
+    "addConversationMember": rpc_add_conversation_member,
+    "removeConversationMember": rpc_remove_conversation_member,
+}
+
+
+def rpc_error(id, code: int, message: str) -> dict:
+    """Return a JSON-RPC 2.0 error response."""
+    return {
+        "jsonrpc": "2.0",
+        "id": id,
+        "error": {"code": code, "message": message},
+    }
+
+
+async def handle_rpc_request(line: bytes, semaphore) -> Union[None, dict]:
+    """Execute one JSON-RPC 2.0 request, return the response.
+
+    Returns None for notifications, i.e. requests without "id".
+    """
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return rpc_error(None, RPC_PARSE_ERROR, f"Parse error. ({e})")
+    if (
+        not isinstance(request, dict)
+        or request.get("jsonrpc") != "2.0"
+        or not isinstance(request.get("method"), str)
+    ):
+        return rpc_error(None, RPC_INVALID_REQUEST, "Invalid request.")
+    id = request.get("id")
+    method = RPC_METHODS.get(request["method"])
+    params = request.get("params", {})
+    if method is None:
+        response = rpc_error(
+            id,
+            RPC_METHOD_NOT_FOUND,
+            f'Method "{request["method"]}" not found.',
+        )
+    elif not isinstance(params, dict):
+        response = rpc_error(
+            id, RPC_INVALID_PARAMS, "Params must be a JSON object."
+        )
+    else:
+        try:
+            result = await method(params, semaphore)
+            response = {"jsonrpc": "2.0", "id": id, "result": result}
+        except ValueError as e:
+            response = rpc_error(id, RPC_INVALID_PARAMS, str(e))
+        except Exception as e:
+            gs.log.debug("Here is the traceback.\n" + traceback.format_exc())
+            response = rpc_error(id, RPC_SERVER_ERROR, str(e))
+    return None if "id" not in request else response
+
+
+async def serve_rpc_client(reader, writer, semaphore) -> None:
+    """Serve the JSON-RPC requests of one connection to --serve.
+
+    Requests are executed concurrently, responses are written as soon as
+    they are ready, so they might be out of order; match them by "id".
+    """
+    import asyncio
+
+    tasks = set()
+
+    async def answer(line):
+        response = await handle_rpc_request(line, semaphore)
+        if response is not None and not writer.is_closing():
+            writer.write(
+                json.dumps(response, default=obj_to_dict).encode() + b"\n"
+            )
+            await writer.drain()
+
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:  # line longer than SERVE_LINE_LIMIT
+                gs.log.warning(
+                    "W117: JSON-RPC request too long. Connection closed."
+                )
+                gs.warn_count += 1
+                break
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.create_task(answer(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+    except ConnectionError:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+
+
+async def action_serve() -> None:
+    """Serve JSON-RPC 2.0 requests on the --serve Unix socket.
+
+    Runs until SIGINT or SIGTERM. The connection to Jami, the account
+    cache and the parsed arguments are kept between requests.
+    """
+    import asyncio
+
+    path = gs.pa.serve
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    semaphore = asyncio.Semaphore(gs.pa.parallel)
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            gs.log.error(
+                "E269: "
+                f'"{path}" exists and is not a socket. Not serving. '
+                "Remove it or use another path for --serve."
+            )
+            gs.err_count += 1
+            return
+        os.remove(path)  # left over from a previous run
+    # only our own user may connect and send messages, the socket gets
+    # its permissions when it is bound
+    umask = os.umask(0o077)
+    try:
+        server = await asyncio.start_unix_server(
+            lambda r, w: serve_rpc_client(r, w, semaphore),
+            path,
+            limit=SERVE_LINE_LIMIT,
+        )
+    except OSError as e:
+        gs.log.error(
+            "E270: "
+            f"Could not listen on socket {path}. Not serving. "
+            f"Exception: {e}"
+        )
+        gs.err_count += 1
+        return
+    finally:
+        os.umask(umask)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    gs.log.info(f'Serving JSON-RPC requests on "{path}".')
+    try:
+        async with server:
+            await stop.wait()
+    except Exception as e:
+        gs.log.error(
+            "E260: "
+            f"Error while serving on {path}. Stopping server. "
+            f"Exception: {e}"
+        )
+        gs.err_count += 1
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        gs.log.info("Server stopped.")
+
+
+async def action_accountmgmt() -> None:
+    """Perform actions on account(s)."""
+    try:
+        # accountmgmt_action
+        if gs.pa.add_account:
+            await action_add_account()
+        if gs.pa.remove_account:
+            await action_remove_account()
+        if gs.pa.get_enabled_accounts:
+            await action_get_enabled_accounts()
+    except Exception as e:
+        gs.log.error(
+            "E256: "
+            "Error during accountmgmt actions. "
+            "Continuing despite error. "
+            f"Exception: {e}"
+        )
+        gs.log.debug("Here is the traceback.\n" + traceback.format_exc())
+        gs.err_count += 1
+
+
+async def action_conversationsetget() -> None:
+    """Perform conversation, get, set actions while being logged in."""
+    if not gs.account:
+        gs.log.error(
+            "E214: " f"Account not set. Skipping action. {gs.__dict__}"
+        )
+        gs.err_count += 1
+        return
+    try:
+        # conversation_action
+        if gs.pa.add_conversation:
+            await action_add_conversation()
+        if gs.pa.remove_conversation:
+            await action_remove_conversation()
+        if gs.pa.add_conversation_member:
+            await action_add_conversation_member()
+        if gs.pa.remove_conversation_member:
+            await action_remove_conversation_member()
+
+        # set_action
+        # if gs.pa.set_display_name:
+        #     await action_set_display_name(gs..., gs...)
+
+        # get_action
+        if gs.pa.get_conversations:
+            await action_get_conversations()
+        if gs.pa.get_conversation_members:
+            await action_get_conversation_members()
+        # set action
+        if gs.setget_action:
+            gs.log.debug("Set or get action(s) were performed or attempted.")
+    except Exception as e:
+        gs.log.error(
+            "E215: "
+            "Error during conversation, set, get actions. "
+            "Continuing despite error. "
+            f"Exception: {e}"
+        )
+        gs.log.debug("Here is the traceback.\n" + traceback.format_exc())
+        gs.err_count += 1
+
+
+async def action_send() -> None:
+    """Send messages while already logged in."""
+    if not gs.account:
+        gs.log.error("E218: " "Account not set. Skipping action.")
+        gs.err_count += 1
+        return
+    try:
+        gs.log.debug(f"account is: {gs.account}")
+        # Now we can send messages and files
+        # TODO
+        await process_arguments_and_input(gs.pa.conversations)
+        gs.log.debug("Message send action finished.")
+    except Exception as e:
+        gs.log.error(
+            "E219: "
+            "Error during sending. Continuing despite error. "
+            f"Exception: {e}"
+        )
+        gs.err_count += 1
+
+
+def dbus_to_python(value):
+    """Convert DBUS types (dbus.String, dbus.Dictionary, ...) to JSON-able
+    Python types.
+    """
+    if isinstance(value, dict):
+        return {str(k): dbus_to_python(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [dbus_to_python(v) for v in value]
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, int):
+        return int(value)
+    return value
+
+
+def listen_message(signal_name: str, args: tuple) -> dict:
+    """Return a received message as dict.
+
+    A messageReceived signal carries the message as dict with keys like
+    "id", "type", "author", "timestamp" and "body". A
+    swarmMessageReceived signal carries a struct (id, type, parent, body,
+    reactions, editions, status) whose body dict holds "author",
+    "timestamp", "body" etc. Both are flattened into the same form.
+    """
+    account, conversation, message = args
+    msg = {"accountid": str(account), "conversationid": str(conversation)}
+    if signal_name == "swarmMessageReceived":
+        id, type, parent, body, reactions, editions, status = message
+        msg.update(dbus_to_python(body))
+        msg.update(
+            {
+                "id": str(id),
+                "type": str(type),
+                "linearizedParent": str(parent),
+                "reactions": dbus_to_python(reactions),
+                "editions": dbus_to_python(editions),
+                "status": dbus_to_python(status),
+            }
+        )
+    else:
+        msg.update(dbus_to_python(message))
+    return msg
+
+
+def format_listen_message(msg: dict) -> str:
+    """Return a received message as one line of output.
+
+    The output format is controlled via --output. JSON gives one JSON
+    object per line (JSON Lines).
+    """
+    if gs.pa.output == OUTPUT_JSON:
+        return json.dumps(msg, default=str) + "\n"
+    body = str(msg.get("body", "")).replace("\n", " ")
+    return (
+        f'{msg["conversationid"]}{SEP}{msg.get("id", "")}{SEP}'
+        f'{msg.get("author", "")}{SEP}{msg.get("type", "")}{SEP}{body}\n'
+    )
+
+
+def write_stdout(text: str) -> None:
+    """Write text to stdout and flush, blocking."""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def silence_stdout() -> None:
+    """Redirect stdout to /dev/null, e.g. after a broken pipe.
+
+    This silences the error of the final flush at exit.
+    """
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+
+def media_file_path(name: str, reserved: set) -> str:
+    """Return a free path for a received file in the media directory.
+
+    Paths of running downloads are in reserved, as their files might not
+    exist yet. The chosen path is added to reserved.
+    """
+    name = os.path.basename(name.replace("\\", "/"))
+    if name in ("", ".", ".."):
+        name = "file"
+    stem, ext = os.path.splitext(name)
+    path = os.path.join(gs.pa.download_media, name)
+    number = 0
+    while path in reserved or os.path.lexists(path):
+        number += 1
+        path = os.path.join(gs.pa.download_media, f"{stem}-{number}{ext}")
+    reserved.add(path)
+    return path
+
+
+class MediaStore:
+    """Content-addressed store of the files downloaded by --download-media.
+
+    Every distinct content is kept once, as DIR/.store/objects/XX/DIGEST.
+    The visible files in DIR are hardlinks to it, so a file posted in
+    several conversations takes its space only once. If quota is not 0,
+    the least recently stored or linked contents are evicted, together
+    with their visible files, until the store fits into quota bytes.
+
+    The index DIR/.store/index.json maps each digest to its size, last
+    use and visible names, so opening the store does not walk DIR. It is
+    only rebuilt from the directory if it is missing or unreadable.
+
+    The methods are blocking and thread-safe, call them via to_thread().
+    """
+
+    def __init__(self, dir: str, quota: int = 0):
+        from threading import Lock
+
+        self.dir = dir
+        self.quota = quota
+        self.lock = Lock()
+        self.root = os.path.join(dir, MEDIA_STORE_DIR)
+        self.index_path = os.path.join(self.root, "index.json")
+        self.tmp = os.path.join(self.root, "tmp")
+        # left over by downloads that were interrupted
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        os.makedirs(self.tmp, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.objects = json.load(f)["objects"]
+        except FileNotFoundError:
+            self.objects = self.rebuild()
+        except Exception as e:
+            gs.log.warning(
+                f'W121: Media store index "{self.index_path}" could not be '
+                f"read. It is rebuilt from the directory. ({e})"
+            )
+            gs.warn_count += 1
+            self.objects = self.rebuild()
+        self.size = sum(obj["size"] for obj in self.objects.values())
+        if self.quota and self.size > self.quota:  # quota was lowered
+            self.evict(keep=None)
+            self.save()
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def temp_path(self, name: str) -> str:
+        """Return a path to download a file to before add()."""
+        return os.path.join(self.tmp, uuid.uuid4().hex + "-" + name)
+
+    def rebuild(self) -> dict:
+        """Return the index entries found in the directory."""
+        objects = {}
+        inodes = {}
+        for dirpath, _, files in os.walk(os.path.join(self.root, "objects")):
+            for digest in files:
+                st = os.stat(os.path.join(dirpath, digest))
+                objects[digest] = {
+                    "size": st.st_size,
+                    "used": st.st_mtime,
+                    "names": [],
+                }
+                inodes[(st.st_dev, st.st_ino)] = digest
+        with os.scandir(self.dir) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                digest = inodes.get((st.st_dev, st.st_ino))
+                if digest is not None:
+                    objects[digest]["names"].append(entry.name)
+        return objects
+
+    def link(self, digest: str, path: str) -> bool:
+        """Make path a hardlink to the stored content digest.
+
+        Returns False if the content is not in the store.
+        """
+        with self.lock:
+            return self._link(digest, path)
+
+    def _link(self, digest: str, path: str) -> bool:
+        # the caller holds self.lock
+        obj = self.objects.get(digest)
+        if obj is None:
+            return False
+        try:
+            os.link(self.object_path(digest), path)
+        except FileNotFoundError:
+            # object was removed behind our back
+            self.size -= obj["size"]
+            del self.objects[digest]
+            self.save()
+            return False
+        obj["names"].append(os.path.basename(path))
+        obj["used"] = time.time()
+        self.evict(keep=digest)
+        self.save()
+        return True
+
+    def add(self, tmp: str, path: str) -> bool:
+        """Move the downloaded file tmp into the store, link it to path.
+
+        Returns True if the content was stored already, i.e. tmp was a
+        duplicate and got removed.
+        """
+        digest = hash_file(tmp, MEDIA_STORE_HASH)
+        # storing and linking under one lock, so that no other thread can
+        # evict the new content in between
+        with self.lock:
+            if digest in self.objects and self._link(digest, path):
+                os.unlink(tmp)
+                return True
+            stored = self.object_path(digest)
+            os.makedirs(os.path.dirname(stored), exist_ok=True)
+            os.replace(tmp, stored)
+            self.objects[digest] = {
+                "size": os.path.getsize(stored),
+                "used": time.time(),
+                "names": [],
+            }
+            self.size += self.objects[digest]["size"]
+            if not self._link(digest, path):
+                raise FileNotFoundError(
+                    errno.ENOENT, "Stored file vanished", stored
+                )
+            return False
+
+    def evict(self, keep: Union[str, None]) -> None:
+        """Remove least recently used contents until quota is met.
+
+        The content keep, just used, stays even if it alone exceeds quota.
+        """
+        if not self.quota or self.size <= self.quota:
+            return
+        lru = sorted(self.objects, key=lambda d: self.objects[d]["used"])
+        for digest in lru:
+            if self.size <= self.quota:
+                break
+            if digest == keep:
+                continue
+            obj = self.objects.pop(digest)
+            stored = self.object_path(digest)
+            for name in obj["names"]:
+                path = os.path.join(self.dir, name)
+                try:
+                    if os.path.samefile(path, stored):
+                        os.unlink(path)
+                except OSError:
+                    pass  # removed or replaced by the user
+            try:
+                os.unlink(stored)
+            except FileNotFoundError:
+                pass
+            self.size -= obj["size"]
+            gs.log.info(
+                f"Media store quota of {self.quota} bytes exceeded. "
+                f"Evicted {obj['names']}, {obj['size']} bytes."
+            )
+
+    def save(self) -> None:
+        save_json_file(self.index_path, {"objects": self.objects})
+
+
+async def fetch_media(pool, store, msg: dict, path: str) -> None:
+    """Download the file of a received file message into the store.
+
+    Contents already stored, known by the sha3sum of the message, are not
+    downloaded again but only linked to path.
+    """
+    import asyncio
+
+    digest = msg.get("sha3sum")
+    try:
+        if digest and await asyncio.to_thread(store.link, digest, path):
+            gs.log.info(f'Linked "{path}" to identical stored file.')
+            return
+    except Exception as e:
+        gs.log.error(
+            "E266: "
+            f'Stored file could not be linked as "{path}". Exception: {e}'
+        )
+        gs.err_count += 1
+        return
+    tmp = store.temp_path(msg["fileId"])
+    try:
+        size = int(msg.get("totalSize"))
+    except (TypeError, ValueError):
+        size = None
+    try:
+        record = await pool.submit(
+            msg["accountid"],
+            msg["conversationid"],
+            msg.get("id", ""),
+            msg["fileId"],
+            os.path.abspath(tmp),
+            size,
+        )
+    except Exception as e:
+        record = {"success": False, "status": f"exception {e}"}
+    if record["success"]:
+        try:
+            duplicate = await asyncio.to_thread(store.add, tmp, path)
+        except Exception as e:
+            gs.log.error(
+                "E266: "
+                f'Downloaded file "{tmp}" could not be stored as "{path}". '
+                f"Exception: {e}"
+            )
+            gs.err_count += 1
+            return
+        if duplicate:
+            gs.log.info(f'Downloaded "{path}", linked to identical file.')
+        else:
+            gs.log.info(f'Downloaded "{path}", {record["size"]} bytes.')
+        return
+    if record.get("duration", 0) is None:
+        gs.log.warning(
+            "W119: "
+            f'Download of "{path}" did not complete within '
+            f"{DOWNLOAD_TIMEOUT} seconds. Status is "
+            f'"{record["status"]}". It is no longer waited for.'
+        )
+        gs.warn_count += 1
+        return
+    gs.log.error(
+        "E265: "
+        f'Download of "{path}" failed with status "{record["status"]}".'
+    )
+    gs.err_count += 1
+    try:
+        os.unlink(tmp)
+    except OSError:
+        pass
+
+
+def download_media(
+    pool, store, msg: dict, tasks: set, reserved: set
+) -> None:
+    """Start fetching the file of a received file message.
+
+    Adds the path of the file to msg under key "download".
+    """
+    import asyncio
+
+    path = media_file_path(msg.get("displayName") or msg["fileId"], reserved)
+    msg["download"] = path
+    task = asyncio.create_task(fetch_media(pool, store, msg, path))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    task.add_done_callback(lambda task: reserved.discard(path))
+
+
+def load_listen_checkpoints(path: str) -> dict:
+    """Read the --listen-checkpoint file {accountid: {conversationid: id}}.
+
+    A missing or unreadable file is treated as empty.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoints = json.load(f)
+        if isinstance(checkpoints, dict):
+            return checkpoints
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        gs.log.warning(
+            f'W122: Listen checkpoint file "{path}" could not be read and '
+            f"is ignored. No messages are caught up. ({e})"
+        )
+        gs.warn_count += 1
+    return {}
+
+
+def spill_page(file, messages: list) -> tuple:
+    """Append a page of messages to file, return its (offset, size)."""
+    data = (json.dumps(messages, default=str) + "\n").encode("utf-8")
+    offset = file.seek(0, os.SEEK_END)
+    file.write(data)
+    return offset, len(data)
+
+
+def read_spilled_page(file, offset: int, size: int) -> list:
+    """Return the page of messages written by spill_page()."""
+    file.seek(offset)
+    return json.loads(file.read(size))
+
+
+async def listen_catch_up(checkpoints: dict, conversations: list) -> list:
+    """Load the messages missed since the checkpoints.
+
+    checkpoints maps conversationids to the id of the last message
+    processed. The history of each conversation is walked page by page
+    from the newest message back to its checkpoint. Conversations without
+    checkpoint get one for their newest message, so from now on nothing
+    is missed.
+
+    The pages are spilled into a temporary file, so memory use does not
+    grow with the number of missed messages. If the checkpoint message is
+    not found, e.g. as the history was reset, only the newest
+    LISTEN_CATCH_UP_MAX messages are caught up.
+
+    Returns a list of (conversationid, file, pages, count) for the
+    conversations with missed messages. pages are the (offset, size) of
+    the pages in file, newest first, see read_spilled_page(). The caller
+    must close the files.
+    """
+    import asyncio
+
+    account = gs.account
+    page_size = gs.pa.export_page_size
+    if not conversations:
+        conversations = [
+            str(c) for c in await gs.ctrl.getConversations(account)
+        ]
+    semaphore = asyncio.Semaphore(gs.pa.parallel)
+
+    async def missed(conversation):
+        async with semaphore:
+            last = checkpoints.get(conversation)
+            if last is None:
+                newest = await asyncio.wait_for(
+                    gs.ctrl.getConversationMessages(
+                        account, conversation, "", 1
+                    ),
+                    EXPORT_PAGE_TIMEOUT,
+                )
+                if newest:
+                    checkpoints[conversation] = str(newest[0].get("id"))
+                return None
+            file = tempfile.TemporaryFile(dir=gs.pa.tmp_dir)
+            pages = []
+            count = 0
+            found = False
+            try:
+                async for page in walk_history(
+                    account, conversation, "", None, page_size
+                ):
+                    ids = [m.get("id") for m in page]
+                    if last in ids:
+                        page = page[: ids.index(last)]
+                        found = True
+                    page = page[: LISTEN_CATCH_UP_MAX - count]
+                    if page:
+                        pages.append(
+                            await asyncio.to_thread(spill_page, file, page)
+                        )
+                        count += len(page)
+                    if found or count >= LISTEN_CATCH_UP_MAX:
+                        break
+            except BaseException:
+                file.close()
+                raise
+        if not found:
+            gs.log.warning(
+                f"W123: Checkpoint message {last} was not found in the "
+                f"newest {count} messages of conversation {conversation}. "
+                "Only these are caught up."
+            )
+            gs.warn_count += 1
+        gs.log.info(
+            f"Caught up {count} messages of conversation {conversation}."
+        )
+        return conversation, file, pages, count
+
+    async def try_missed(conversation):
+        try:
+            return await missed(conversation)
+        except Exception as e:
+            gs.log.error(
+                "E267: "
+                "Messages missed in conversation "
+                f"{conversation} could not be loaded. Exception: {e!r}"
+            )
+            gs.err_count += 1
+            return None
 
-    messages_all = (
-        messages_from_commandline + messages_from_pipe + messages_from_keyboard
-    )  # keyboard at end
+    results = await asyncio.gather(*(try_missed(c) for c in conversations))
+    return [r for r in results if r is not None]
 
-    # loop thru all msgs and split them
-    if gs.pa.split:
-        # gs.pa.split can have escape characters, it has to be de-escaped
-        decoded_string = bytes(gs.pa.split, "utf-8").decode("unicode_escape")
-        gs.log.debug(f'String used for splitting is: "{decoded_string}"')
-        messages_all_split = []
-        for m in messages_all:
-            messages_all_split += m.split(decoded_string)
-    else:  # not gs.pa.split
-        messages_all_split = messages_all
 
-    if (gs.pa.file or messages_all_split) and not conversations:
-        gs.log.error(
-            "E255: "
-            "No conversations are given. Specify --conversations. "
-            "Nothing is being sent. Try again with --conversations set."
-        )
-        gs.err_count += 1
-        return
+async def listen_forever() -> int:
+    """Print received messages until SIGINT or SIGTERM.
 
-    await send_messages_and_files(conversations, messages_all_split)
-    # now we are done with all the usual sends, now we start streaming
-    if streaming:
-        await stream_messages_from_pipe(conversations)
+    Messages are taken from the signal queue in batches of up to
+    LISTEN_BATCH_MAX. A batch is written with a single write and flush in
+    a worker thread, so a slow reader of stdout never blocks the event
+    loop, let alone the DBUS thread. Meanwhile arriving messages queue
+    up and go into the next (larger) batch.
 
+    With --download-media the files of file messages are downloaded by a
+    libjamiDownloadPool in the background, into a MediaStore.
 
-async def action_accountmgmt() -> None:
-    """Perform actions on account(s)."""
+    With --listen-checkpoint the id of the last message printed per
+    conversation is saved at most every LISTEN_CHECKPOINT_INTERVAL
+    seconds and when stopping. On start the messages missed since are
+    printed first, page by page, see listen_catch_up(). The signals are
+    subscribed to before, so messages arriving meanwhile wait in the
+    queue; those printed already are dropped as duplicates, as the
+    duplicate filter remembers at least all caught up messages.
+
+    Returns the number of messages printed.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    queue = gs.ctrl.subscribe(*LISTEN_SIGNALS)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        # None in the queue stops listening after the messages before it
+        loop.add_signal_handler(signum, queue.put_nowait, None)
+    conversations = set(gs.pa.conversations or ())
+    seen = {}  # recent message ids, insertion ordered
+    seen_max = LISTEN_SEEN_MAX  # raised by the catch-up
+    count = 0
+    archive = None
+    tracker = None
+    pool = None
+    store = None
+    downloads = set()  # tasks of fetch_media()
+    reserved = set()  # paths of running downloads
+    checkpoints = None  # {accountid: {conversationid: id}}
+    dirty = False  # checkpoints changed since saved
+    saved = time.monotonic()
+
+    async def process(messages):
+        nonlocal count, dirty
+        lines = []
+        printed = []
+        for msg in messages:
+            key = (msg["conversationid"], msg.get("id"))
+            if key in seen:
+                continue  # announced by the other signal already
+            seen[key] = None
+            if len(seen) > seen_max:
+                del seen[next(iter(seen))]
+            if (
+                pool is not None
+                and msg.get("type") == FILE_MESSAGE_TYPE
+                and msg.get("fileId")
+            ):
+                download_media(pool, store, msg, downloads, reserved)
+            lines.append(format_listen_message(msg))
+            printed.append(msg)
+        if lines:
+            await asyncio.to_thread(write_stdout, "".join(lines))
+            count += len(lines)
+        if archive is not None and printed:
+            try:
+                await asyncio.to_thread(archive_messages, archive, printed)
+            except Exception as e:
+                gs.log.error(
+                    "E263: "
+                    f"{len(printed)} messages could not be stored in "
+                    f'archive "{gs.pa.archive}". Exception: {e}'
+                )
+                gs.err_count += 1
+        if checkpoints is not None and printed:
+            last = checkpoints.setdefault(gs.account, {})
+            for msg in printed:
+                if msg.get("id"):
+                    last[msg["conversationid"]] = msg["id"]
+            dirty = True
+
+    async def save_checkpoints():
+        nonlocal dirty, saved
+        dirty = False
+        saved = time.monotonic()
+        # a copy, as the event loop goes on changing checkpoints
+        data = {a: dict(c) for a, c in checkpoints.items()}
+        try:
+            await asyncio.to_thread(
+                save_json_file, gs.pa.listen_checkpoint, data
+            )
+        except Exception as e:
+            gs.log.error(
+                "E268: "
+                f'Listen checkpoint file "{gs.pa.listen_checkpoint}" could '
+                f"not be written. Exception: {e}"
+            )
+            gs.err_count += 1
+
+    gs.log.info(f"Listening for messages of account {gs.account}.")
     try:
-        # accountmgmt_action
-        if gs.pa.add_account:
-            action_add_account()
-        if gs.pa.remove_account:
-            action_remove_account()
-        if gs.pa.get_enabled_accounts:
-            action_get_enabled_accounts()
-    except Exception as e:
-        gs.log.error(
-            "E256: "
-            "Error during accountmgmt actions. "
-            "Continuing despite error. "
-            f"Exception: {e}"
-        )
-        gs.log.debug("Here is the traceback.\n" + traceback.format_exc())
-        gs.err_count += 1
+        if gs.pa.download_media:
+            from .controller import (
+                libjamiDownloadPool,
+                libjamiTransferTracker,
+            )
+
+            tracker = libjamiTransferTracker(gs.ctrl)
+            tracker.start()
+            pool = libjamiDownloadPool(
+                gs.ctrl,
+                tracker,
+                gs.pa.download_parallel,
+                gs.pa.download_parallel_conversation,
+                DOWNLOAD_TIMEOUT,
+            )
+            store = await asyncio.to_thread(
+                MediaStore, gs.pa.download_media, gs.pa.download_quota
+            )
+        if gs.pa.archive:
+            # used by one worker thread after the other
+            archive = open_message_db(gs.pa.archive, check_same_thread=False)
+        if gs.pa.listen_checkpoint:
+            checkpoints = await asyncio.to_thread(
+                load_listen_checkpoints, gs.pa.listen_checkpoint
+            )
+            missed = await listen_catch_up(
+                checkpoints.setdefault(gs.account, {}),
+                gs.pa.conversations or [],
+            )
+            dirty = True  # new conversations got their first checkpoint
+            # live messages arriving meanwhile may repeat all of them
+            seen_max += sum(n for _, _, _, n in missed)
+            try:
+                for conversation, file, pages, _ in missed:
+                    for offset, size in reversed(pages):
+                        page = await asyncio.to_thread(
+                            read_spilled_page, file, offset, size
+                        )
+                        page.reverse()  # oldest first
+                        await process(
+                            [
+                                {
+                                    "accountid": gs.account,
+                                    "conversationid": conversation,
+                                }
+                                | msg
+                                for msg in page
+                            ]
+                        )
+            finally:
+                for _, file, _, _ in missed:
+                    file.close()
+        stopping = False
+        while not stopping:
+            timeout = None
+            if dirty:
+                timeout = saved + LISTEN_CHECKPOINT_INTERVAL - time.monotonic()
+            try:
+                batch = [await asyncio.wait_for(queue.get(), timeout)]
+            except TimeoutError:
+                await save_checkpoints()
+                continue
+            while len(batch) < LISTEN_BATCH_MAX and not queue.empty():
+                batch.append(queue.get_nowait())
+            messages = []
+            for entry in batch:
+                if entry is None:
+                    stopping = True
+                    continue
+                signal_name, args = entry
+                if str(args[0]) != gs.account:
+                    continue
+                if conversations and str(args[1]) not in conversations:
+                    continue
+                messages.append(listen_message(signal_name, args))
+            await process(messages)
+    except BrokenPipeError:
+        gs.log.debug("Stdout was closed. Stopping listening.")
+        silence_stdout()
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+        gs.ctrl.unsubscribe(queue)
+        if checkpoints is not None and dirty:
+            await save_checkpoints()
+        if archive is not None:
+            archive.close()
+        if pool is not None:
+            tasks = list(downloads)
+            cancelled = len(tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await pool.close()
+            if cancelled:
+                gs.log.warning(
+                    "W120: "
+                    f"Stopped listening with {cancelled} downloads queued "
+                    "or running. They were cancelled."
+                )
+                gs.warn_count += 1
+        if tracker is not None:
+            await tracker.close()
+    gs.log.info(f"Stopped listening. {count} messages received.")
+    return count
 
 
-async def action_conversationsetget() -> None:
-    """Perform conversation, get, set actions while being logged in."""
+async def action_listen() -> None:
+    """Listen to messages and files."""
     if not gs.account:
-        gs.log.error(
-            "E214: " f"Account not set. Skipping action. {gs.__dict__}"
-        )
+        gs.log.error("E164: " "Account not set. Skipping action.")
         gs.err_count += 1
         return
     try:
-        # conversation_action
-        if gs.pa.add_conversation:
-            action_add_conversation()
-        if gs.pa.remove_conversation:
-            action_remove_conversation()
-        if gs.pa.add_conversation_member:
-            action_add_conversation_member()
-        if gs.pa.remove_conversation_member:
-            action_remove_conversation_member()
-
-        # set_action
-        # if gs.pa.set_display_name:
-        #     await action_set_display_name(gs..., gs...)
-
-        # get_action
-        if gs.pa.get_conversations:
-            action_get_conversations()
-        if gs.pa.get_conversation_members:
-            action_get_conversation_members()
-        # set action
-        if gs.setget_action:
-            gs.log.debug("Set or get action(s) were performed or attempted.")
+        gs.log.debug(f"Listening type: {gs.pa.listen}")
+        if gs.pa.listen == LISTEN_FOREVER:
+            await listen_forever()
+        else:
+            gs.log.error(
+                "E165: "
+                f'Unrecognized listening type "{gs.pa.listen}". '
+                "Skipping listening."
+            )
+            gs.err_count += 1
     except Exception as e:
         gs.log.error(
-            "E215: "
-            "Error during conversation, set, get actions. "
-            "Continuing despite error. "
+            "E166: "
+            "Error during listening. Continuing despite error. "
             f"Exception: {e}"
         )
         gs.log.debug("Here is the traceback.\n" + traceback.format_exc())
         gs.err_count += 1
 
 
-async def action_send() -> None:
-    """Send messages while already logged in."""
-    if not gs.account:
-        gs.log.error("E218: " "Account not set. Skipping action.")
-        gs.err_count += 1
-        return
+def open_message_db(path: str, check_same_thread: bool = True):
+    """Open the SQLite message database at path, create it if needed.
+
+    The database holds the messages, the export checkpoints and a
+    full-text index of the message bodies. A database created before the
+    full-text index existed gets it built once.
+    """
+    import sqlite3
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=check_same_thread)
+    db.execute("PRAGMA journal_mode=WAL")  # readers do not block writers
+    indexed = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+    ).fetchone()
+    db.executescript(MESSAGE_DB_SCHEMA)
+    if not indexed:
+        with db:
+            db.execute(
+                "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')"
+            )
+    return db
+
+
+def archive_messages(db, messages: list) -> None:
+    """Store received messages in the --archive database, blocking."""
+    with db:  # one transaction
+        db.executemany(
+            "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                message_row(m["accountid"], m["conversationid"], m)
+                for m in messages
+            ),
+        )
+
+
+def search_archive(path: str, query: str, conversations, limit: int) -> list:
+    """Return the messages of the archive matching the FTS5 query.
+
+    Most recently stored messages first, at most limit. This order is
+    the one of the full-text index, so the search stops after limit
+    matches instead of sorting all of them. Each message is a dict with the
+    keys "accountid", "conversationid", "id", "type", "author",
+    "timestamp" and "body".
+    """
+    import sqlite3
+    from pathlib import Path
+
+    # read-only, a missing archive must not be created; as_uri() quotes
+    # characters like "?", "#" and "%" of the path
+    uri = Path(path).resolve().as_uri() + "?mode=ro"
+    db = sqlite3.connect(uri, uri=True)
+    if not db.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+    ).fetchone():
+        # written by an older version, build the full-text index once
+        db.close()
+        open_message_db(path).close()
+        db = sqlite3.connect(uri, uri=True)
     try:
-        gs.log.debug(f"account is: {gs.account}")
-        # Now we can send messages and files
-        # TODO
-        await process_arguments_and_input(gs.pa.conversations)
-        gs.log.debug("Message send action finished.")
-    except Exception as e:
-        gs.log.error(
-            "E219: "
-            "Error during sending. Continuing despite error. "
-            f"Exception: {e}"
+        sql = (
+            "SELECT m.accountid, m.conversationid, m.id, m.type, m.author, "
+            "m.timestamp, m.body FROM messages_fts "
+            "JOIN messages AS m ON m.rowid = messages_fts.rowid "
+            "WHERE messages_fts MATCH ?"
         )
-        gs.err_count += 1
+        params = [query]
+        if conversations:
+            sql += (
+                " AND m.conversationid IN "
+                f"({', '.join('?' * len(conversations))})"
+            )
+            params += conversations
+        sql += " ORDER BY messages_fts.rowid DESC LIMIT ?"
+        params.append(limit)
+        keys = (
+            "accountid",
+            "conversationid",
+            "id",
+            "type",
+            "author",
+            "timestamp",
+            "body",
+        )
+        return [dict(zip(keys, row)) for row in db.execute(sql, params)]
+    finally:
+        db.close()
 
 
-async def action_listen() -> None:
-    """Listen to messages and files."""
-    if not gs.account:
-        gs.log.error("E164: " "Account not set. Skipping action.")
-        gs.err_count += 1
-        return
+def action_search() -> None:
+    """Print the archived messages matching --search."""
+    path = gs.pa.archive or ARCHIVE_DEFAULT
     try:
-        gs.log.error(
-            "Listening is not implemented yet. "
-            "Please write a Pull Request to make it happen."
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f'Archive "{path}" does not exist.')
+        t0 = time.monotonic()
+        results = search_archive(
+            path, gs.pa.search, gs.pa.conversations, gs.pa.search_limit
         )
-        gs.err_count += 1
-        # gs.log.debug(f"Listening type: {gs.pa.listen}")
-        # if gs.pa.listen == FOREVER:
-        #     await listen_forever(gs.client)
-        # elif gs.pa.listen == ONCE:
-        #     await listen_once(gs.client)
-        #     # could use 'await listen_once_alternative(gs.client)'
-        #     # as an alternative implementation
-        # elif gs.pa.listen == TAIL:
-        #     await listen_tail(gs.client, gs.credentials)
-        # elif gs.pa.listen == ALL:
-        #     await listen_all(gs.client, gs.credentials)
-        # else:
-        #     gs.log.error(
-        #         "E165: "
-        #         f'Unrecognized listening type "{gs.pa.listen}". '
-        #         "Skipping listening."
-        #     )
-        #     gs.err_count += 1
     except Exception as e:
         gs.log.error(
-            "E166: "
-            "Error during listening. Continuing despite error. "
+            "E264: "
+            f'Searching the archive for "{gs.pa.search}" failed. '
             f"Exception: {e}"
         )
-        gs.log.debug("Here is the traceback.\n" + traceback.format_exc())
         gs.err_count += 1
+        return
+    gs.log.debug(
+        f"{len(results)} messages found in "
+        f"{(time.monotonic() - t0) * 1000:.1f} ms."
+    )
+    # like --listen: one line per message, JSON Lines with --output json
+    write_stdout("".join(format_listen_message(m) for m in results))
+
+
+def message_row(account: str, conversation: str, msg: dict) -> tuple:
+    """Return a message as row of the messages table."""
+    try:
+        timestamp = int(msg.get("timestamp"))
+    except (TypeError, ValueError):
+        timestamp = None
+    return (
+        account,
+        conversation,
+        str(msg.get("id", "")),
+        msg.get("type"),
+        msg.get("author"),
+        timestamp,
+        msg.get("body"),
+        json.dumps(msg, default=str),
+    )
+
+
+class HistoryJsonlWriter:
+    """Append exported messages to a JSON Lines file or stdout.
+
+    The checkpoints are kept in the side file FILE.checkpoint.json. It is
+    only replaced after the messages it covers are synced to disk. Stdout
+    has no checkpoints, i.e. every export is a full export.
+
+    The methods are blocking and thread-safe, call them via to_thread().
+    """
+
+    def __init__(self, path: str):
+        from threading import Lock
+
+        self.lock = Lock()
+        if path == "-":
+            self.file = sys.stdout
+            self.checkpoint_path = None
+            self.checkpoints = {}
+            return
+        self.file = open(path, "a", encoding="utf-8")
+        self.checkpoint_path = path + ".checkpoint.json"
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                self.checkpoints = json.load(f)
+        except FileNotFoundError:
+            self.checkpoints = {}
+
+    def get_checkpoint(self, account: str, conversation: str) -> dict:
+        with self.lock:
+            return dict(
+                self.checkpoints.get(account, {}).get(conversation, {})
+            )
+
+    def write(
+        self, account: str, conversation: str, messages: list, state=None
+    ) -> None:
+        """Write messages, then the checkpoint state if not None."""
+        with self.lock:
+            self._write(account, conversation, messages, state)
+
+    def _write(self, account, conversation, messages, state) -> None:
+        self.file.write(
+            "".join(
+                json.dumps(
+                    {"accountid": account, "conversationid": conversation}
+                    | msg,
+                    default=str,
+                )
+                + "\n"
+                for msg in messages
+            )
+        )
+        if state is None:
+            return
+        self.file.flush()
+        if self.checkpoint_path is None:
+            return
+        os.fsync(self.file.fileno())
+        self.checkpoints.setdefault(account, {})[conversation] = dict(state)
+        save_json_file(self.checkpoint_path, self.checkpoints)
+
+    def close(self) -> None:
+        self.file.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class HistorySqliteWriter:
+    """Store exported messages in an SQLite database.
+
+    Messages and checkpoint of a page are written in one transaction.
+    Messages exported twice are stored once.
+
+    The methods are blocking and thread-safe, call them via to_thread().
+    """
+
+    def __init__(self, path: str):
+        from threading import Lock
+
+        self.lock = Lock()
+        # used by one worker thread after the other
+        self.db = open_message_db(path, check_same_thread=False)
+
+    def get_checkpoint(self, account: str, conversation: str) -> dict:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT state FROM checkpoints "
+                "WHERE accountid = ? AND conversationid = ?",
+                (account, conversation),
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def write(
+        self, account: str, conversation: str, messages: list, state=None
+    ) -> None:
+        """Write messages and the checkpoint state if not None."""
+        with self.lock, self.db:  # one transaction
+            self.db.executemany(
+                "INSERT OR IGNORE INTO messages "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (message_row(account, conversation, m) for m in messages),
+            )
+            if state is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                    (account, conversation, json.dumps(state)),
+                )
+
+    def close(self) -> None:
+        self.db.close()
+
+
+async def walk_history(
+    account: str, conversation: str, start: str, stop: str, page_size: int
+):
+    """Yield the history of a conversation page by page, newest first.
+
+    Starts after the message start ("" starts at the newest message) and
+    ends before the message stop (None ends at the first message). Only
+    one page is held in memory at any time.
+    """
+    import asyncio
+
+    start_at = start
+    while True:
+        page = await asyncio.wait_for(
+            gs.ctrl.getConversationMessages(
+                account, conversation, start_at, page_size
+            ),
+            EXPORT_PAGE_TIMEOUT,
+        )
+        last_page = len(page) < page_size
+        messages = [dbus_to_python(m) for m in page]
+        if start_at and messages and messages[0].get("id") == start_at:
+            messages = messages[1:]  # the page starts with start_at itself
+        if stop is not None:
+            ids = [m.get("id") for m in messages]
+            if stop in ids:
+                messages = messages[: ids.index(stop)]
+                last_page = True
+        if messages:
+            yield messages
+        if last_page or not messages:
+            return
+        start_at = messages[-1].get("id")
+
+
+async def export_conversation(writer, conversation: str) -> dict:
+    """Export the history of one conversation.
+
+    The checkpoint state of a conversation has the keys "newest" and
+    "oldest", the ids of the newest and oldest message exported, and
+    "complete", True once the first message was exported. A rerun first
+    exports the messages newer than "newest", then, if not "complete",
+    continues the export after "oldest". Returns a summary dict.
+
+    The writes run in worker threads, so disk I/O of one conversation
+    does not delay the page loads of the others.
+    """
+    import asyncio
+
+    account = gs.account
+    page_size = gs.pa.export_page_size
+    state = await asyncio.to_thread(
+        writer.get_checkpoint, account, conversation
+    )
+    count = 0
+    if state.get("newest"):
+        # messages received since the last export
+        newest = None
+        async for messages in walk_history(
+            account, conversation, "", state["newest"], page_size
+        ):
+            newest = newest or messages[0].get("id")
+            # an interrupted run exports these again, hence no checkpoint
+            await asyncio.to_thread(
+                writer.write, account, conversation, messages
+            )
+            count += len(messages)
+        if newest:
+            state["newest"] = newest
+            await asyncio.to_thread(
+                writer.write, account, conversation, [], state
+            )
+    if not state.get("complete"):
+        # the first export, or the rest of an interrupted one
+        async for messages in walk_history(
+            account, conversation, state.get("oldest", ""), None, page_size
+        ):
+            state.setdefault("newest", messages[0].get("id"))
+            state["oldest"] = messages[-1].get("id")
+            await asyncio.to_thread(
+                writer.write, account, conversation, messages, state
+            )
+            count += len(messages)
+        state["complete"] = True
+        await asyncio.to_thread(
+            writer.write, account, conversation, [], state
+        )
+    return {"conversationid": conversation, "exported": count}
+
+
+async def action_export_history() -> None:
+    """Export the history of conversations to a JSONL or SQLite file."""
+    import asyncio
+
+    path = gs.pa.export_history
+    conversations = gs.pa.conversations
+    if not conversations:
+        conversations = [
+            str(c) for c in await gs.ctrl.getConversations(gs.account)
+        ]
+    if path.lower().endswith(SQLITE_SUFFIXES):
+        writer = HistorySqliteWriter(path)
+    else:
+        writer = HistoryJsonlWriter(path)
+    semaphore = asyncio.Semaphore(gs.pa.parallel)
+
+    async def export(conversation):
+        async with semaphore:
+            try:
+                result = await export_conversation(writer, conversation)
+            except Exception as e:
+                gs.log.error(
+                    "E262: "
+                    f"Exporting the history of conversation {conversation} "
+                    "failed. Rerun to continue where it stopped. "
+                    f"Exception: {e!r}"
+                )
+                gs.err_count += 1
+                return
+            gs.log.info(
+                f"{result['exported']} messages of conversation "
+                f"{conversation} exported to {path}."
+            )
+
+    try:
+        await asyncio.gather(*(export(c) for c in conversations))
+    finally:
+        writer.close()
 
 
 def create_jami_controller() -> None:
     """Create the Jami controller object
 
     This enables us to communicate via the DBUS interface to the jamid daemon.
+    The controller is asynchronous: its DBUS calls are awaited and do not
+    block the event loop. Must be called from within the event loop.
     """
+    import subprocess
+
+    from .controller import libjamiCtrlAsync
+
     try:
-        ctrl = libjamiCtrl(name=sys.argv[0], autoAnswer=False)
+        ctrl = libjamiCtrlAsync(name=sys.argv[0], autoAnswer=False)
     except Exception as e:
         gs.log.error(
             "E234: "
@@ -1082,14 +3806,15 @@ def create_jami_controller() -> None:
             gs.err_count += 1
             raise e
         try:  # retry it for a second and last time
-            ctrl = libjamiCtrl(name=sys.argv[0], autoAnswer=False)
+            ctrl = libjamiCtrlAsync(name=sys.argv[0], autoAnswer=False)
         except Exception as e:
             raise e
+    ctrl.start()  # DBUS replies and signals are processed in this thread
     gs.ctrl = ctrl
     gs.log.debug(f"Jami controller object ctrl set. {gs.ctrl.__dict__}")
 
 
-def action_account() -> None:
+async def action_account() -> None:
     """Set the accountid.
 
     Sets the global accountid or raises an exception to quit program.
@@ -1098,9 +3823,10 @@ def action_account() -> None:
     if gs.account is not None:
         # alread set
         return
-    accts = gs.ctrl.getAllEnabledAccounts()
+    accts = await gs.ctrl.getAllEnabledAccounts()
     for acct in accts:
-        details = gs.ctrl.getAccountDetails(acct)
+        # served from the account cache, no extra round trip
+        details = await gs.ctrl.getAccountDetails(acct)
         gs.log.debug(f"Account details: {details}")
 
     if gs.pa.account is None:
@@ -1135,17 +3861,21 @@ def action_account() -> None:
             f"Account {gs.pa.account} was specified in command line. "
             "--account was used."
         )
-        # check if account is valid
+        # check if account is valid, it can be an id, an alias or a username
         # otherwise raise error
-        if gs.pa.account not in accts:
+        acct = await gs.ctrl.resolveAccount(gs.pa.account, accts)
+        if acct is None:
             txt = (
                 "E234: "
-                "Account is not a valid accountid. "
+                "Account is not a valid accountid, alias or username. "
                 "Specify correct accountid with --account. "
                 f"Valid accountids are {accts}."
             )
             gs.err_count += 1
             raise JamiCommanderError(txt)
+        if acct != gs.pa.account:
+            gs.log.debug(f"Account {gs.pa.account} resolved to {acct}.")
+            gs.pa.account = acct
     gs.account = gs.pa.account
     gs.log.debug(f"Account {gs.account} is valid and will be used.")
 
@@ -1169,16 +3899,31 @@ async def async_main() -> None:
             # do NOT set the account value --account
             await action_accountmgmt()
         if gs.conversation_action or gs.setget_action:
-            action_account()  # set the account value --account
+            await action_account()  # set the account value --account
             await action_conversationsetget()
+        if gs.export_action:
+            await action_account()  # set the account value --account
+            await action_export_history()
         if gs.send_action:
-            action_account()  # set the account value --account
+            await action_account()  # set the account value --account
             await action_send()
+        if gs.batch_action:
+            # jobs may specify the account, so a default account is optional
+            accts = await gs.ctrl.getAllEnabledAccounts()
+            if gs.pa.account is not None or len(accts) == 1:
+                await action_account()  # set the account value --account
+            await action_batch()
+        if gs.serve_action:
+            # requests may specify the account, so a default is optional
+            accts = await gs.ctrl.getAllEnabledAccounts()
+            if gs.pa.account is not None or len(accts) == 1:
+                await action_account()  # set the account value --account
+            await action_serve()
         # if gs.pa.room_invites and gs.pa.listen not in (FOREVER, ONCE):
         #    action_account() # set the account value --account
         #     await listen_invites_once(gs....)
         if gs.listen_action:
-            action_account()  # set the account value --account
+            await action_account()  # set the account value --account
             await action_listen()
         # if gs.pa.logout:
         #     await action_logout()
@@ -1186,7 +3931,35 @@ async def async_main() -> None:
         raise
     finally:
         # clean up DBUS API connection
-        gs.log.debug("Leaving DBUS session, no cleanup necessary.")
+        if gs.ctrl is not None:
+            gs.log.debug(
+                f"Account cache statistics: {gs.ctrl.getAccountCacheStats()}"
+            )
+            if not await gs.ctrl.close():
+                gs.log.warning(
+                    "W114: "
+                    "The Jami controller thread did not stop in time."
+                )
+                gs.warn_count += 1
+        gs.log.debug("Leaving DBUS session.")
+
+
+def has_jami_actions() -> bool:
+    """Return True if an action needs the Jami daemon."""
+    return (
+        gs.send_action
+        # todo
+        or gs.accountmgmt_action
+        or gs.conversation_action
+        or gs.listen_action
+        or gs.export_action
+        or gs.batch_action
+        or gs.serve_action
+        # or gs.pa.listen != LISTEN_DEFAULT
+        # or gs.pa.tail != TAIL_UNUSED_DEFAULT
+        # or gs.pa.verify
+        or gs.setget_action
+    )
 
 
 def check_arg_files_readable() -> None:
@@ -1229,35 +4002,167 @@ def check_download_media_dir() -> None:
         if os.access(dl, os.W_OK):  # Check for write access
             return  # all OK
         else:
-            raise PermissionError(
-                errno.EPERM,
-                "E238: "
-                "Found an existing media download directory "
-                f'"{dl}". But this directory is lacking write '
-                "permissions. Add write permissions to it.",
-                dl,
-            )
-    else:
-        # not a file, not a directory, create directory
-        mode = 0o777
+            raise PermissionError(
+                errno.EPERM,
+                "E238: "
+                "Found an existing media download directory "
+                f'"{dl}". But this directory is lacking write '
+                "permissions. Add write permissions to it.",
+                dl,
+            )
+    else:
+        # not a file, not a directory, create directory
+        mode = 0o777
+        try:
+            os.mkdir(dl, mode)
+        except OSError as e:
+            raise OSError(
+                e.errno,
+                "E239: "
+                "Could not create media download directory "
+                f"{dl} for you. ({e})",
+                dl,
+            )
+        gs.log.debug(f'Created media download directory "{dl}" for you.')
+
+
+def load_version_cache(path: str) -> dict:
+    """Read the cached PyPI answer {"version", "etag", "fetched"}.
+
+    A missing or unreadable cache is treated as empty.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if isinstance(cache, dict) and cache.get("version"):
+            return cache
+    except Exception as e:
+        gs.log.debug(f'Version cache "{path}" not used. ({e})')
+    return {}
+
+
+def save_version_cache(path: str, cache: dict) -> None:
+    """Write the cached PyPI answer, the file is replaced atomically."""
+    try:
+        save_json_file(path, cache)
+    except Exception as e:
+        gs.log.debug(f'Version cache "{path}" not written. ({e})')
+
+
+def fetch_pypi_version(url: str, etag: Union[None, str]) -> tuple:
+    """Ask PyPI for the latest release, blocking.
+
+    Returns (version, etag). version is None if PyPI answered
+    "304 Not Modified" to the If-None-Match etag.
+    """
+    import urllib.error
+    import urllib.request
+
+    request = urllib.request.Request(
+        url, headers={"Accept": "application/json"}
+    )
+    if etag:
+        request.add_header("If-None-Match", etag)
+    try:
+        with urllib.request.urlopen(
+            request, timeout=VERSION_CHECK_TIMEOUT
+        ) as response:
+            # "info" describes the latest release, no need to look
+            # at the (long) list of all releases
+            version = json.load(response)["info"]["version"]
+            return version, response.headers.get("ETag")
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, etag
+        raise
+
+
+async def get_latest_version(pkg: str) -> Union[None, str]:
+    """Return the latest version of pkg on PyPI.
+
+    The answer is cached in VERSION_CACHE_FILE for VERSION_CACHE_TTL
+    seconds. After that PyPI is asked again, sending the cached etag, so
+    an unchanged answer is not downloaded again. PyPI gets at most
+    VERSION_CHECK_TIMEOUT seconds. If it fails, the stale cached version
+    is used. Returns None if there is neither an answer nor a
+    cached version.
+    """
+    import asyncio
+
+    path = VERSION_CACHE_FILE
+    cache = load_version_cache(path)
+    now = time.time()
+    fetched = cache.get("fetched", 0)
+    if 0 <= now - fetched < VERSION_CACHE_TTL:
+        gs.log.debug(f'Using version cached in "{path}".')
+        return cache["version"]
+
+    # fetch package metadata from PyPI
+    pypi_url = f"https://pypi.org/pypi/{pkg}/json"
+    gs.log.debug(f"getting version data from URL {pypi_url}")
+    # A daemon thread instead of asyncio.to_thread(): a hanging DNS
+    # lookup is not covered by the socket timeout and must neither block
+    # the event loop nor the exit of the program.
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(method, value):
+        if not future.done():
+            method(value)
+
+    def fetch():
+        try:
+            result = fetch_pypi_version(pypi_url, cache.get("etag"))
+        except Exception as e:
+            callback = (resolve, future.set_exception, e)
+        else:
+            callback = (resolve, future.set_result, result)
         try:
-            os.mkdir(dl, mode)
-        except OSError as e:
-            raise OSError(
-                e.errno,
-                "E239: "
-                "Could not create media download directory "
-                f"{dl} for you. ({e})",
-                dl,
+            loop.call_soon_threadsafe(*callback)
+        except RuntimeError:
+            pass  # loop already closed, nobody waits any more
+
+    import threading
+
+    threading.Thread(target=fetch, daemon=True).start()
+    try:
+        version, etag = await asyncio.wait_for(
+            future, VERSION_CHECK_TIMEOUT
+        )
+    except Exception as e:
+        if isinstance(e, asyncio.TimeoutError):
+            e = f"no answer within {VERSION_CHECK_TIMEOUT} seconds"
+        if not cache:
+            gs.log.warning(
+                f"W125: Could not obtain version info from {pypi_url} for "
+                f"you. ({e})"
             )
-        gs.log.debug(f'Created media download directory "{dl}" for you.')
+            gs.warn_count += 1
+            return None
+        gs.log.warning(
+            f"W118: Could not obtain version info from {pypi_url} for "
+            f"you. Using the version cached in \"{path}\" instead. ({e})"
+        )
+        gs.warn_count += 1
+        return cache["version"]
+    if version is None:
+        gs.log.debug("PyPI: not modified since last check.")
+        version = cache["version"]
+    save_version_cache(
+        path, {"version": version, "etag": etag, "fetched": now}
+    )
+    return version
 
 
 def check_version() -> None:
     """Check if latest version."""
+    import asyncio
+
     pkg = PROG_WITHOUT_EXT
     ver = VERSIONNR  # default, fallback
     try:
+        from importlib import metadata
+
         ver_pip = metadata.version(pkg)  # from installed pip package
     except Exception as e:
         gs.log.debug(
@@ -1278,21 +4183,12 @@ def check_version() -> None:
     gs.log.debug(f"Version of currently executed package {pkg} is {ver}.")
 
     installed_version = LooseVersion(ver)
-    # fetch package metadata from PyPI
-    pypi_url = f"https://pypi.org/pypi/{pkg}/json"
-    gs.log.debug(f"getting version data from URL {pypi_url}")
-    try:
-        response = urllib.request.urlopen(pypi_url).read().decode()
-    except Exception as e:
-        gs.log.warning(
-            "Could not obtain version info from " f"{pypi_url} for you. ({e})"
-        )
+    latest = asyncio.run(get_latest_version(pkg))
+    if latest is None:
         latest_version = "unknown"
         utd = "Try again later."
     else:
-        latest_version = max(
-            LooseVersion(s) for s in json.loads(response)["releases"].keys()
-        )
+        latest_version = LooseVersion(latest)
         if installed_version >= latest_version:
             utd = "You are up-to-date!"
         else:
@@ -1395,6 +4291,9 @@ def initial_check_of_args() -> None:  # noqa: C901
 
     if gs.pa.output is not None:
         gs.pa.output = gs.pa.output.lower()
+    gs.pa.file_stdin_mode = gs.pa.file_stdin_mode.lower()
+    gs.pa.dedupe_action = gs.pa.dedupe_action.lower()
+    gs.pa.listen = gs.pa.listen.lower()
 
     # accountmgmt
     if gs.pa.add_account or gs.pa.remove_account or gs.pa.get_enabled_accounts:
@@ -1419,6 +4318,21 @@ def initial_check_of_args() -> None:  # noqa: C901
     else:
         gs.send_action = False
 
+    # batch
+    gs.batch_action = gs.pa.batch is not None
+
+    # serve
+    gs.serve_action = gs.pa.serve is not None
+
+    # listen
+    gs.listen_action = gs.pa.listen != LISTEN_NEVER
+
+    # export
+    gs.export_action = gs.pa.export_history is not None
+
+    # search, needs no Jami daemon
+    gs.search_action = gs.pa.search is not None
+
     # get
     if gs.pa.get_conversations or gs.pa.get_conversation_members:
         gs.get_action = True
@@ -1446,7 +4360,11 @@ def initial_check_of_args() -> None:  # noqa: C901
             if message == "-" or message == "_":
                 STDIN_MESSAGE += 1
                 gs.stdin_use = "message"
-    STDIN_TOTAL = STDIN_MESSAGE + STDIN_FILE
+    STDIN_BATCH = 0
+    if gs.pa.batch == "-":
+        STDIN_BATCH += 1
+        gs.stdin_use = "batch"
+    STDIN_TOTAL = STDIN_MESSAGE + STDIN_FILE + STDIN_BATCH
 
     # Secondly, the checks
     if gs.pa.version and (
@@ -1458,6 +4376,66 @@ def initial_check_of_args() -> None:  # noqa: C901
         )
     elif gs.pa.account is not None and (gs.pa.account.strip() == ""):
         t = "Don't use an empty name for --account."
+    elif gs.pa.tmp_dir is not None and not os.path.isdir(gs.pa.tmp_dir):
+        t = f'--tmp-dir "{gs.pa.tmp_dir}" is not an existing directory.'
+    elif gs.pa.file_stdin_mode not in (
+        FILE_STDIN_AUTO,
+        FILE_STDIN_TMPFILE,
+        FILE_STDIN_MEMFD,
+    ):
+        t = (
+            "Incorrect value given for --file-stdin-mode. "
+            f"Only '{FILE_STDIN_AUTO}', '{FILE_STDIN_TMPFILE}' and "
+            f"'{FILE_STDIN_MEMFD}' are allowed."
+        )
+    elif gs.pa.file_stdin_mode == FILE_STDIN_MEMFD and not (
+        hasattr(os, "memfd_create") and can_use_fd_path()
+    ):
+        t = (
+            f'--file-stdin-mode "{FILE_STDIN_MEMFD}" is not supported '
+            "on this system."
+        )
+    elif gs.pa.dedupe_action not in (DEDUPE_SKIP, DEDUPE_REFERENCE):
+        t = (
+            "Incorrect value given for --dedupe-action. "
+            f"Only '{DEDUPE_SKIP}' and '{DEDUPE_REFERENCE}' are allowed."
+        )
+    elif gs.pa.export_page_size < 2:
+        t = "--export-page-size must be at least 2."
+    elif gs.pa.search_limit < 1:
+        t = "--search-limit must be at least 1."
+    elif gs.pa.download_quota < 0:
+        t = "--download-quota must not be negative."
+    elif gs.pa.download_parallel < 1:
+        t = "--download-parallel must be at least 1."
+    elif gs.pa.download_parallel_conversation < 1:
+        t = "--download-parallel-conversation must be at least 1."
+    elif gs.pa.download_media and gs.pa.listen == LISTEN_NEVER:
+        t = "--download-media requires --listen."
+    elif gs.pa.listen_checkpoint and gs.pa.listen == LISTEN_NEVER:
+        t = "--listen-checkpoint requires --listen."
+    elif gs.pa.listen not in (LISTEN_NEVER, LISTEN_FOREVER):
+        t = (
+            "Incorrect value given for --listen. "
+            f"Only '{LISTEN_NEVER}' and '{LISTEN_FOREVER}' are allowed."
+        )
+    elif gs.pa.batch not in (None, "-") and not (
+        isfile(gs.pa.batch) and access(gs.pa.batch, R_OK)
+    ):
+        t = f'--batch file "{gs.pa.batch}" was not found or is not readable.'
+    elif gs.pa.wait_transfers is not None and gs.pa.wait_transfers < 0:
+        t = "--wait-transfers must not be negative."
+    elif gs.pa.dedupe_ttl < 1:
+        t = "--dedupe-ttl must be at least 1."
+    elif gs.pa.max_message_size < 0:
+        t = "--max-message-size must not be negative."
+    elif gs.pa.parallel < 1:
+        t = "--parallel must be at least 1."
+    elif gs.pa.stream_flush_ms < 0 or gs.pa.stream_max_bytes < 1:
+        t = (
+            "--stream-flush-ms must not be negative and "
+            "--stream-max-bytes must be at least 1."
+        )
     elif gs.pa.output not in (
         OUTPUT_TEXT,
         OUTPUT_JSON,
@@ -1535,28 +4513,10 @@ class colors:
 
 
 # according to linter: function is too complex, C901
-def main_inner(
-    argv: Union[None, list] = None
-) -> None:  # noqa: C901 # ignore mccabe if-too-complex
-    """Run the program.
-
-    Function signature identical to main().
-    Please see main().
-
-    Returns None. Returns nothing.
-
-    Raises exception if an error is detected. Many exceptions are
-        possible. One of them is: JamiCommanderError.
-        Sets global state to communicate errors.
+def build_parser() -> argparse.ArgumentParser:
+    """Construct the argument parser."""
+    import argparse
 
-    """
-    if argv:
-        sys.argv = argv
-    # prepare the global state
-    global gs
-    gs = GlobalState()
-    global SEP
-    # Construct the argument parser
     ap = argparse.ArgumentParser(
         add_help=False,
         description=(f"Welcome to {PROG_WITHOUT_EXT}, a Jami CLI client. "),
@@ -1601,9 +4561,14 @@ def main_inner(
         required=False,
         action="store_true",
         help="Print README.md file. "
-        "Details:: Tries to print the local README.md file from installation. "
-        "If not found it will get the README.md file from github.com and "
-        "print it. See also --usage, --help, and --manual.",
+        "Details:: Prints the README.md file installed with the package. "
+        "If not found it uses the README.md file of a git checkout, "
+        "or the one downloaded earlier. Only if there is none of them, "
+        "it downloads the README.md file from github.com, caches it in "
+        f"'{README_CACHE_FILE_SHOWN}' and prints it. The download gives up "
+        f"after {README_FETCH_TIMEOUT} seconds. If the output is a "
+        f"terminal, the file is shown with $PAGER (default "
+        f"'{PAGER_DEFAULT}'). See also --usage, --help, and --manual.",
     )
     # Add the arguments to the parser
     ap.add_argument(
@@ -1770,6 +4735,9 @@ def main_inner(
         "Details:: This requires exactly one argument, the account id. "
         "This is not the user name but the long random looking "
         "string made up of hexadecimal digits. "
+        "Alternatively the alias or the username of an enabled account "
+        "can be given. If several enabled accounts share the alias, "
+        "the first one is used. "
         "If --account is not used then {PROG_WITHOUT_EXT} will "
         "try to automatically detect and use an enabled account. "
         "To be used by arguments like --message and -file. ",
@@ -1870,6 +4838,50 @@ def main_inner(
         "See also --conversations. ",
     )
 
+    ap.add_argument(
+        "--tmp-dir",
+        required=False,
+        type=str,
+        metavar="DIRECTORY",
+        help="Set the directory for temporary files. "
+        "Details:: A file piped in with '-f -' is stored in a temporary "
+        "file before it is sent. The data is copied in chunks, so "
+        "even huge files do not use much memory. The temporary file is "
+        "removed after sending. A tmpfs directory like '/dev/shm' avoids "
+        "writing to disk, but then the file must fit into RAM. "
+        "The Jami daemon must be able to read files in DIRECTORY. "
+        "Defaults to the system's temporary directory, e.g. '/tmp' "
+        "or the directory given in environment variable TMPDIR.",
+    )
+
+    ap.add_argument(
+        "--file-stdin-mode",
+        required=False,
+        type=str,
+        default=FILE_STDIN_MODE_DEFAULT,
+        metavar="AUTO|TMPFILE|MEMFD",
+        help="Select how a file piped in with '-f -' is handed to Jami. "
+        f"Details:: With '{FILE_STDIN_TMPFILE}' the data is always copied "
+        "into a temporary file in --tmp-dir. "
+        f"With '{FILE_STDIN_MEMFD}' piped data is copied into an anonymous "
+        "memory file (memfd, Linux only) and nothing is written to disk, "
+        "but the file must fit into RAM. "
+        f"With '{FILE_STDIN_AUTO}' piped data is copied into a temporary "
+        "file. "
+        f"With '{FILE_STDIN_AUTO}' and '{FILE_STDIN_MEMFD}' a regular file "
+        "redirected into stdin (e.g. '< backup.tar') is not copied at all, "
+        "Jami reads it directly via '/proc/<pid>/fd/0'. "
+        f"Limitation of '{FILE_STDIN_AUTO}' and '{FILE_STDIN_MEMFD}': a "
+        "'/proc/<pid>/fd/N' path only exists while "
+        f"{PROG_WITHOUT_EXT} runs, but Jami reads the file after the send "
+        "returned and cannot hardlink it into the conversation. So these "
+        "modes only take effect together with --wait-transfers, otherwise "
+        "the data is copied into a temporary file. Peers downloading the "
+        f"file after {PROG_WITHOUT_EXT} exited may fail. "
+        f"Defaults to '{FILE_STDIN_MODE_DEFAULT}', which has no such "
+        "limitation.",
+    )
+
     # -h already used for --help, -w for "web"
     ap.add_argument(
         "-w",
@@ -1936,6 +4948,377 @@ def main_inner(
         "By default, i.e. if not set, no messages will be split.",
     )
 
+    ap.add_argument(
+        "--max-message-size",
+        required=False,
+        type=int,
+        default=MAX_MESSAGE_SIZE_DEFAULT,
+        metavar="BYTES",
+        help="Set the maximum size of a text message. "
+        "Details:: Messages longer than BYTES bytes are cut into several "
+        "messages of at most BYTES bytes. This is applied after --split. "
+        "Data piped in with '-m -' is split and cut while it is being "
+        "read, so setting --split or --max-message-size keeps memory use "
+        "low even for huge inputs. "
+        f"Defaults to {MAX_MESSAGE_SIZE_DEFAULT}, i.e. no limit.",
+    )
+
+    ap.add_argument(
+        "--stream-flush-ms",
+        required=False,
+        type=int,
+        default=STREAM_FLUSH_MS_DEFAULT,
+        metavar="MILLISECONDS",
+        help="Merge streamed lines into fewer messages. "
+        "Details:: Only used when streaming with '-m _'. "
+        "Lines arriving on the stdin pipe within MILLISECONDS of the "
+        "first unsent line are merged into one message. A line is "
+        "never delayed by more than MILLISECONDS. This reduces the "
+        "number of messages a lot for bursty input like logs. "
+        f"Defaults to {STREAM_FLUSH_MS_DEFAULT}, i.e. each line is sent "
+        "as a separate message. See also --stream-max-bytes.",
+    )
+
+    ap.add_argument(
+        "--stream-max-bytes",
+        required=False,
+        type=int,
+        default=STREAM_MAX_BYTES_DEFAULT,
+        metavar="BYTES",
+        help="Set the maximum size of a merged streamed message. "
+        "Details:: Only used together with --stream-flush-ms. A merged "
+        "message is sent as soon as it reaches BYTES bytes. A line "
+        "that would make it larger starts a new message. "
+        f"Defaults to {STREAM_MAX_BYTES_DEFAULT}.",
+    )
+
+    ap.add_argument(
+        "--parallel",
+        required=False,
+        type=int,
+        default=PARALLEL_DEFAULT,
+        metavar="N",
+        help="Set the maximum number of concurrent sends. "
+        "Details:: Messages and files are sent to all conversations "
+        "given in --conversations concurrently, with at most N send "
+        "requests to the Jami daemon in flight at the same time. "
+        "Within one conversation messages and files are always sent "
+        "one after another, in their original order. "
+        f"Defaults to {PARALLEL_DEFAULT}. Use 1 to send strictly "
+        "sequentially.",
+    )
+
+    ap.add_argument(
+        "--send-report",
+        required=False,
+        action="store_true",
+        help="Print a result table after sending. "
+        "Details:: For every conversation and every message or file "
+        "print conversation id, type, status, start time and duration "
+        "in seconds, and the message or file name. "
+        "Use --output json to get the results as JSON object.",
+    )
+
+    ap.add_argument(
+        "--wait-transfers",
+        required=False,
+        type=float,
+        nargs="?",
+        const=WAIT_TRANSFERS_FOREVER,
+        metavar="TIMEOUT",
+        help="Wait until sent files are transferred. "
+        "Details:: Normally the program ends as soon as Jami accepted the "
+        "files to be sent, while the transfers might still be running. "
+        "With this option the program waits until all file transfers "
+        "finished or failed, but at most TIMEOUT seconds. Then for every "
+        "file and conversation the final status, the bytes transferred, "
+        "the duration in seconds and the throughput are printed. "
+        "Temporary files of '-f -' are kept until the transfers finished. "
+        "If TIMEOUT is not given or 0, there is no time limit.",
+    )
+
+    ap.add_argument(
+        "--dedupe",
+        required=False,
+        type=str,
+        nargs="?",
+        const=DEDUPE_CACHE_DEFAULT,
+        metavar="INDEX_FILE",
+        help="Do not send the same file to the same conversation again. "
+        "Details:: The SHA-256 hash of the content of every file sent "
+        "is remembered per conversation in INDEX_FILE. Files with "
+        "identical content are not sent again to a conversation while "
+        "the entry is younger than --dedupe-ttl. The file name does not "
+        "matter, only the content. "
+        "What happens instead is set with --dedupe-action. "
+        f"If INDEX_FILE is not given, '{DEDUPE_CACHE_SHOWN}' is used.",
+    )
+
+    ap.add_argument(
+        "--dedupe-ttl",
+        required=False,
+        type=int,
+        default=DEDUPE_TTL_DEFAULT,
+        metavar="SECONDS",
+        help="Set how long --dedupe remembers a sent file. "
+        "Details:: After SECONDS the same file is sent again. "
+        f"Defaults to {DEDUPE_TTL_DEFAULT} seconds, i.e. one day.",
+    )
+
+    ap.add_argument(
+        "--dedupe-action",
+        required=False,
+        type=str,
+        default=DEDUPE_ACTION_DEFAULT,
+        metavar="SKIP|REFERENCE",
+        help="Select what --dedupe does with a file already sent. "
+        f"Details:: With '{DEDUPE_SKIP}' the file is silently skipped. "
+        f"With '{DEDUPE_REFERENCE}' a short text message referring to the "
+        "file sent before is sent instead of the file. "
+        f"Defaults to '{DEDUPE_ACTION_DEFAULT}'.",
+    )
+
+    ap.add_argument(
+        "--batch",
+        required=False,
+        type=str,
+        metavar="MANIFEST_FILE",
+        help="Send many messages and files in one go. "
+        "Details:: MANIFEST_FILE contains one send job per line in JSON "
+        "format (JSON Lines). Use '-' to read the jobs from stdin. A job "
+        'looks like {"account": "myalias", "conversations": ["abc..."], '
+        '"message": "Hello", "format": "markdown"}. Instead of or in '
+        'addition to "message" a job can contain "file": "report.pdf". '
+        '"message", "file" and "conversations" can be a string or a list '
+        'of strings. "account" (accountid, alias or username) is optional '
+        "if --account is used or only one account exists. "
+        f'"format" is one of {", ".join(FORMATS)}; '
+        "if not given -w, -z, -k and -j decide. "
+        'An optional "id" is copied into the result. '
+        "All jobs share one connection to Jami and are sent while the "
+        "manifest is still being read, jobs for the same conversation in "
+        "manifest order, see also --parallel. --dedupe and "
+        "--wait-transfers apply to the files of every job. For every job "
+        "one line of JSON with the results, including the transfers, is "
+        "printed as soon as the job is done.",
+    )
+
+    ap.add_argument(
+        "--serve",
+        required=False,
+        type=str,
+        metavar="SOCKET",
+        help="Run as server, accepting requests on a Unix socket. "
+        f"Details:: {PROG_WITHOUT_EXT} keeps running and keeps its "
+        "connection to Jami, so each request costs one round trip "
+        "instead of starting a new process. SOCKET is the path of the "
+        "Unix domain socket to create, only the own user can use it. "
+        "The protocol is JSON-RPC 2.0 with one JSON object per line. "
+        "Methods are: ping, getAccounts, send, getConversations, "
+        "getConversationMembers, addConversation, removeConversation, "
+        "addConversationMember and removeConversationMember. Params are "
+        'a JSON object; "account" is optional if --account is used or '
+        'only one account exists; "conversation" and "member" are ids. '
+        'The params of "send" are a job as described in --batch. '
+        "Requests are executed concurrently. Stop the server with "
+        "SIGTERM or Control-C. E.g. "
+        f"'echo \'{{\"jsonrpc\": \"2.0\", \"id\": 1, \"method\": \"send\", "
+        '\"params\": {\"conversations\": \"abc...\", \"message\": \"Hi\"}}\' '
+        "| socat - UNIX-CONNECT:SOCKET'.",
+    )
+
+    ap.add_argument(
+        "--listen",
+        required=False,
+        type=str,
+        default=LISTEN_DEFAULT,
+        nargs="?",
+        const=LISTEN_FOREVER,
+        metavar="NEVER|FOREVER",
+        help="Print received messages. "
+        f"Details:: If no argument is given, '{LISTEN_FOREVER}' is "
+        f"assumed. With '{LISTEN_FOREVER}' {PROG_WITHOUT_EXT} keeps "
+        "running and prints every message received by the account until "
+        "it gets SIGTERM or Control-C. With --conversations only messages "
+        "of these conversations are printed. One line is printed per "
+        "message. With '--output json' each line is a JSON object "
+        "(JSON Lines) with the keys 'accountid', 'conversationid', 'id', "
+        "'type', 'author', 'timestamp', 'body' and more, as provided by "
+        "Jami. Bursts of messages are written with a single flush. "
+        f"'{LISTEN_NEVER}' is the default and does not listen. "
+        "Listening is performed after all other actions.",
+    )
+
+    ap.add_argument(
+        "--listen-checkpoint",
+        required=False,
+        type=str,
+        nargs="?",
+        const=LISTEN_CHECKPOINT_DEFAULT,
+        metavar="FILE",
+        help="Continue listening where the previous run stopped. "
+        "Details:: Used with --listen. The id of the last message printed "
+        "in each conversation is saved in FILE, at most every "
+        f"{LISTEN_CHECKPOINT_INTERVAL} seconds and when listening stops. "
+        "The file is replaced atomically, so it survives a crash. On "
+        "start, the messages received since these checkpoints, e.g. while "
+        f"{PROG_WITHOUT_EXT} was restarted, are loaded from the history "
+        "of the conversations and printed first, oldest first. Then "
+        "listening continues with live messages, without gaps and without "
+        "duplicates. After a crash the messages of the last few seconds "
+        "may be printed again. Conversations without checkpoint, e.g. on "
+        "the first run, start with their newest message. If the message "
+        "of a checkpoint is no longer in the history, only the newest "
+        f"{LISTEN_CATCH_UP_MAX} messages are caught up. "
+        f"If FILE is not given, '{LISTEN_CHECKPOINT_SHOWN}' is used. "
+        "One FILE can be shared by several accounts, but not by processes "
+        "running at the same time.",
+    )
+
+    ap.add_argument(
+        "--archive",
+        required=False,
+        type=str,
+        nargs="?",
+        const=ARCHIVE_DEFAULT,
+        metavar="DB",
+        help="Store received messages in an SQLite database. "
+        "Details:: Every message printed by --listen is also stored in "
+        "the SQLite database DB, together with a full-text index of the "
+        "message bodies. Search it with --search. "
+        f"If DB is not given, '{ARCHIVE_SHOWN}' is used. Databases "
+        "written by --export-history have the same format, so exported "
+        "history can be searched too.",
+    )
+
+    ap.add_argument(
+        "--search",
+        required=False,
+        type=str,
+        metavar="QUERY",
+        help="Search the messages stored by --archive. "
+        "Details:: Prints the messages whose body matches QUERY, most "
+        "recently stored first, one per line like --listen, as JSON Lines "
+        "with '--output json'. "
+        "QUERY uses the SQLite FTS5 syntax, e.g. 'invoice', "
+        "'\"disk full\"', 'back* AND up' or 'NEAR(disk full)'. "
+        "With --conversations only these conversations are searched. "
+        "The database is the one given with --archive, by default "
+        f"'{ARCHIVE_SHOWN}'. Searching does not need the Jami daemon. "
+        "See also --search-limit.",
+    )
+
+    ap.add_argument(
+        "--search-limit",
+        required=False,
+        type=int,
+        default=SEARCH_LIMIT_DEFAULT,
+        metavar="N",
+        help="Set the maximum number of messages printed by --search. "
+        f"Details:: Defaults to {SEARCH_LIMIT_DEFAULT}.",
+    )
+
+    ap.add_argument(
+        "--download-media",
+        required=False,
+        type=str,
+        default="",
+        nargs="?",
+        const=DOWNLOAD_MEDIA_DEFAULT,
+        metavar="DIR",
+        help="Download the files received while listening. "
+        "Details:: Used with --listen. Every file received by the account "
+        "(in the conversations given with --conversations) is downloaded "
+        "into the directory DIR, which is created if it does not exist. "
+        f"If DIR is not given, '{DOWNLOAD_MEDIA_DEFAULT}' in the current "
+        "directory is used. A file keeps the name given by its sender, "
+        "with a number appended if the name is taken. The printed message "
+        "gets the key 'download' with the path of the file. The download "
+        "runs in the background, its completion is logged. "
+        f"A download not completed within {DOWNLOAD_TIMEOUT} seconds "
+        "gives up its slot. "
+        "Each distinct content is stored only once, in the subdirectory "
+        f"'{MEDIA_STORE_DIR}', and the files in DIR are hardlinks to it. "
+        "So a file posted in several conversations takes its space once, "
+        "and a file whose content is already stored is not downloaded "
+        "again. See also --download-quota, --download-parallel and "
+        "--download-parallel-conversation.",
+    )
+
+    ap.add_argument(
+        "--download-quota",
+        required=False,
+        type=int,
+        default=DOWNLOAD_QUOTA_DEFAULT,
+        metavar="BYTES",
+        help="Set the maximum size of the downloaded files. "
+        "Details:: When the files stored by --download-media exceed BYTES "
+        "in total, the least recently received contents are deleted, "
+        "together with all their files in the media directory, until the "
+        "total fits again. The most recent file is kept even if it alone "
+        f"exceeds BYTES. Defaults to {DOWNLOAD_QUOTA_DEFAULT}, i.e. no "
+        "limit.",
+    )
+
+    ap.add_argument(
+        "--download-parallel",
+        required=False,
+        type=int,
+        default=DOWNLOAD_PARALLEL_DEFAULT,
+        metavar="N",
+        help="Set the maximum number of concurrent downloads. "
+        "Details:: Limits the downloads of --download-media running at "
+        "once, across all conversations. Further files wait in line. "
+        f"Defaults to {DOWNLOAD_PARALLEL_DEFAULT}.",
+    )
+
+    ap.add_argument(
+        "--download-parallel-conversation",
+        required=False,
+        type=int,
+        default=DOWNLOAD_PARALLEL_CONVERSATION_DEFAULT,
+        metavar="N",
+        help="Set the maximum number of concurrent downloads per "
+        "conversation. "
+        "Details:: Limits the downloads of --download-media running at "
+        "once for the same conversation, so that a conversation receiving "
+        "many files does not delay the files of other conversations. "
+        f"Defaults to {DOWNLOAD_PARALLEL_CONVERSATION_DEFAULT}.",
+    )
+
+    ap.add_argument(
+        "--export-history",
+        required=False,
+        type=str,
+        metavar="FILE",
+        help="Export the message history of conversations. "
+        "Details:: The history of the conversations given with "
+        "--conversations, or of all conversations of the account, is "
+        "fetched from Jami page by page and appended to FILE. "
+        f"If FILE ends with {', '.join(SQLITE_SUFFIXES)} it is an SQLite "
+        "database with the tables 'messages' and 'checkpoints'. Otherwise "
+        "FILE gets one JSON object per message (JSON Lines), '-' prints "
+        "them to stdout. Messages are exported newest first. A checkpoint "
+        "per conversation is stored in the database, or next to FILE in "
+        "FILE.checkpoint.json. So a rerun exports only the messages "
+        "received since the last run, and an interrupted export "
+        "continues where it stopped. See also --export-page-size.",
+    )
+
+    ap.add_argument(
+        "--export-page-size",
+        required=False,
+        type=int,
+        default=EXPORT_PAGE_SIZE_DEFAULT,
+        metavar="N",
+        help="Set the number of messages fetched at once by "
+        "--export-history. "
+        "Details:: Memory use is proportional to N times --parallel, "
+        "not to the length of the history. The messages caught up by "
+        "--listen-checkpoint are fetched in pages of N messages too. "
+        f"Defaults to {EXPORT_PAGE_SIZE_DEFAULT}.",
+    )
+
     ap.add_argument(
         "--separator",
         required=False,
@@ -1999,10 +5382,162 @@ def main_inner(
         "on every run, only a 'check pypi.org' upon request. Your "
         "privacy is protected. The new release is neither downloaded, "
         "nor installed. It just informs you. "
+        f"The answer of pypi.org is cached for {VERSION_CACHE_TTL // 3600} "
+        f"hours in '{VERSION_CACHE_FILE_SHOWN}'. pypi.org gets at most "
+        f"{VERSION_CHECK_TIMEOUT} seconds to answer, otherwise the cached "
+        "version is used. "
         "After printing version information the "
         "program will continue to run. This is useful for having version "
         "number in the log files.",
     )
+    return ap
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Return the argument parser, it is built once per process.
+
+    Repeated calls of main() reuse the parser.
+    """
+    global parser
+    if parser is None:
+        parser = build_parser()
+    return parser
+
+
+def find_readme() -> Union[None, str]:
+    """Return the path of a local README.md or None.
+
+    Looks for the README.md bundled with the package, then for the one
+    of a git checkout, then for one downloaded earlier by fetch_readme().
+    """
+    pkgdir = os.path.dirname(os.path.realpath(__file__))
+    for readme in (
+        os.path.join(pkgdir, "README.md"),
+        os.path.join(os.path.dirname(pkgdir), "README.md"),
+        README_CACHE_FILE,
+    ):
+        if isfile(readme) and access(readme, R_OK):
+            return readme
+    return None
+
+
+def fetch_readme() -> str:
+    """Download README.md into README_CACHE_FILE, return its path.
+
+    Gives up after README_FETCH_TIMEOUT seconds. The cache file is
+    replaced atomically, so it is never seen half written.
+    """
+    import urllib.request
+
+    gs.log.info(
+        f"README.md not found locally. Downloading it from "
+        f"{README_FILE_RAW_URL}."
+    )
+    cachedir = os.path.dirname(README_CACHE_FILE)
+    os.makedirs(cachedir, exist_ok=True)
+    with urllib.request.urlopen(
+        README_FILE_RAW_URL, timeout=README_FETCH_TIMEOUT
+    ) as response, tempfile.NamedTemporaryFile(
+        dir=cachedir, prefix=".README-", delete=False
+    ) as f:
+        try:
+            shutil.copyfileobj(response, f, FILE_COPY_CHUNK_SIZE)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, README_CACHE_FILE)
+    return README_CACHE_FILE
+
+
+def page_file(path: str) -> None:
+    """Stream a file to stdout, through $PAGER if stdout is a terminal."""
+    with open(path, "rb") as fin:
+        if sys.stdout.isatty():
+            import shlex
+            import subprocess
+
+            pager = shlex.split(os.environ.get("PAGER") or PAGER_DEFAULT)
+            # like git: quit if one screen, keep colors, no init
+            env = dict(os.environ)
+            env.setdefault("LESS", "FRX")
+            try:
+                proc = subprocess.Popen(pager, stdin=subprocess.PIPE, env=env)
+            except OSError:
+                pass  # no pager, print it
+            else:
+                try:
+                    shutil.copyfileobj(fin, proc.stdin, FILE_COPY_CHUNK_SIZE)
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass  # pager quit before the end of file
+                proc.wait()
+                return
+        sys.stdout.flush()
+        try:
+            shutil.copyfileobj(fin, sys.stdout.buffer, FILE_COPY_CHUNK_SIZE)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            silence_stdout()  # e.g. piped into head
+
+
+def print_bundled_help(args: list) -> bool:
+    """Print --usage, --help or --manual from the bundled help files.
+
+    This fast path avoids building the argument parser. The help files
+    (help.usage.txt etc.) are created by the scripts in scripts/ from the
+    output of the program when piped, with program name jami-commander.
+    So they are only used if the output would be identical: the output is
+    not a terminal, the program is called as jami-commander, COLUMNS is
+    not set and the help file belongs to this version.
+
+    Returns True if the help was printed.
+    """
+    name = BUNDLED_HELP.get(tuple(args))
+    if (
+        name is None
+        or os.path.basename(sys.argv[0]) != PROG_WITHOUT_EXT
+        or "COLUMNS" in os.environ
+        or sys.stdout.isatty()
+    ):
+        return False
+    try:
+        with open(
+            os.path.join(os.path.dirname(__file__), name), encoding="utf-8"
+        ) as f:
+            text = f.read()
+    except OSError:
+        return False
+    if f"version {VERSIONNR} {VERSION}." not in " ".join(text.split()):
+        return False  # help file is outdated
+    sys.stdout.write(text)
+    sys.stdout.flush()
+    return True
+
+
+def main_inner(
+    argv: Union[None, list] = None
+) -> None:  # noqa: C901 # ignore mccabe if-too-complex
+    """Run the program.
+
+    Function signature identical to main().
+    Please see main().
+
+    Returns None. Returns nothing.
+
+    Raises exception if an error is detected. Many exceptions are
+        possible. One of them is: JamiCommanderError.
+        Sets global state to communicate errors.
+
+    """
+    if argv:
+        sys.argv = argv
+    # prepare the global state
+    global gs
+    gs = GlobalState()
+    global SEP
+    if print_bundled_help(sys.argv[1:]):
+        return 0
+    ap = get_parser()
     gs.pa = ap.parse_args()
     # wrap and indent: https://towardsdatascience.com/6-fancy-built-in-text-
     #                  wrapping-techniques-in-python-a78cc57c2566
@@ -2027,6 +5562,8 @@ def main_inner(
         coff = ""
         eon = ""
         eoff = ""
+    import textwrap
+
     if gs.pa.usage:
         print(textwrap.fill(ap.description, width=term_width))
         print("")
@@ -2055,7 +5592,8 @@ Print manual.
 Print README.md file.
 <-d>, <--debug>
 Print debug information.
-<--log-level> DEBUG|INFO|WARNING|ERROR|CRITICAL [DEBUG|INFO|WARNING|ERROR|CRITICAL ...]
+<--log-level> DEBUG|INFO|WARNING|ERROR|CRITICAL \
+[DEBUG|INFO|WARNING|ERROR|CRITICAL ...]
 Set the log level(s).
 <--verbose>
 Set the verbosity level.
@@ -2079,12 +5617,17 @@ Add member(s) to one or multiple swarm conversations.
 Remove member(s) from one or multiple swarm conversations.
 <-a> ACCOUNTID, <--account> ACCOUNTID
 Connect to and use the specified account.
-<-c> CONVERSATIONID [CONVERSATIONID ...], <--conversations> CONVERSATIONID [CONVERSATIONID ...]
+<-c> CONVERSATIONID [CONVERSATIONID ...], <--conversations> CONVERSATIONID \
+[CONVERSATIONID ...]
 Specify one or multiple swarm conversations.
 <-m> TEXT [TEXT ...], <--message> TEXT [TEXT ...]
 Send one or multiple text messages.
 <-f> FILE [FILE ...], <--file> FILE [FILE ...]
 Send one or multiple files (e.g. PDF, DOC, MP4).
+<--tmp-dir> DIRECTORY
+Set the directory for temporary files.
+<--file-stdin-mode> AUTO|TMPFILE|MEMFD
+Select how a file piped in with '-f -' is handed to Jami.
 <-w>, <--html>
 Send message as format "HTML".
 <-z>, <--markdown>
@@ -2095,6 +5638,50 @@ Send message as format "CODE".
 Send message after emojizing.
 <--split> SEPARATOR
 Split message text into multiple Jami messages.
+<--max-message-size> BYTES
+Set the maximum size of a text message.
+<--stream-flush-ms> MILLISECONDS
+Merge streamed lines into fewer messages.
+<--stream-max-bytes> BYTES
+Set the maximum size of a merged streamed message.
+<--parallel> N
+Set the maximum number of concurrent sends.
+<--send-report>
+Print a result table after sending.
+<--wait-transfers> [TIMEOUT]
+Wait until sent files are transferred.
+<--batch> MANIFEST_FILE
+Send many messages and files in one go.
+<--serve> SOCKET
+Run as server, accepting requests on a Unix socket.
+<--listen> [NEVER|FOREVER]
+Print received messages.
+<--listen-checkpoint> [FILE]
+Continue listening where the previous run stopped.
+<--archive> [DB]
+Store received messages in an SQLite database.
+<--search> QUERY
+Search the messages stored by --archive.
+<--search-limit> N
+Set the maximum number of messages printed by --search.
+<--download-media> [DIR]
+Download the files received while listening.
+<--download-quota> BYTES
+Set the maximum size of the downloaded files.
+<--download-parallel> N
+Set the maximum number of concurrent downloads.
+<--download-parallel-conversation> N
+Set the maximum number of concurrent downloads per conversation.
+<--export-history> FILE
+Export the message history of conversations.
+<--export-page-size> N
+Set the number of messages fetched at once by --export-history.
+<--dedupe> [INDEX_FILE]
+Do not send the same file to the same conversation again.
+<--dedupe-ttl> SECONDS
+Set how long --dedupe remembers a sent file.
+<--dedupe-action> SKIP|REFERENCE
+Select what --dedupe does with a file already sent.
 <--separator> SEPARATOR
 Set a custom separator used for certain print outs.
 <-o> TEXT|JSON, <--output> TEXT|JSON
@@ -2133,8 +5720,7 @@ Print version information or check for updates.
             "It can send one or multiple message to one or "
             "multiple Jami conversations. "
             "Arbitrary files can be sent as well. "
-            "Listen and receiving is not yet implemented. "
-            "Please write a PR for listening. "
+            "It can listen and print the messages received. "
             "End-to-end encryption is enabled by default "
             "and cannot be turned off.  ─── "
             "Bundling several actions together into a single call to "
@@ -2153,36 +5739,7 @@ Print version information or check for updates.
         print("")
         ap.print_help(file=None)  # ap.print_usage() is included
         return 0
-    if gs.pa.readme:
-        # Todo
-        exedir = os.path.dirname(os.path.realpath(__file__))
-        readme = exedir + "/../" + "README.md"
-        readme_primary = readme
-        foundpath = None
-        if os.path.exists(readme):
-            foundpath = readme
-            print(f"Found local README.md here: {readme}")
-        else:
-            readme = exedir + "/" + "README.md"
-            if os.path.exists(readme):
-                foundpath = readme
-                print(f"Found local README.md here: {readme}")
-        if foundpath is None:
-            print(
-                "Sorry, README.md not found locally "
-                f"in installation directory {readme_primary}."
-            )
-            print(f"Hence downloading it from {README_FILE_RAW_URL}.")
-            notused, foundpath = tempfile.mkstemp()
-            urllib.request.urlretrieve(README_FILE_RAW_URL, foundpath)
-        try:
-            with open(foundpath, "r+") as f:
-                text = f.read()
-            print(f"{text}")
-        except Exception:  # (BrokenPipeError, IOError):
-            # print("BrokenPipeError caught", file=sys.stderr)
-            pass
-        return 0
+    import logging
 
     logging.basicConfig(  # initialize root logger, a must
         format="{asctime}: {levelname:>8}: {name:>16}: {message}", style="{"
@@ -2226,14 +5783,31 @@ Print version information or check for updates.
             )
             gs.warn_count += 1
 
+    if gs.pa.readme:
+        readme = find_readme()
+        if readme is None:
+            try:
+                readme = fetch_readme()
+            except Exception as e:
+                gs.err_count += 1
+                gs.log.error(
+                    "E261: "
+                    "README.md is neither installed nor cached and "
+                    f"could not be downloaded from {README_FILE_RAW_URL}. "
+                    f"({e})"
+                )
+                return 1
+        page_file(readme)
+        return 0
+
     SEP = bytes(gs.pa.separator, "utf-8").decode("unicode_escape")
     gs.log.debug(
         f'Separator is set to "{SEP}" of '
         f"length {len(SEP)}. E.g. Col1{SEP}Col2."
     )
     initial_check_of_args()
-    # Todo: check_download_media_dir()
     try:
+        check_download_media_dir()
         check_arg_files_readable()
     except Exception as e:
         gs.log.error(e)  # already has Exxx: unique error number
@@ -2249,25 +5823,22 @@ Print version information or check for updates.
             version()  # continue execution
         else:
             check_version()  # continue execution
-        if not (
-            gs.send_action
-            # todo
-            or gs.accountmgmt_action
-            or gs.conversation_action
-            or gs.listen_action
-            # or gs.pa.listen != LISTEN_DEFAULT
-            # or gs.pa.tail != TAIL_UNUSED_DEFAULT
-            # or gs.pa.verify
-            or gs.setget_action
-        ):
+        if not (has_jami_actions() or gs.search_action):
             gs.log.debug("Only --version. Print and quit.")
             return  # just version, quit
 
+    if gs.search_action:
+        action_search()
+        if not has_jami_actions():
+            return  # search does not need the Jami daemon, quit
+
     create_pid_file()
 
     gs.log.debug(f'Python version is "{sys.version}"')
     gs.log.debug(f'Stdin pipe is assigned to "{gs.stdin_use}".')
 
+    import asyncio
+
     try:
         asyncio.run(async_main())  # do everything in the event loop
         # the next can be reached on success or failure
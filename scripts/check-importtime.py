@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# - runs `jami_commander.py` with `--version print`, `--usage`, `--help`
+#   under `python -X importtime`
+# - runs `--usage`, `--help`, `--manual` again like the installed
+#   `jami-commander` entry point does, i.e. with argv0 `jami-commander`,
+#   piped and without COLUMNS, which takes the fast path of the bundled
+#   help files (print_bundled_help())
+# - fails if one of them imports a module that must be loaded lazily
+#   (dbus, gi, markdown, emoji, urllib.request, the controller, ...)
+# - fails if an entry point run builds the argument parser or
+#   prints something else than the argument parser prints, i.e. if the
+#   bundled help file is outdated
+# - fails if a bundled help file contains the home directory of the user
+#   who created it, the help files are the same for every user
+# - fails if the total import time of one of them exceeds the budget
+# - usage: scripts/check-importtime.py [BUDGET_MS]
+#   the budget defaults to 120 milliseconds, measured best of 3 runs
+#   to even out noise
+
+
+import os
+import subprocess
+import sys
+from os.path import isdir
+
+BUDGET_MS = 120
+RUNS = 3
+
+COMMANDS = [
+    ["--version", "print"],
+    ["--usage"],
+    ["--help"],
+]
+
+# run like the entry point, must be served from these bundled help files
+ENTRY_POINT_COMMANDS = {
+    "--usage": "help.usage.txt",
+    "--help": "help.help.txt",
+    "--manual": "help.manual.txt",
+}
+
+# what the console script generated by pip for setup.cfg's entry point
+# does, plus a report whether the argument parser was built
+PARSER_BUILT = "parser built: "
+ENTRY_POINT = f"""
+import sys
+sys.argv[0] = "jami-commander"
+import jami_commander.jami_commander as jc
+try:
+    rc = jc.main()
+finally:
+    print("{PARSER_BUILT}" + str(jc.parser is not None), file=sys.stderr)
+sys.exit(rc)
+"""
+
+# these must only be imported when they are really needed
+LAZY_MODULES = [
+    "asyncio",
+    "dbus",
+    "gi",
+    "emoji",
+    "markdown",
+    "urllib.request",
+    "importlib.metadata",
+    "hashlib",
+    "jami_commander.controller",
+]
+# ... and these are not needed either to print a bundled help file;
+# textwrap is not listed, traceback imports it
+ENTRY_POINT_LAZY_MODULES = LAZY_MODULES + [
+    "argparse",
+    "logging",
+    "subprocess",
+]
+
+if isdir("jami_commander"):
+    root = "."
+elif isdir("../jami_commander"):
+    root = ".."
+else:
+    print(
+        "Error: directory jami_commander not found, neither in "
+        "local nor in parent directory."
+    )
+    sys.exit(1)
+
+
+def importtime(args, entry_point=False, columns=None):
+    """Return (total import time in microseconds, set of modules, stdout,
+    True if the argument parser was built)"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    env.pop("COLUMNS", None)
+    if columns is not None:
+        env["COLUMNS"] = columns  # bypasses the bundled help files
+    if entry_point:
+        cmd = ["-c", ENTRY_POINT]
+    else:
+        cmd = ["-m", "jami_commander.jami_commander"]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + cmd + args,
+        cwd=root,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        env=env,
+    )
+    total = 0
+    modules = set()
+    built = PARSER_BUILT + "True" in result.stderr.splitlines()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.add(name.strip())
+        if not name.startswith("  "):  # top level import
+            total += int(cumulative)
+    return total, modules, result.stdout, built
+
+
+def check(label, args, entry_point=False, helpfile=None):
+    """Print the result of one command, return True if it failed"""
+    runs = [importtime(args, entry_point) for _ in range(RUNS)]
+    best = min(run[0] for run in runs)
+    modules = set.union(*(run[1] for run in runs))
+    lazy = ENTRY_POINT_LAZY_MODULES if entry_point else LAZY_MODULES
+    eager = [m for m in lazy if m in modules]
+    status = "ok"
+    if eager:
+        status = f"FAILED, imports {', '.join(eager)}"
+    elif entry_point and any(run[3] for run in runs):
+        status = f"FAILED, {helpfile} not used, outdated?"
+    elif helpfile is not None and os.path.expanduser("~") in runs[0][2]:
+        status = f"FAILED, {helpfile} contains the home directory"
+    elif helpfile is not None and runs[0][2] != parser_output(args):
+        status = f"FAILED, {helpfile} differs, regenerate it"
+    elif best > budget * 1000:
+        status = f"FAILED, over budget of {budget} ms"
+    print(f"{label:24} {best / 1000:8.1f} ms    {status}")
+    return status != "ok"
+
+
+def parser_output(args):
+    """Return the help as printed by the argument parser
+
+    The bundled help files are created the same way, see
+    scripts/create-help-*.sh.
+    """
+    return importtime(args, entry_point=True, columns="80")[2]
+
+
+budget = int(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS
+failed = False
+for args in COMMANDS:
+    failed |= check(" ".join(args), args)
+for arg, helpfile in ENTRY_POINT_COMMANDS.items():
+    failed |= check(f"jami-commander {arg}", [arg], True, helpfile)
+
+sys.exit(1 if failed else 0)
@@ -1,4 +1,5 @@
 #!/usr/bin/env bash
+# COLUMNS=80 bypasses the bundled help file, i.e. the file being created
 PATH=".:jami_commander/:$PATH" &&
-    jc --help >help.help.txt
-echo "help.help.txt is $(wc -l help.help.txt | cut -d ' ' -f1) lines long"
+    COLUMNS=80 jami-commander --help >jami_commander/help.help.txt
+echo "help.help.txt is $(wc -l jami_commander/help.help.txt | cut -d ' ' -f1) lines long"
@@ -1,7 +1,8 @@
 #!/usr/bin/env bash
+# COLUMNS=80 bypasses the bundled help file, i.e. the file being created
 PATH=".:jami_commander/:$PATH" &&
-    jami-commander --manual >help.manual.txt
-echo "help.manual.txt is $(wc -l help.manual.txt | cut -d ' ' -f1) lines long"
+    COLUMNS=80 jami-commander --manual >jami_commander/help.manual.txt
+echo "help.manual.txt is $(wc -l jami_commander/help.manual.txt | cut -d ' ' -f1) lines long"
 
 # PATH=".:jami_commander/:$PATH" &&
 #     old_width=$(stty size | cut -d' ' -f2-) &&
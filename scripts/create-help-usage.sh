@@ -1,4 +1,5 @@
 #!/usr/bin/env bash
+# COLUMNS=80 bypasses the bundled help file, i.e. the file being created
 PATH=".:jami_commander/:$PATH" &&
-    jc --usage >help.usage.txt
-echo "help.usage.txt is $(wc -l help.usage.txt | cut -d ' ' -f1) lines long"
+    COLUMNS=80 jami-commander --usage >jami_commander/help.usage.txt
+echo "help.usage.txt is $(wc -l jami_commander/help.usage.txt | cut -d ' ' -f1) lines long"
@@ -13,3 +13,6 @@ if ! [ -f "$FN" ]; then
     fi
 fi
 isort "$FN" && flake8 "$FN" && python3 -m black --line-length 79 "$FN"
+# check import time and the bundled help files used by the installed
+# jami-commander entry point, see check-importtime.py
+python3 "$(dirname -- "$0")/check-importtime.py"
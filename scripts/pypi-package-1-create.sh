@@ -18,6 +18,7 @@
 
 # prepare-commit, including version increase in setup.cfg
 rm dist/* # cleanup
+cp README.md jami_commander/README.md # shipped as package data, see --readme
 python3 -m build
 ls -l dist/*
 # publish
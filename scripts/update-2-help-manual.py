@@ -10,6 +10,7 @@
 # - runs a diff on the previous and new README.md to show the changes
 
 
+import os
 import re
 import shutil
 import subprocess
@@ -22,10 +23,12 @@ from os.path import isfile
 now = datetime.now()
 date_string = now.strftime("%Y%m%d-%H%M%S")
 
-helpfile = "help.manual.txt"
+# the help file is shipped as package data, see print_bundled_help()
+helpfile = "jami_commander/help.manual.txt"
 filename = "README.md"
 # executable = "jami_commander/jami-commander"
-executable = "jc"
+# the name of the executable is part of the help text
+executable = "jami-commander"
 
 if isfile(filename) and access(filename, R_OK):
     # so that subprocess can execute it without PATH
@@ -45,9 +48,12 @@ backupfile = filename + "." + date_string
 shutil.copy2(filename, backupfile)
 
 with open(helpfile, "w") as f:
-    # tty size defaults to 80 columns
+    # tty size defaults to 80 columns,
+    # COLUMNS=80 bypasses the bundled help file, i.e. the file being created
     bashCmd = [executable, "--manual"]
-    process = subprocess.Popen(bashCmd, stdout=f)
+    process = subprocess.Popen(
+        bashCmd, stdout=f, env=dict(os.environ, COLUMNS="80")
+    )
     _, error = process.communicate()
     if error:
         print(error)
@@ -95,3 +101,6 @@ if error:
 else:
     output = output.decode("utf-8").strip("\n")
     print(f"Diff is:\n{output}")
+
+# README.md is also shipped as package data, see --readme
+shutil.copy2(filename, filename.replace("README.md", "jami_commander/README.md"))
@@ -65,20 +65,33 @@ with open(helpfile, "r+") as f:
     helptext = f.read()
     print(f"Length of new {helpfile} file is: {len(helptext)}")
 
+
+def wrap_long_line(line, width=79):
+    """Split line with backslash-newline continuations.
+
+    Inside the string literal a backslash at the end of a line joins the
+    lines again, so the help text is unchanged, but the source stays
+    within width characters.
+    """
+    parts = []
+    while len(line) > width:
+        cut = line.rfind(" ", 0, width - 1) + 1  # space stays in front
+        if cut <= 0:
+            break
+        parts.append(line[:cut] + "\\")
+        line = line[cut:]
+    parts.append(line)
+    return "\n".join(parts)
+
+
+helptext = "\n".join(wrap_long_line(line) for line in helptext.split("\n"))
+
 with open(filename, "r+") as f:
     text = f.read()
     print(f"Length of {filename} before: {len(text)}")
     text = re.sub(
         r'help_help_pre = """\n[\s\S]*?"""',
-        r'help_help_pre = """\n'
-        + helptext.translate(
-            str.maketrans(
-                {
-                    "\\": r"\\",
-                }
-            )
-        )
-        + '"""',
+        lambda m: 'help_help_pre = """\n' + helptext + '"""',
         text,
     )
 
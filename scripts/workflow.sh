@@ -104,7 +104,7 @@ done
 PS3='Please enter your choice: '
 OPT1="git add dist/ # must do this! commit -a will not include them"
 OPT2="git status # what is the current status"
-OPT3="git add VERSION help.help.txt help.manual.txt help.usage.txt jami_commander/jami_commander.py  setup.cfg"
+OPT3="git add VERSION jami_commander/help.help.txt jami_commander/help.manual.txt jami_commander/help.usage.txt jami_commander/README.md jami_commander/jami_commander.py  setup.cfg"
 OPTC="Continue"
 OPTQ="Quit"
 options=("$OPT1" "$OPT2" "$OPT3" "$OPTC" "$OPTQ")